@@ -0,0 +1,205 @@
+"""
+Archive of old chat history. Messages older than MESSAGE_ARCHIVE_AFTER_DAYS are moved, board by board, into
+MessageArchive segments of up to MESSAGE_ARCHIVE_SEGMENT_SIZE compressed messages, which keeps the Message table
+and its indexes small. The history of a board keeps reading them (see MessageCursorPagination), archived messages
+are read only and are not searchable.
+The last message of a board stays in the Message table for inboxes. Archiving takes every message of a board
+older than a date and restoring gives back every message newer than a date, so the messages left in the table
+are always newer than the archived ones of their board.
+Archiving is not a deletion for clients: the changes feed gets no tombstone and the history keeps the messages.
+"""
+import zlib
+from datetime import datetime
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Q, Subquery
+from .models import Board, Message, MessageArchive, SearchKind
+from .renderers import dumps, loads
+from .search import index_documents
+
+COMPRESSION_LEVEL = 6
+
+
+def encode_messages(messages):
+    rows = [
+        [message.id, message.sent_by_id, message.content, message.date_sent.isoformat(), message.updated_at.isoformat()]
+        for message in messages
+    ]
+    return zlib.compress(dumps(rows).encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decode_segment(segment):
+    # Messages of the segment, oldest first, as if loaded from the database but flagged as archived
+    messages = []
+    for message_id, sent_by_id, content, date_sent, updated_at in loads(zlib.decompress(bytes(segment.data))):
+        message = Message(
+            id=message_id, board_id=segment.board_id, sent_by_id=sent_by_id, content=content,
+            date_sent=datetime.fromisoformat(date_sent), updated_at=datetime.fromisoformat(updated_at),
+        )
+        message._state.adding = False
+        message._state.db = segment._state.db
+        message.archived = True
+        messages.append(message)
+    return messages
+
+
+def build_segment(board_id, messages, segment=None):
+    # messages are sorted from oldest to newest
+    ids = [message.id for message in messages]
+    segment = segment or MessageArchive(board_id=board_id)
+    segment.first_date, segment.first_id = messages[0].date_sent, messages[0].id
+    segment.last_date, segment.last_id = messages[-1].date_sent, messages[-1].id
+    segment.min_id, segment.max_id = min(ids), max(ids)
+    segment.count = len(messages)
+    segment.data = encode_messages(messages)
+    return segment
+
+
+def archive_messages(before, segment_size=None, board_ids=None):
+    """
+    Move the messages sent before the date into archive segments. Returns the number of archived messages.
+    """
+    segment_size = segment_size or settings.MESSAGE_ARCHIVE_SEGMENT_SIZE
+    boards = Board.objects.filter(id__in=Message.objects.filter(date_sent__lt=before).values('board_id'))
+    if board_ids is not None:
+        boards = boards.filter(id__in=board_ids)
+
+    archived = 0
+    for board_id, last_message_id in boards.values_list('id', 'last_message_id'):
+        messages = Message.objects.filter(board_id=board_id, date_sent__lt=before).exclude(id=last_message_id).order_by('date_sent', 'id')
+        while True:
+            with transaction.atomic():
+                batch = list(messages[:segment_size])
+                if not batch:
+                    break
+                build_segment(board_id, batch).save()
+                # Not deleted for clients: receivers of messages_deleted remove their search postings and reset the
+                # last message of the board (never archived, so left as is), without writing tombstones
+                Message.objects.filter(id__in=[message.id for message in batch]).delete(archived=True)
+            archived += len(batch)
+    return archived
+
+
+def compact_archives(segment_size=None, board_ids=None):
+    """
+    Merge the consecutive segments of a board that fit in one segment, successive archiving runs leave partial ones.
+    Returns the number of segments removed.
+    """
+    segment_size = segment_size or settings.MESSAGE_ARCHIVE_SEGMENT_SIZE
+    boards = MessageArchive.objects.filter(count__lt=segment_size)
+    if board_ids is not None:
+        boards = boards.filter(board_id__in=board_ids)
+
+    removed = 0
+    for board_id in boards.values_list('board_id', flat=True).distinct().order_by():
+        groups, group, total = [], [], 0
+        segments = MessageArchive.objects.filter(board_id=board_id).order_by('last_date', 'last_id').values_list('id', 'count')
+        for segment_id, count in segments:
+            if group and total + count > segment_size:
+                groups.append(group)
+                group, total = [], 0
+            group.append(segment_id)
+            total += count
+        groups.append(group)
+
+        for group in groups:
+            if len(group) < 2:
+                continue
+            with transaction.atomic():
+                loaded = MessageArchive.objects.in_bulk(group)
+                messages = [message for segment_id in group for message in decode_segment(loaded[segment_id])]
+                build_segment(board_id, messages).save()
+                MessageArchive.objects.filter(id__in=group).delete()
+            removed += len(group) - 1
+    return removed
+
+
+def restore_messages(since=None, board_ids=None):
+    """
+    Move the archived messages sent since the date (all of them without date) back to the Message table.
+    Returns the number of restored messages.
+    """
+    segments = MessageArchive.objects.all()
+    if since is not None:
+        segments = segments.filter(last_date__gte=since)
+    if board_ids is not None:
+        segments = segments.filter(board_id__in=board_ids)
+
+    restored, boards = 0, set()
+    for segment_id in segments.order_by('board_id', '-last_date', '-last_id').values_list('id', flat=True):
+        with transaction.atomic():
+            segment = MessageArchive.objects.select_for_update().get(id=segment_id)
+            messages = decode_segment(segment)
+            kept = [message for message in messages if since is not None and message.date_sent < since]
+            back = [message for message in messages if since is None or message.date_sent >= since]
+
+            dates = {message.id: (message.date_sent, message.updated_at) for message in back}
+            for message in back:
+                message._state.adding = True
+            Message.objects.bulk_create(back)
+            # bulk_create() applies auto_now_add and auto_now, put the original dates back
+            for message in back:
+                message.date_sent, message.updated_at = dates[message.id]
+            Message.objects.bulk_update(back, ['date_sent', 'updated_at'])
+            index_documents(SearchKind.MESSAGE, back)
+
+            if kept:
+                build_segment(segment.board_id, kept, segment).save()
+            else:
+                segment.delete()
+        restored += len(back)
+        boards.add(segment.board_id)
+
+    # Boards whose every message was archived get their last message back
+    latest = Message.objects.filter(board=OuterRef('pk')).order_by('-date_sent', '-id').values('id')[:1]
+    Board.objects.filter(id__in=boards, last_message__isnull=True).update(last_message=Subquery(latest))
+    return restored
+
+
+def read_archive(segments, before=None, after=None, limit=None):
+    """
+    Archived messages of the segments queryset. Newest first before the (date_sent, id) position before,
+    or oldest first after the position after. At most limit messages, all of them without limit.
+    """
+    if after is not None:
+        date_sent, message_id = after
+        segments = segments.filter(Q(last_date__gt=date_sent) | Q(last_date=date_sent, last_id__gt=message_id))
+        segments = segments.order_by('last_date', 'last_id')
+    else:
+        if before is not None:
+            date_sent, message_id = before
+            segments = segments.filter(Q(first_date__lt=date_sent) | Q(first_date=date_sent, first_id__lt=message_id))
+        segments = segments.order_by('-last_date', '-last_id')
+
+    # Pick the segments holding enough messages before loading their data.
+    # The first one holds at least one message on the right side of the position, every next one is complete.
+    selected, available = [], 0
+    for segment_id, count in (segments.values_list('id', 'count')[:limit] if limit else segments.values_list('id', 'count')):
+        selected.append(segment_id)
+        available += count if len(selected) > 1 else 1
+        if limit and available >= limit:
+            break
+    if not selected:
+        return []
+
+    loaded = MessageArchive.objects.select_related('board').in_bulk(selected)
+    messages = []
+    for segment_id in selected:
+        segment = loaded[segment_id]
+        segment_messages = decode_segment(segment)
+        for message in segment_messages:
+            message.board = segment.board
+        if after is not None:
+            messages += [message for message in segment_messages if (message.date_sent, message.id) > after]
+        else:
+            messages += [message for message in reversed(segment_messages) if before is None or (message.date_sent, message.id) < before]
+    return messages[:limit] if limit else messages
+
+
+def find_archived_message(message_id):
+    for segment in MessageArchive.objects.select_related('board').filter(min_id__lte=message_id, max_id__gte=message_id):
+        for message in decode_segment(segment):
+            if message.id == message_id:
+                message.board = segment.board
+                return message
+    return None
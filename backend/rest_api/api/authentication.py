@@ -0,0 +1,153 @@
+"""
+JWT authentication without database access. Access tokens carry the fields of the user that requests rely on
+(see add_user_claims), the request user is built from them. Claims are trusted as long as the user is unchanged: tokens
+carry the version of the user, kept in the shared cache and bumped when the user is saved or deleted, a token of
+an older version gets the user from the cache below. Refreshing a token reads the user again and fails for
+inactive users.
+Views that need the complete user get it with get_full_user(), from a bounded per-process LRU whose entries are
+only used while the shared version of their user is the one they were loaded with.
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .models import TheUser
+
+# Fields of the user copied into tokens, besides its id
+USER_CLAIMS = ['email', 'first_name', 'last_name', 'is_admin']
+# Claim holding the version of the user the other claims were copied from
+VERSION_CLAIM = 'user_version'
+VERSION_KEY_PREFIX = 'auth_user_version:'
+
+
+def get_user_version(user_id):
+    return cache.get(f'{VERSION_KEY_PREFIX}{user_id}', 0)
+
+
+def bump_user_version(user_id):
+    # Versions do not expire, a version going back to 0 would make older tokens and entries valid again
+    key = f'{VERSION_KEY_PREFIX}{user_id}'
+    if not cache.add(key, 1, timeout=None):
+        cache.incr(key)
+
+
+def add_user_claims(token, user, version=None):
+    # version is read before loading the user when the caller can, so that a save in between is not missed
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    token[VERSION_CLAIM] = get_user_version(user.pk) if version is None else version
+    return token
+
+
+def build_user(values):
+    # TheUser as if loaded from the database with these fields only, the others are loaded on access
+    names = [field.attname for field in TheUser._meta.concrete_fields if field.attname in values]
+    return TheUser.from_db(None, names, [values[name] for name in names])
+
+
+class UserCache:
+    """
+    Least recently used users by id. An entry is used while the version of its user in the shared cache is the
+    one it was loaded with, so that changes made by any process show up right away (see invalidate), and for
+    timeout seconds at most. Every get() returns a new instance, requests never share a user object.
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Bumped by invalidations, a user loaded meanwhile is not stored
+        self.generation = 0
+        self.fields = [field.attname for field in TheUser._meta.concrete_fields]
+
+    def get(self, user_id):
+        # Read before the user, a save in between makes the entry stale
+        version = get_user_version(user_id)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now and entry[1] == version:
+                self.entries.move_to_end(user_id)
+                return build_user(entry[2])
+            generation = self.generation
+
+        values = TheUser.objects.filter(id=user_id).values(*self.fields).first()
+        if values is None:
+            return None
+        with self.lock:
+            if generation == self.generation:
+                self.entries[user_id] = (now + self.timeout, version, values)
+                self.entries.move_to_end(user_id)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return build_user(values)
+
+    def invalidate(self, user_id):
+        # Reaches the caches of every process through the shared version
+        bump_user_version(user_id)
+        with self.lock:
+            self.entries.pop(user_id, None)
+            self.generation += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1
+
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def get_full_user(user):
+    # Complete and up to date version of a request user, from the cache
+    return user_cache.get(user.pk) or user
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication building the request user from the claims of the access token instead of loading it.
+    Tokens issued without the claims, or before the user changed, fall back to the user cache.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        claims_version = validated_token.get(VERSION_CLAIM)
+        if all(claim in validated_token for claim in USER_CLAIMS) and claims_version == get_user_version(user_id):
+            values = {claim: validated_token[claim] for claim in USER_CLAIMS}
+            return build_user({api_settings.USER_ID_FIELD: user_id, 'is_active': True, **values})
+
+        user = user_cache.get(user_id)
+        if user is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+
+class UserClaimsRefreshToken(RefreshToken):
+    @property
+    def access_token(self):
+        # New access tokens get the current fields of the user, which must still be active
+        user_id = self.payload.get(api_settings.USER_ID_CLAIM)
+        version = get_user_version(user_id)
+        user = TheUser.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        add_user_claims(self, user, version)
+        return super().access_token
+
+
+class ClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = UserClaimsRefreshToken
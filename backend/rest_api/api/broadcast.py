@@ -0,0 +1,139 @@
+"""
+Channel layer sends to many groups at once. Each group_send is a round trip to Redis, sending them one after
+the other makes a message to a board of hundreds of members wait for hundreds of round trips.
+group_send_many() keeps up to BROADCAST_CONCURRENCY sends in flight. Sync code (views, signals) hands its sends
+to the broadcaster, an event loop in a background thread, once the transaction is committed: the request that
+created the message does not wait for them.
+Card events are coalesced: changes of a card within CARD_EVENT_WINDOW seconds end up in one frame, or in none
+when the card is back to where it was.
+"""
+import asyncio
+import threading
+from concurrent.futures import wait
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from .metrics import metrics
+
+
+def latest_message_sends(message_data, user_ids):
+    # One event per inbox, see MessageHomeConsumer
+    event = {"type": "latest_message_update", "message": message_data}
+    return [(f"user_{user_id}_latest_messages", event) for user_id in user_ids]
+
+
+async def group_send_many(sends, channel_layer=None):
+    """
+    Send the (group, event) pairs, a failed send does not stop the others. Returns the number of failed sends.
+    """
+    channel_layer = channel_layer or get_channel_layer()
+    failed = 0
+    for start in range(0, len(sends), settings.BROADCAST_CONCURRENCY):
+        results = await asyncio.gather(
+            *(channel_layer.group_send(group, event) for group, event in sends[start:start + settings.BROADCAST_CONCURRENCY]),
+            return_exceptions=True,
+        )
+        failed += sum(isinstance(result, Exception) for result in results)
+    metrics.increment('broadcast.sends', len(sends))
+    if failed:
+        metrics.increment('broadcast.errors', failed)
+    return failed
+
+
+class Broadcaster:
+    """
+    Runs group_send_many() for sync code on an event loop of its own, started on first use.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.loop = None
+        self.lock = threading.Lock()
+        # Sends submitted and not done yet, see wait()
+        self.futures = set()
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                threading.Thread(target=self.loop.run_forever, name=self.name, daemon=True).start()
+            return self.loop
+
+    def submit(self, sends):
+        # Returns a concurrent.futures.Future of the number of failed sends
+        future = asyncio.run_coroutine_threadsafe(group_send_many(sends), self.get_loop())
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self.forget)
+        return future
+
+    def forget(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def submit_on_commit(self, build_sends):
+        # build_sends() runs after the commit of the current transaction, nothing is sent if it is rolled back
+        transaction.on_commit(lambda: self.submit(build_sends()))
+
+    def wait(self, timeout=None):
+        # Wait for the sends submitted so far (tests, shutdown)
+        with self.lock:
+            futures = list(self.futures)
+        wait(futures, timeout)
+
+
+broadcaster = Broadcaster('broadcast')
+
+
+class CardEventCoalescer:
+    """
+    Status changes of cards, sent as one card_status_update per card and per CARD_EVENT_WINDOW by the broadcaster.
+    """
+
+    def __init__(self, broadcaster):
+        self.broadcaster = broadcaster
+        self.lock = threading.Lock()
+        # card id -> [(board_id, status) before the first change, (board_id, status) after the last one]
+        self.pending = {}
+        self.scheduled = False
+        self.flush_lock = None
+
+    def add(self, card_id, before, after):
+        metrics.increment('card_events.received')
+        with self.lock:
+            if card_id in self.pending:
+                self.pending[card_id][1] = after
+            else:
+                self.pending[card_id] = [before, after]
+            if self.scheduled:
+                return
+            self.scheduled = True
+        loop = self.broadcaster.get_loop()
+        loop.call_soon_threadsafe(loop.call_later, settings.CARD_EVENT_WINDOW, lambda: loop.create_task(self.flush()))
+
+    async def flush(self):
+        if self.flush_lock is None:
+            self.flush_lock = asyncio.Lock()
+        # Flushes run one after the other, an event of a card never overtakes an older one
+        async with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, {}
+                self.scheduled = False
+            sends = [
+                (f"board_{board_id}", {
+                    "type": "card_status_update",
+                    "board": board_id,
+                    "message": {"card_id": card_id, "new_status": status}
+                })
+                for card_id, (before, (board_id, status)) in pending.items() if before != (board_id, status)
+            ]
+            metrics.increment('card_events.sent', len(sends))
+            if sends:
+                await group_send_many(sends)
+
+    def wait(self, timeout=None):
+        # Send what is pending right away and wait for it (tests, shutdown)
+        asyncio.run_coroutine_threadsafe(self.flush(), self.broadcaster.get_loop()).result(timeout)
+
+
+card_events = CardEventCoalescer(broadcaster)
@@ -0,0 +1,89 @@
+import time
+from hashlib import md5
+from uuid import uuid4
+from django.core.cache import cache
+from django.db import transaction
+
+
+# Serialized board lists are cached per user and query string. Their key contains a generation of every board
+# in the list, changing the generation of a board (signals) makes the lists that contain it miss the cache.
+BOARD_LIST_TIMEOUT = 60 * 10
+# Visible board ids of each user, dropped when the user joins or leaves a board
+BOARD_IDS_TIMEOUT = 60 * 60
+# Stampede protection: a single request rebuilds a missing entry while the others wait for it
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2
+LOCK_POLL = 0.05
+
+
+def board_generation_key(board_id):
+    return f"board_generation:{board_id}"
+
+
+def board_ids_key(user):
+    return "board_ids:admin" if user.is_admin else f"board_ids:{user.id}"
+
+
+def invalidate_boards(board_ids=(), user_ids=(), admins=False):
+    """
+    Make the cached lists that contain the given boards miss, and forget the visible boards of the given users
+    (and of admins). Done right away and again once the transaction commits, so that a list rebuilt from
+    not yet committed data does not stay in cache.
+    """
+    board_ids, user_ids = set(board_ids), set(user_ids)
+    if not board_ids and not user_ids and not admins:
+        return
+
+    def invalidate():
+        if board_ids:
+            cache.set_many({board_generation_key(board_id): uuid4().hex for board_id in board_ids}, timeout=None)
+        keys = [f"board_ids:{user_id}" for user_id in user_ids]
+        if admins:
+            keys.append("board_ids:admin")
+        if keys:
+            cache.delete_many(keys)
+
+    invalidate()
+    transaction.on_commit(invalidate)
+
+
+def get_board_list_key(request, board_ids):
+    # The generation of a board is created the first time it is needed
+    keys = [board_generation_key(board_id) for board_id in sorted(board_ids)]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # add() keeps a generation set meanwhile by an invalidation
+        for key in missing:
+            cache.add(key, uuid4().hex, timeout=None)
+        generations.update(cache.get_many(missing))
+    fingerprint = f"{request.user.id}|{request.user.is_admin}|{request.get_full_path()}|{[generations.get(key) for key in keys]}"
+    return f"board_list:{md5(fingerprint.encode('utf-8')).hexdigest()}"
+
+
+def get_or_build(key, build, timeout):
+    """
+    Value cached under key, built with build() when missing. build may return None for a value not to cache.
+    Only one caller builds a missing value, the others wait for it up to LOCK_WAIT seconds before building it too.
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}:lock"
+    if not cache.add(lock_key, 1, LOCK_TIMEOUT):
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            value = cache.get(key)
+            if value is not None:
+                return value
+        return build()
+
+    try:
+        value = build()
+        if value is not None:
+            cache.set(key, value, timeout)
+        return value
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,152 @@
+"""
+Write path of the chat messages received by ChatConsumer. The sender is the authenticated user of the connection
+and the board comes from a snapshot kept by the consumer, so the only queries are the writes.
+Messages received within CHAT_BATCH_WINDOW seconds, by any connection of the process, are inserted together.
+Batches are written and broadcast one after the other, messages of a board keep the order in which they arrived.
+"""
+import asyncio
+from collections import defaultdict, deque
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .broadcast import group_send_many, latest_message_sends
+from .metrics import metrics
+from .models import Board, Message, TheUser
+from .signals import get_latest_message_recipients, get_message_data, messages_created
+
+
+class MessageRejected(Exception):
+    # The board or the sender of the message was deleted before it was written
+    pass
+
+
+def insert_messages(messages):
+    # One multi-row insert, side effects are applied by messages_created()
+    with transaction.atomic():
+        Message.objects.bulk_create(messages)
+        if messages and messages[0].pk is None:
+            # MySQL does not return the ids of bulk inserts, they are read back in the same transaction by the
+            # date_sent values bulk_create() gave the messages. The rows of one insert get increasing ids.
+            inserted_ids = defaultdict(deque)
+            rows = Message.objects.filter(
+                date_sent__in={message.date_sent for message in messages},
+                board_id__in={message.board_id for message in messages},
+                sent_by_id__in={message.sent_by_id for message in messages},
+            ).order_by('id').values_list('board_id', 'sent_by_id', 'id')
+            for board_id, sent_by_id, message_id in rows:
+                inserted_ids[board_id, sent_by_id].append(message_id)
+            for message in messages:
+                message.pk = inserted_ids[message.board_id, message.sent_by_id].popleft()
+        messages_created(messages)
+
+
+def write_messages(messages):
+    """
+    Insert the messages and apply what post_save receivers do for a single message.
+    Returns the messages that could not be written, because their board or sender was deleted meanwhile,
+    and the inbox recipients of the boards of the others.
+    """
+    now = timezone.now()
+    for message in messages:
+        message.date_sent = message.updated_at = now
+    rejected = []
+    try:
+        insert_messages(messages)
+    except IntegrityError:
+        # One message of a deleted board or user fails the whole batch, the others are inserted without it
+        for message in messages:
+            message.pk = None
+            message._state.adding = True
+        board_ids = set(Board.objects.filter(id__in={message.board_id for message in messages}).values_list('id', flat=True))
+        user_ids = set(TheUser.objects.filter(id__in={message.sent_by_id for message in messages}).values_list('id', flat=True))
+        rejected = [message for message in messages if message.board_id not in board_ids or message.sent_by_id not in user_ids]
+        if not rejected:
+            raise
+        messages = [message for message in messages if message.board_id in board_ids and message.sent_by_id in user_ids]
+        if messages:
+            insert_messages(messages)
+    return rejected, get_latest_message_recipients({message.board_id for message in messages})
+
+
+class MessageBatcher:
+    """
+    Groups the messages written at about the same time. write() returns a future resolved with the message payload
+    once the batch of the message is inserted and broadcast to the board group.
+    """
+
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.loop = None
+
+    def reset(self, loop):
+        # Pending messages, timer and lock belong to an event loop (tests run each case in its own loop)
+        self.loop = loop
+        self.pending = []
+        self.timer = None
+        self.lock = asyncio.Lock()
+
+    def write(self, message, board_data, sender_data):
+        loop = asyncio.get_running_loop()
+        if loop is not self.loop:
+            self.reset(loop)
+        future = loop.create_future()
+        self.pending.append((message, board_data, sender_data, future))
+        if len(self.pending) >= self.max_size:
+            self.flush_pending()
+        elif self.timer is None:
+            self.timer = loop.call_later(self.window, self.flush_pending)
+        return future
+
+    def flush_pending(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            # Tasks take the lock in the order they were created
+            self.loop.create_task(self.flush(batch))
+
+    async def flush(self, batch):
+        async with self.lock:
+            try:
+                rejected, recipients = await database_sync_to_async(write_messages)([item[0] for item in batch])
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            if rejected:
+                rejected = {id(message) for message in rejected}
+                for message, *_, future in batch:
+                    if id(message) in rejected and not future.done():
+                        future.set_exception(MessageRejected())
+                batch = [item for item in batch if id(item[0]) not in rejected]
+                metrics.increment('chat.rejected_messages', len(rejected))
+            metrics.increment('chat.batches')
+            metrics.increment('chat.messages', len(batch))
+
+            channel_layer = get_channel_layer()
+            inbox_sends = []
+            for message, board_data, sender_data, future in batch:
+                message_data = get_message_data(message, board_data, sender_data)
+                try:
+                    # One after the other, board members get the messages in order
+                    await channel_layer.group_send(f"board_{message.board_id}", {
+                        "type": "chat_message",
+                        "board": message.board_id,
+                        "message": message_data
+                    })
+                except Exception:
+                    # The message is stored, the sender still gets its acknowledgement
+                    metrics.increment('chat.broadcast_errors')
+                inbox_sends += latest_message_sends(message_data, recipients[message.board_id])
+                if not future.done():
+                    future.set_result(message_data)
+            # Acknowledgements go first, inboxes of the whole batch are then updated concurrently
+            await group_send_many(inbox_sends, channel_layer)
+
+
+message_batcher = MessageBatcher(settings.CHAT_BATCH_WINDOW, settings.CHAT_BATCH_SIZE)
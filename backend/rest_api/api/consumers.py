@@ -1,36 +1,137 @@
-import json 
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Board, Message, TheUser
+from .models import Board, Message
+import asyncio
 import logging
-from datetime import datetime
-from django.core.serializers.json import DjangoJSONEncoder
-from django.db.models.fields.files import FieldFile
+import time
+from collections import defaultdict
 from django.contrib.auth.models import AnonymousUser
-from django.utils.timezone import is_aware
 from asgiref.sync import async_to_sync
-from urllib.parse import parse_qsl
 from channels.exceptions import StopConsumer
-from django.core.cache import cache
+from .wire import negotiate
+from .outbound import OutboundQueue, SLOW_CLIENT_CLOSE_CODE
+from .membership import MembershipResolver, to_id
+from .chat import MessageRejected, message_batcher
+from .tickets import delete_ticket
+from django.conf import settings
 
 logger = logging.getLogger('api')
 
-# Date and image fields json encoder used when sending message to connected clients.
-class CombinedEncoder(DjangoJSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, FieldFile):
-            try:
-                return obj.url
-            except ValueError:
-                return None
-        elif isinstance(obj, datetime):
-            if is_aware(obj):
-                obj = obj.astimezone()
-            return obj.isoformat()
-        return super().default(obj)
-
-
-class ChatConsumer(AsyncWebsocketConsumer):
+class WireFormatMixin:
+    """
+    Frames in the wire format the client asked for when connecting (see api/wire.py), written by the outbound
+    queue of the connection (see api/outbound.py).
+    """
+    outbound = None
+
+    async def accept_with_format(self):
+        self.wire, subprotocol = negotiate(self.scope)
+        await self.accept(subprotocol)
+        self.outbound = OutboundQueue(self.write_frame, self.close_slow_client, settings.WEBSOCKET_QUEUE_MAX_SIZE)
+
+    async def send_frame(self, frame, coalesce=None, supersede=None, release=()):
+        # coalesce and supersede are keys of frames that only matter in their latest version, see api/outbound.py
+        if self.outbound is not None:
+            self.outbound.put(frame, coalesce, supersede, release)
+
+    async def write_frame(self, frame):
+        await self.send(**self.wire.encode(frame))
+
+    async def close_slow_client(self):
+        logger.warning(f"{self.scope['path']} - client too far behind, disconnected")
+        await self.close(code=SLOW_CLIENT_CLOSE_CODE)
+
+    async def websocket_disconnect(self, message):
+        if self.outbound is not None:
+            self.outbound.stop()
+        await super().websocket_disconnect(message)
+
+    async def decode_frame(self, text_data=None, bytes_data=None):
+        # Frames from clients are objects. Anything else gets an error frame and None, the connection stays open.
+        try:
+            frame = self.wire.decode(text_data, bytes_data)
+        except (ValueError, TypeError):
+            frame = None
+        if not isinstance(frame, dict):
+            logger.warning(f"{self.scope['path']} - malformed frame received")
+            await self.send_frame({'type': 'error', 'detail': 'Malformed frame'})
+            return None
+        return frame
+
+
+def card_key(event):
+    return ('card', event['message']['card_id'])
+
+
+def bulk_card_keys(event):
+    # A status queued before a bulk update of its card must not be replaced by a later one, which would be
+    # written before the bulk update
+    return [('card', card['card_id']) for card in event['message']['cards']]
+
+
+def inbox_key(event):
+    # Latest message of a board, its board is a dict or an id
+    board = event['message']['board']
+    return ('inbox', board['id'] if isinstance(board, dict) else board)
+
+
+class ChatWriteMixin:
+    """
+    Chat messages sent through a connection, by its user. Consumers set self.membership, self.user_data
+    (the user as sent in events) and self.boards (board snapshots) when connecting.
+    """
+
+    async def write_chat_message(self, data_json):
+        board_id = to_id(data_json.get('board'))
+        if board_id is None or not self.membership.can_access_board(board_id):
+            logger.warning(f"{self.scope['path']} - message rejected for a board the user is not a member of")
+            return
+        content = data_json.get('content')
+        if not isinstance(content, str) or not content:
+            return
+
+        board_data = await self.get_board_data(board_id)
+        if board_data is None:
+            return
+        # The sender is the authenticated user, whatever sent_by says
+        message = Message(board_id=board_id, sent_by=self.user, content=content)
+        # Inserted with the messages received meanwhile, then broadcast to the board group and the inboxes.
+        # The next frames of the connection are read meanwhile so that they can join the same batch.
+        future = message_batcher.write(message, board_data, self.user_data)
+        asyncio.ensure_future(self.acknowledge(future, board_id, data_json.get('client_id')))
+
+    async def acknowledge(self, future, board_id, client_id):
+        try:
+            message_data = await future
+        except MessageRejected:
+            logger.warning(f"{self.scope['path']} - message rejected, its board or sender was deleted")
+            return
+        except Exception:
+            logger.exception(f"{self.scope['path']} - message could not be saved")
+            return
+        # Clients asking for it get the id and date of their message, matched by their own client_id
+        if client_id is not None:
+            await self.send_ack(board_id, {
+                'type': 'ack',
+                'client_id': client_id,
+                'id': message_data['id'],
+                'date_sent': message_data['date_sent'],
+            })
+
+    async def send_ack(self, board_id, ack):
+        await self.send_frame(ack)
+
+    async def get_board_data(self, board_id):
+        # Boards are read once per CHAT_BOARD_SNAPSHOT_TTL
+        snapshot = self.boards.get(board_id)
+        if snapshot is None or snapshot[0] < time.monotonic():
+            board = await database_sync_to_async(Board.objects.filter(id=board_id).first)()
+            snapshot = (time.monotonic() + settings.CHAT_BOARD_SNAPSHOT_TTL, board.to_dict() if board else None)
+            self.boards[board_id] = snapshot
+        return snapshot[1]
+
+
+class ChatConsumer(ChatWriteMixin, WireFormatMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.board_id = self.scope['url_route']['kwargs'].get('board_id')
         self.user = self.scope['user']
@@ -39,77 +140,57 @@ class ChatConsumer(AsyncWebsocketConsumer):
             #logger.warning(f"Connection attempt rejected for anonymous user on {self.scope['path']}")
             await self.close()
         else:
-            # Parse query string to get UUID
-            query_string = self.scope['query_string'].decode("utf-8")
-            query_params = dict(parse_qsl(query_string))
-            uuid = query_params.get('uuid')
-            self.cache_key = f"websocket_auth:{uuid}"
+            # Ticket of the connection, read by JwtAuthMiddleware
+            self.ticket = self.scope.get('ticket')
 
+            # Memberships are loaded once for the whole connection
+            self.membership = MembershipResolver(self.user)
+            await database_sync_to_async(self.membership.load_boards)()
             if self.board_id:
+                if not self.membership.can_access_board(self.board_id):
+                    await self.close()
+                    return
                 self.board_name = f"board_{self.board_id}"
                 await self.channel_layer.group_add(self.board_name, self.channel_name)
 
+            # Messages are sent by the connected user (see ChatWriteMixin)
+            self.user_data = await database_sync_to_async(self.user.to_dict)()
+            self.boards = {}
 
             # logger.info(f"Connection accepted for user {self.user.id} on {self.scope['path']}")
-            await self.accept()
+            await self.accept_with_format()
 
     async def disconnect(self, close_code):
         # logger.info(f"[User {self.scope['user'].id}] {self.scope['path']} - Disconnected with code: {close_code}")
         if getattr(self, 'board_name', False):
             await self.channel_layer.group_discard(self.board_name, self.channel_name)
 
-        # Delete the cache entry when the user disconnects
-        if hasattr(self, 'cache_key'):
-            cache.delete(self.cache_key)
+        # Delete the ticket when the user disconnects
+        await delete_ticket(getattr(self, 'ticket', None))
         
         # Raise StopConsumer to properly close the consumer
         raise StopConsumer()
         
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         logger.debug(f"{self.scope['path']} - New data received")
-        data_json = json.loads(text_data)
-        
-        # Create the message once
-        new_message = await self.create_message(data_json)
-        
-        # Prepare the message data
-        message_data = await self.prepare_message_data(new_message)
-        
-        # Send to the specific board group
-        if self.board_id:
-            await self.channel_layer.group_send(
-                self.board_name,
-                {
-                    "type": "chat_message",
-                    "message": message_data
-                }
-            )
-    
+        data_json = await self.decode_frame(text_data, bytes_data)
+        if data_json is not None:
+            await self.write_chat_message(data_json)
 
     async def chat_message(self, event):
         message = event['message']
-        await self.send(text_data=json.dumps(message, cls=CombinedEncoder))
-
-
-    @database_sync_to_async
-    def create_message(self, data):
-        board = Board.objects.get(id=data['board'])
-        user = TheUser.objects.get(id=data['sent_by'])
-        new_message = Message.objects.create(board=board, sent_by=user, content=data['content'])
-        return new_message
-
-    @database_sync_to_async
-    def prepare_message_data(self, message):
-        return {
-            'id': message.id,
-            'board': message.board.to_dict(),
-            'sent_by': message.sent_by.to_dict(),
-            'content': message.content,
-            'date_sent': message.date_sent.isoformat()
-        }
+        await self.send_frame(message)
+
+    # Card events are sent to the same board group, they are not forwarded to chat sockets
+    async def card_status_update(self, event):
+        pass
+
+    async def cards_bulk_update(self, event):
+        pass
+
 
 # Consumer to automatically send TO-DO task to DOING when time is up.
-class CardTaskConsumer(AsyncWebsocketConsumer):
+class CardTaskConsumer(WireFormatMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         self.board_id = self.scope['url_route']['kwargs'].get('board_id')
@@ -118,43 +199,53 @@ class CardTaskConsumer(AsyncWebsocketConsumer):
             #logger.warning(f"Connection attempt rejected for anonymous user on {self.scope['path']}")
             await self.close()
         else:
-            # Parse query string to get UUID
-            query_string = self.scope['query_string'].decode("utf-8")
-            query_params = dict(parse_qsl(query_string))
-            uuid = query_params.get('uuid')
-            self.cache_key = f"websocket_auth:{uuid}"
+            # Ticket of the connection, read by JwtAuthMiddleware
+            self.ticket = self.scope.get('ticket')
 
             if self.board_id:
+                self.membership = MembershipResolver(self.user)
+                await database_sync_to_async(self.membership.load_boards)()
+                if not self.membership.can_access_board(self.board_id):
+                    await self.close()
+                    return
                 self.board_name = f"board_{self.board_id}"
                 await self.channel_layer.group_add(self.board_name, self.channel_name)
             
             # logger.info(f"Connection accepted for user {self.user.id} on {self.scope['path']}")
-            await self.accept()
+            await self.accept_with_format()
 
     async def disconnect(self, close_code):
         # logger.info(f"[User {self.scope['user'].id}] {self.scope['path']} - Disconnected with code: {close_code}")
         if getattr(self, 'board_name', False):
             await self.channel_layer.group_discard(self.board_name, self.channel_name)
         
-        # Delete the cache entry when the user disconnects
-        if hasattr(self, 'cache_key'):
-            cache.delete(self.cache_key)
+        # Delete the ticket when the user disconnects
+        await delete_ticket(getattr(self, 'ticket', None))
         
         # Raise StopConsumer to properly close the consumer
         raise StopConsumer()
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         # We don't expect to receive messages from the client in this consumer
         pass
 
     async def card_status_update(self, event):
-        # Send message to WebSocket
+        # Send message to WebSocket, a status still waiting to be sent is replaced
         logger.debug(f"{self.scope['path']} - sending new event")
-        await self.send(text_data=json.dumps(event, cls=CombinedEncoder))
+        await self.send_frame(event, coalesce=card_key(event))
+
+    async def cards_bulk_update(self, event):
+        # Status of many cards changed at once
+        logger.debug(f"{self.scope['path']} - sending new event")
+        await self.send_frame(event, release=bulk_card_keys(event))
+
+    # Chat messages are sent to the same board group, they are not forwarded to card sockets
+    async def chat_message(self, event):
+        pass
 
 # Message home consumer to allow connected clients to receive in real time new messages without need to enter in single chat 
 # Users alone in their group. Their own inbox everywhere connected different from simple self.channel_name
-class MessageHomeConsumer(AsyncWebsocketConsumer):
+class MessageHomeConsumer(WireFormatMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         
@@ -162,18 +253,15 @@ class MessageHomeConsumer(AsyncWebsocketConsumer):
             # logger.warning(f"Connection attempt rejected for anonymous user on {self.scope['path']}")
             await self.close()
         else:
-            # Parse query string to get UUID
-            query_string = self.scope['query_string'].decode("utf-8")
-            query_params = dict(parse_qsl(query_string))
-            uuid = query_params.get('uuid')
-            self.cache_key = f"websocket_auth:{uuid}"
+            # Ticket of the connection, read by JwtAuthMiddleware
+            self.ticket = self.scope.get('ticket')
 
             self.user_group = f"user_{self.user.id}_latest_messages"
             # Join user-specific group
             await self.channel_layer.group_add(self.user_group, self.channel_name)
 
             # logger.info(f"Connection accepted on {self.scope['path']}")
-            await self.accept()
+            await self.accept_with_format()
 
     async def disconnect(self, close_code):
         # logger.info(f"{self.scope['path']} - Disconnected with code: {close_code}")
@@ -181,25 +269,24 @@ class MessageHomeConsumer(AsyncWebsocketConsumer):
         if getattr(self, 'user_group', False):
             await self.channel_layer.group_discard(self.user_group, self.channel_name)
         
-        # Delete the cache entry when the user disconnects
-        if hasattr(self, 'cache_key'):
-            cache.delete(self.cache_key)
+        # Delete the ticket when the user disconnects
+        await delete_ticket(getattr(self, 'ticket', None))
         
         # Raise StopConsumer to properly close the consumer
         raise StopConsumer()
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         # We don't expect to receive messages from the client in this consumer
         pass
 
     async def latest_message_update(self, event):
-        # Send message to WebSocket
+        # Send message to WebSocket, an older message of the board still waiting to be sent is dropped
         logger.debug(f"{self.scope['path']} - sending new event")
-        await self.send(text_data=json.dumps(event, cls=CombinedEncoder))
+        await self.send_frame(event, supersede=inbox_key(event))
 
 
 # Test consumer to echo sent message
-class EchoConsumer(AsyncWebsocketConsumer):
+class EchoConsumer(WireFormatMixin, AsyncWebsocketConsumer):
 
     async def connect(self):
         self.n = 0
@@ -209,31 +296,166 @@ class EchoConsumer(AsyncWebsocketConsumer):
             # logger.warning(f"Connection attempt rejected for anonymous user on {self.scope['path']}")
             await self.close()
         else:
-            # Parse query string to get UUID
-            query_string = self.scope['query_string'].decode("utf-8")
-            query_params = dict(parse_qsl(query_string))
-            uuid = query_params.get('uuid')
-            self.cache_key = f"websocket_auth:{uuid}"
+            # Ticket of the connection, read by JwtAuthMiddleware
+            self.ticket = self.scope.get('ticket')
 
             # logger.info(f"Connection accepted on {self.scope['path']}")
-            await self.accept()
-            await self.send(text_data=json.dumps({'message': 'Connected'}))
+            await self.accept_with_format()
+            await self.send_frame({'message': 'Connected'})
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         self.n += 1
-        text_data_json = json.loads(text_data)
-        message = text_data_json['message']
+        text_data_json = await self.decode_frame(text_data, bytes_data)
+        if text_data_json is None:
+            return
+        message = text_data_json.get('message')
         logger.debug(f"{self.scope['path']} - Received message: {message}")
         
         response = f"Echo {self.n}: {message}"
-        await self.send(text_data=json.dumps({'message': response}))
+        await self.send_frame({'message': response})
 
     async def disconnect(self, close_code):
         # logger.info(f"[User {self.scope['user'].id }] {self.scope['path']} - Disconnected with code: {close_code}")
         
-        # Delete the cache entry when the user disconnects
-        if hasattr(self, 'cache_key'):
-            cache.delete(self.cache_key)
+        # Delete the ticket when the user disconnects
+        await delete_ticket(getattr(self, 'ticket', None))
         
         # Raise StopConsumer to properly close the consumer
-        raise StopConsumer()
\ No newline at end of file
+        raise StopConsumer()
+
+
+# One connection for all the streams of a client. Control messages subscribe to and unsubscribe from streams:
+#   {"action": "subscribe" | "unsubscribe", "stream": "chat" | "cards", "board": <id>}
+#   {"action": "subscribe" | "unsubscribe", "stream": "inbox"}
+# and send chat messages: {"action": "send", "stream": "chat", "board": <id>, "content": ..., "client_id": ...}.
+# Frames of a stream are wrapped: {"stream": ..., "board": <id>, "payload": <frame of the dedicated socket>},
+# answers to control messages are {"type": "subscribed" | "unsubscribed" | "error", "stream": ..., "board": ...}.
+class MultiplexConsumer(ChatWriteMixin, WireFormatMixin, AsyncWebsocketConsumer):
+    board_streams = ('chat', 'cards')
+
+    async def connect(self):
+        self.user = self.scope['user']
+
+        if isinstance(self.user, AnonymousUser):
+            await self.close()
+        else:
+            # Ticket of the connection, read by JwtAuthMiddleware
+            self.ticket = self.scope.get('ticket')
+
+            await self.load_membership()
+            self.user_data = await database_sync_to_async(self.user.to_dict)()
+            self.boards = {}
+            # board id -> subscribed streams of the board, whose group the connection is in
+            self.subscriptions = defaultdict(set)
+            self.user_group = None
+            await self.accept_with_format()
+
+    async def disconnect(self, close_code):
+        for board_id in getattr(self, 'subscriptions', {}):
+            await self.channel_layer.group_discard(f"board_{board_id}", self.channel_name)
+        if getattr(self, 'user_group', None):
+            await self.channel_layer.group_discard(self.user_group, self.channel_name)
+
+        # Delete the ticket when the user disconnects
+        await delete_ticket(getattr(self, 'ticket', None))
+
+        # Raise StopConsumer to properly close the consumer
+        raise StopConsumer()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data_json = await self.decode_frame(text_data, bytes_data)
+        if data_json is None:
+            return
+        action, stream, board = data_json.get('action'), data_json.get('stream'), data_json.get('board')
+        if action == 'subscribe' and stream == 'inbox':
+            await self.subscribe_inbox()
+        elif action == 'unsubscribe' and stream == 'inbox':
+            await self.unsubscribe_inbox()
+        elif action == 'subscribe' and stream in self.board_streams:
+            await self.subscribe_board(stream, board)
+        elif action == 'unsubscribe' and stream in self.board_streams:
+            await self.unsubscribe_board(stream, board)
+        elif action == 'send' and stream == 'chat':
+            await self.write_chat_message(data_json)
+        else:
+            await self.send_control('error', stream, board, detail='Unknown action or stream')
+
+    async def subscribe_inbox(self):
+        if self.user_group is None:
+            self.user_group = f"user_{self.user.id}_latest_messages"
+            await self.channel_layer.group_add(self.user_group, self.channel_name)
+        await self.send_control('subscribed', 'inbox')
+
+    async def unsubscribe_inbox(self):
+        if self.user_group is not None:
+            await self.channel_layer.group_discard(self.user_group, self.channel_name)
+            self.user_group = None
+        await self.send_control('unsubscribed', 'inbox')
+
+    async def subscribe_board(self, stream, board):
+        board_id = to_id(board)
+        if board_id is None:
+            return await self.send_control('error', stream, board, detail='Unknown board')
+        if not self.membership.can_access_board(board_id):
+            # The user may have joined the board since the boards were loaded, they are read again at most once
+            # per MULTIPLEX_MEMBERSHIP_RELOAD_INTERVAL whatever the number of refused subscriptions
+            if time.monotonic() - self.membership_loaded_at >= settings.MULTIPLEX_MEMBERSHIP_RELOAD_INTERVAL:
+                await self.load_membership()
+            if not self.membership.can_access_board(board_id):
+                return await self.send_control('error', stream, board_id, detail='Not a member of the board')
+        if board_id not in self.subscriptions:
+            if len(self.subscriptions) >= settings.MULTIPLEX_MAX_BOARDS:
+                return await self.send_control('error', stream, board_id, detail='Too many boards')
+            # Chat and card events of a board share its group
+            await self.channel_layer.group_add(f"board_{board_id}", self.channel_name)
+        self.subscriptions[board_id].add(stream)
+        await self.send_control('subscribed', stream, board_id)
+
+    async def load_membership(self):
+        self.membership = MembershipResolver(self.user)
+        await database_sync_to_async(self.membership.load_boards)()
+        self.membership_loaded_at = time.monotonic()
+
+    async def unsubscribe_board(self, stream, board):
+        board_id = to_id(board)
+        streams = self.subscriptions.get(board_id)
+        if streams is not None:
+            streams.discard(stream)
+            if not streams:
+                del self.subscriptions[board_id]
+                await self.channel_layer.group_discard(f"board_{board_id}", self.channel_name)
+        await self.send_control('unsubscribed', stream, board_id)
+
+    async def send_control(self, frame_type, stream, board=None, **extra):
+        frame = {'type': frame_type, 'stream': stream}
+        if board is not None:
+            frame['board'] = board
+        await self.send_frame({**frame, **extra})
+
+    async def send_stream(self, stream, board_id, payload, **policy):
+        frame = {'stream': stream, 'payload': payload}
+        if board_id is not None:
+            frame['board'] = board_id
+        await self.send_frame(frame, **policy)
+
+    async def send_ack(self, board_id, ack):
+        await self.send_stream('chat', board_id, ack)
+
+    async def forward(self, stream, event, payload, **policy):
+        # Events of a board group only go to its subscribed streams
+        board_id = event.get('board')
+        if stream in self.subscriptions.get(board_id, ()):
+            await self.send_stream(stream, board_id, payload, **policy)
+
+    async def chat_message(self, event):
+        await self.forward('chat', event, event['message'])
+
+    async def card_status_update(self, event):
+        await self.forward('cards', event, event, coalesce=card_key(event))
+
+    async def cards_bulk_update(self, event):
+        await self.forward('cards', event, event, release=bulk_card_keys(event))
+
+    async def latest_message_update(self, event):
+        if self.user_group is not None:
+            await self.send_stream('inbox', None, event, supersede=inbox_key(event))
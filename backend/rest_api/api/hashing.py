@@ -0,0 +1,91 @@
+"""
+Password hashing off the request threads. PBKDF2 takes a long time on purpose, run from sync views it holds
+the thread that serves every other sync view. Signup and signin are async views that send hashing to a dedicated
+pool with a bounded number of pending jobs: when it is full they are refused right away (503) instead of queueing,
+so a login storm cannot slow down board and chat traffic.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, get_hasher, identify_hasher, make_password
+from .metrics import metrics
+
+
+class PoolFull(Exception):
+    pass
+
+
+class HashingPool:
+    """
+    Thread pool of `workers` threads accepting at most `max_pending` jobs, running or waiting.
+    Metrics are named after the pool: submitted, rejected and completed counters, pending gauge,
+    wait (time spent in queue) and duration timings.
+    """
+
+    def __init__(self, name, workers, max_pending):
+        self.name = name
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        # Threads are only started once the pool is used
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.name)
+            return self.executor
+
+    async def run(self, func, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                metrics.increment(f'{self.name}.rejected')
+                raise PoolFull(self.name)
+            self.pending += 1
+            metrics.gauge(f'{self.name}.pending', self.pending)
+        metrics.increment(f'{self.name}.submitted')
+        queued_at = time.perf_counter()
+
+        def job():
+            started_at = time.perf_counter()
+            metrics.observe(f'{self.name}.wait', started_at - queued_at)
+            try:
+                return func(*args)
+            finally:
+                metrics.observe(f'{self.name}.duration', time.perf_counter() - started_at)
+
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.get_executor(), job)
+        finally:
+            with self.lock:
+                self.pending -= 1
+                metrics.gauge(f'{self.name}.pending', self.pending)
+            metrics.increment(f'{self.name}.completed')
+
+
+password_hashing = HashingPool('password_hashing', settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_MAX_PENDING)
+
+
+async def hash_password(password):
+    return await password_hashing.run(make_password, password)
+
+
+async def verify_password(user, password):
+    """
+    Same as user.check_password(), the hash is upgraded when the hasher settings changed.
+    A missing user still costs a hash, as with ModelBackend, so that unknown emails are not faster to reject.
+    """
+    if user is None:
+        await hash_password(password)
+        return False
+    if not await password_hashing.run(check_password, password, user.password):
+        return False
+    preferred = get_hasher()
+    if identify_hasher(user.password).algorithm != preferred.algorithm or preferred.must_update(user.password):
+        user.password = await hash_password(password)
+        await sync_to_async(user.save)(update_fields=['password'])
+    return True
@@ -0,0 +1,33 @@
+from datetime import datetime
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from api.archive import archive_messages, compact_archives, restore_messages
+
+class Command(BaseCommand):
+    help = 'Moves old messages to compressed archive segments, merges partial segments or restores archived messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.MESSAGE_ARCHIVE_AFTER_DAYS, help='Archive the messages older than this')
+        parser.add_argument('--board', type=int, action='append', dest='boards', help='Only this board (repeatable)')
+        parser.add_argument('--segment-size', type=int, default=settings.MESSAGE_ARCHIVE_SEGMENT_SIZE, help='Messages per segment')
+        parser.add_argument('--compact', action='store_true', help='Merge the partial segments of each board')
+        parser.add_argument('--restore', action='store_true', help='Move archived messages back to the messages table')
+        parser.add_argument('--since', help='With --restore, only the messages sent since this date (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            try:
+                since = datetime.fromisoformat(options['since']) if options['since'] else None
+            except ValueError:
+                raise CommandError('--since must be a date like 2024-01-31')
+            count = restore_messages(since=since, board_ids=options['boards'])
+            self.stdout.write(self.style.SUCCESS(f'{count} message(s) restored'))
+            return
+
+        if not options['compact']:
+            before = timezone.now() - timezone.timedelta(days=options['days'])
+            count = archive_messages(before, segment_size=options['segment_size'], board_ids=options['boards'])
+            self.stdout.write(self.style.SUCCESS(f'{count} message(s) archived'))
+        count = compact_archives(segment_size=options['segment_size'], board_ids=options['boards'])
+        self.stdout.write(self.style.SUCCESS(f'{count} segment(s) merged'))
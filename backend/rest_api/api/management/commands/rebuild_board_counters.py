@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from api.models import Board
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-status card counters and the progress of boards from their cards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--board', type=int, nargs='*', help='Ids of the boards to rebuild, all boards by default')
+
+    def handle(self, *args, **options):
+        count = Board.rebuild_card_counts(options['board'])
+        self.stdout.write(self.style.SUCCESS(f'Card counters rebuilt for {count} board(s)'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from api.models import Card, Message, SearchKind, SearchPosting
+from api.search import index_documents
+
+BATCH_SIZE = 500
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index of cards and messages'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            SearchPosting.objects.all().delete()
+            for kind, model in [(SearchKind.CARD, Card), (SearchKind.MESSAGE, Message)]:
+                batch, count = [], 0
+                for obj in model.objects.order_by('id').iterator(chunk_size=BATCH_SIZE):
+                    batch.append(obj)
+                    if len(batch) == BATCH_SIZE:
+                        index_documents(kind, batch)
+                        count, batch = count + len(batch), []
+                index_documents(kind, batch)
+                self.stdout.write(f'{count + len(batch)} {model._meta.verbose_name_plural} indexed')
+        self.stdout.write(self.style.SUCCESS('Search index rebuilt'))
@@ -0,0 +1,70 @@
+from django.utils.functional import cached_property
+from .models import Board, Card
+
+
+class MembershipResolver:
+    """
+    Ids of the boards and cards a user is a member of, each loaded with one query on first use and then
+    answered from memory. Permission classes share the resolver of the request (see get_membership),
+    WebSocket consumers keep one for their connection.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @property
+    def is_admin(self):
+        return getattr(self.user, 'is_admin', False)
+
+    @cached_property
+    def board_ids(self):
+        # Board members are kept in sync with the members of the board's cards
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(Board.members.through.objects.filter(theuser_id=self.user.id).values_list('board_id', flat=True))
+
+    @cached_property
+    def card_ids(self):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(Card.members.through.objects.filter(theuser_id=self.user.id).values_list('card_id', flat=True))
+
+    def load_boards(self):
+        # Run from async code with database_sync_to_async, board checks are then answered without database access
+        return self.board_ids
+
+    def is_board_member(self, board):
+        # board is a Board or its id
+        if 'board_ids' not in self.__dict__ and has_prefetched_members(board):
+            return self.user.pk in {member.pk for member in board.members.all()}
+        return to_id(board) in self.board_ids
+
+    def is_card_member(self, card):
+        if 'card_ids' not in self.__dict__ and has_prefetched_members(card):
+            return self.user.pk in {member.pk for member in card.members.all()}
+        return to_id(card) in self.card_ids
+
+    def can_access_board(self, board):
+        return self.is_admin or self.is_board_member(board)
+
+
+def has_prefetched_members(obj):
+    # Members already loaded with the object answer without query
+    return 'members' in getattr(obj, '_prefetched_objects_cache', {})
+
+
+def to_id(obj):
+    if isinstance(obj, (Board, Card)):
+        return obj.pk
+    try:
+        return int(obj)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_membership(request):
+    # One resolver per request, reused by every permission check of the request
+    resolver = getattr(request, '_membership', None)
+    if resolver is None or resolver.user is not request.user:
+        resolver = request._membership = MembershipResolver(request.user)
+    return resolver
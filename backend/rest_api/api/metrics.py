@@ -0,0 +1,50 @@
+import threading
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    In-process counters, gauges and timings. Each worker process has its own, admins read them from /api/metrics/.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        # name -> [count, total seconds, max seconds]
+        self.timings = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            timing = self.timings[name]
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timings': {
+                    name: {'count': count, 'avg': total / count if count else 0, 'max': longest}
+                    for name, (count, total, longest) in self.timings.items()
+                },
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timings.clear()
+
+
+metrics = Metrics()
@@ -2,11 +2,12 @@ from channels.db import database_sync_to_async
 from urllib.parse import parse_qsl
 from channels.middleware import BaseMiddleware
 from channels.auth import AuthMiddlewareStack
-from django.db import close_old_connections
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AnonymousUser
 import logging
-from django.core.cache import cache
+import time
+from .metrics import metrics
+from .tickets import get_ticket_user_id
 
 logger = logging.getLogger('api')
 User = get_user_model()
@@ -24,16 +25,13 @@ class JwtAuthMiddleware(BaseMiddleware):
     def __init__(self, app):
         self.app = app
 
-    async def auth(self, query_string):
-        query_params = dict(parse_qsl(query_string))
-        uuid = query_params.get('uuid') # getting uuid from request query url parameters string
-        
+    async def auth(self, uuid):
         if not uuid:
             logger.warning("No UUID provided in query string")
             return AnonymousUser()
 
-        cache_key = f"websocket_auth:{uuid}"
-        user_id = cache.get(cache_key)
+        # Nothing here blocks the event loop: the ticket store is async, the user is loaded in a thread
+        user_id = await get_ticket_user_id(uuid)
 
         if user_id is None:
             logger.warning(f"UUID not found in cache")
@@ -42,13 +40,15 @@ class JwtAuthMiddleware(BaseMiddleware):
         return await get_user(user_id)
 
     async def __call__(self, scope, receive, send):
-        # Close old database connections to prevent usage of timed out connections
-        close_old_connections()
-
+        # Database connections are closed when too old by database_sync_to_async, around get_user()
         if scope["type"] == "websocket":
+            started_at = time.perf_counter()
             query_string = scope.get('query_string', b'').decode('utf-8')
-            user = await self.auth(query_string)
+            scope['ticket'] = dict(parse_qsl(query_string)).get('uuid') # getting uuid from request query url parameters string
+            user = await self.auth(scope['ticket'])
             scope['user'] = user
+            metrics.observe('websocket.connect_auth', time.perf_counter() - started_at)
+            metrics.increment('websocket.rejected' if isinstance(user, AnonymousUser) else 'websocket.authenticated')
 
         return await self.app(scope, receive, send)
 
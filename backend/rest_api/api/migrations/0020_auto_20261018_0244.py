@@ -0,0 +1,38 @@
+# Generated by Django 3.2.19 on 2026-10-18 02:44
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_last_message(apps, schema_editor):
+    Board = apps.get_model('api', 'Board')
+    Message = apps.get_model('api', 'Message')
+    latest = Message.objects.filter(board=models.OuterRef('pk')).order_by('-date_sent', '-id').values('id')[:1]
+    Board.objects.update(last_message=models.Subquery(latest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_auto_20241012_1757'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='last_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='api.message'),
+        ),
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 44, 41, 475020)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 44, 41, 477941)),
+        ),
+        migrations.RunPython(fill_last_message, migrations.RunPython.noop),
+    ]
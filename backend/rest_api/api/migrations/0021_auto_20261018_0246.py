@@ -0,0 +1,54 @@
+# Generated by Django 3.2.19 on 2026-10-18 02:46
+
+import datetime
+from django.db import migrations, models
+
+
+def fill_card_counts(apps, schema_editor):
+    Board = apps.get_model('api', 'Board')
+    Card = apps.get_model('api', 'Card')
+    boards = {board.id: board for board in Board.objects.all()}
+    for row in Card.objects.values('board_id', 'status').annotate(total=models.Count('id')).order_by():
+        setattr(boards[row['board_id']], f"{row['status'].lower()}_count", row['total'])
+    Board.objects.bulk_update(boards.values(), ['todo_count', 'doing_count', 'blocked_count', 'done_count'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0020_auto_20261018_0244'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='blocked_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='doing_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='done_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='todo_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 46, 44, 481263)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 46, 44, 486285)),
+        ),
+        migrations.RunPython(fill_card_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.19 on 2026-10-18 02:47
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_auto_20261018_0246'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 47, 54, 974268)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 47, 54, 978986)),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['board', 'date_sent', 'id'], name='message_board_date_sent_idx'),
+        ),
+    ]
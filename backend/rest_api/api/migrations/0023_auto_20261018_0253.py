@@ -0,0 +1,34 @@
+# Generated by Django 3.2.19 on 2026-10-18 02:53
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_auto_20261018_0247'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 53, 58, 383876)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 2, 53, 58, 387738)),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:00
+
+import datetime
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_message_updated_at(apps, schema_editor):
+    # Messages were never edited so far
+    Message = apps.get_model('api', 'Message')
+    Message.objects.update(updated_at=models.F('date_sent'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0023_auto_20261018_0253'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 0, 21, 982386)),
+        ),
+        migrations.AlterField(
+            model_name='board',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 0, 21, 985667)),
+        ),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('board', 'Board'), ('card', 'Card'), ('message', 'Message')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.RunPython(fill_message_updated_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:13
+
+import datetime
+from django.db import migrations, models
+
+
+# Many to many tables are created by Django and have no Meta, their indexes are managed here.
+# The unique (card/board, user) index serves lookups by card or board, these serve lookups by user.
+MEMBERS_INDEXES = [
+    ('Card', models.Index(fields=['theuser', 'card'], name='card_members_user_card_idx')),
+    ('Board', models.Index(fields=['theuser', 'board'], name='board_members_user_board_idx')),
+]
+
+
+def add_members_indexes(apps, schema_editor):
+    for model_name, index in MEMBERS_INDEXES:
+        schema_editor.add_index(apps.get_model('api', model_name).members.through, index)
+
+
+def remove_members_indexes(apps, schema_editor):
+    for model_name, index in MEMBERS_INDEXES:
+        schema_editor.remove_index(apps.get_model('api', model_name).members.through, index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0024_auto_20261018_0300'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 13, 41, 639925)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 13, 41, 642447)),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['board', 'status'], name='card_board_status_idx'),
+        ),
+        migrations.RunPython(add_members_indexes, remove_members_indexes),
+    ]
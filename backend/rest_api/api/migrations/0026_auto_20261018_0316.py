@@ -0,0 +1,44 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:16
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0025_auto_20261018_0313'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 16, 0, 362085)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 16, 0, 365736)),
+        ),
+        migrations.CreateModel(
+            name='SearchPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('kind', models.CharField(choices=[('card', 'Card'), ('message', 'Message')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('weight', models.FloatField()),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='api.board')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['term', 'kind', 'board'], name='search_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchposting',
+            index=models.Index(fields=['kind', 'object_id'], name='search_document_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:21
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0026_auto_20261018_0316'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='board',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 21, 49, 498234)),
+        ),
+        migrations.AlterField(
+            model_name='card',
+            name='due_date',
+            field=models.DateTimeField(default=datetime.datetime(2026, 12, 27, 3, 21, 49, 501892)),
+        ),
+        migrations.CreateModel(
+            name='MessageArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_date', models.DateTimeField()),
+                ('first_id', models.PositiveIntegerField()),
+                ('last_date', models.DateTimeField()),
+                ('last_id', models.PositiveIntegerField()),
+                ('min_id', models.PositiveIntegerField()),
+                ('max_id', models.PositiveIntegerField()),
+                ('count', models.PositiveIntegerField()),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='message_archives', to='api.board')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='messagearchive',
+            index=models.Index(fields=['board', 'last_date', 'last_id'], name='archive_board_position_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='messagearchive',
+            index=models.Index(fields=['min_id', 'max_id'], name='archive_id_range_idx'),
+        ),
+    ]
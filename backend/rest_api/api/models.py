@@ -1,9 +1,15 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F
 from django.forms.models import model_to_dict
+from django.dispatch import Signal
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.db.models.fields.files import ImageFieldFile, FieldFile
 from django.utils import timezone
 from datetime import datetime
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from .caching import invalidate_boards
 
 
 
@@ -75,9 +81,11 @@ class TheUser(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
-    
+    # Fields sent to other users in WebSocket events, same as TheUserSerializer. Never the password hash.
+    PUBLIC_FIELDS = ['id', 'first_name', 'last_name', 'email', 'is_admin']
+
     def to_dict(self):
-        data = model_to_dict(self, fields=[field.name for field in self._meta.fields])
+        data = model_to_dict(self, fields=self.PUBLIC_FIELDS)
         
         for key, value in data.items():
             if isinstance(value, datetime):
@@ -93,9 +101,40 @@ class TheUser(AbstractBaseUser, PermissionsMixin):
         return data
 
 
+# Denormalized number of cards per status stored on each board
+CARD_COUNT_FIELDS = ['todo_count', 'doing_count', 'blocked_count', 'done_count']
+
+
 def get_due_date(weeks=1):
     return timezone.now() + timezone.timedelta(weeks=10)
 
+# Ids of the boards being deleted. Their cards go with them: card delete receivers leave the boards alone and
+# board delete receivers handle the cards at once, as messages (see messages_deleted).
+deleting_board_ids = ContextVar('deleting_board_ids', default=frozenset())
+
+
+@contextmanager
+def deleting_boards(board_ids):
+    token = deleting_board_ids.set(deleting_board_ids.get() | set(board_ids))
+    try:
+        yield
+    finally:
+        deleting_board_ids.reset(token)
+
+
+class BoardQuerySet(models.QuerySet):
+    def bump_versions(self, **changes):
+        # Increment the version of the boards, applying any other field changes in the same query
+        return self.update(version=F('version') + 1, updated_at=timezone.now(), **changes)
+
+    def delete(self):
+        with transaction.atomic(), deleting_boards(self.values_list('id', flat=True)):
+            return super().delete()
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+
 class Board(models.Model):
     id = models.AutoField(primary_key=True)
     name = models.CharField(unique=True, max_length=100)
@@ -103,12 +142,126 @@ class Board(models.Model):
     due_date = models.DateTimeField(default=get_due_date(weeks=10))
     description = models.TextField(default='This is a new board')
     progress = models.FloatField(default=0)
+    todo_count = models.PositiveIntegerField(default=0)
+    doing_count = models.PositiveIntegerField(default=0)
+    blocked_count = models.PositiveIntegerField(default=0)
+    done_count = models.PositiveIntegerField(default=0)
     pic = models.ImageField(upload_to='uploads/images/', null=True, blank=True)
     members = models.ManyToManyField(TheUser, related_name="boards", blank=True) # unique
+    # Pointer to the most recent message of the board, kept up to date by signals. Used to build inboxes in one query.
+    last_message = models.ForeignKey('Message', related_name='+', null=True, blank=True, on_delete=models.SET_NULL)
+    # Bumped by any change of the board, its cards or its members. Used for ETags and the changes feed.
+    version = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = BoardQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    # Written with queries by card and message writes, never from an instance that may have been loaded before them
+    MAINTAINED_FIELDS = ['progress', *CARD_COUNT_FIELDS, 'last_message', 'version']
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or kwargs.get('force_insert'):
+            self.version += 1
+            super().save(*args, **kwargs)
+            return
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        update_fields = [name for name in update_fields if name not in self.MAINTAINED_FIELDS]
+        self.version = F('version') + 1
+        super().save(*args, update_fields=update_fields + ['version'], **kwargs)
+        # Current values of the maintained fields, in place of the expression
+        self.refresh_from_db(fields=self.MAINTAINED_FIELDS)
+
+    def delete(self, *args, **kwargs):
+        with deleting_boards([self.pk]):
+            return super().delete(*args, **kwargs)
+
+    def sync_members(self, user_ids):
+        # Board members are the members of its cards. Only re-check the given users instead of recomputing
+        # the whole board, so the cost depends on the number of changed members and not on the board size.
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+        in_cards = set(
+            Card.members.through.objects
+            .filter(card__board=self, theuser_id__in=user_ids)
+            .values_list('theuser_id', flat=True)
+        )
+        if in_cards:
+            self.members.add(*in_cards)
+        if user_ids - in_cards:
+            self.members.remove(*(user_ids - in_cards))
+
+    @staticmethod
+    def compute_progress(counts):
+        total = sum(counts[field] for field in CARD_COUNT_FIELDS)
+        if total == 0:
+            return 0
+        return round(counts['done_count'] / total * 100, 2)
+
+    @classmethod
+    def adjust_card_counts(cls, board_id, deltas):
+        # Apply {status: delta} changes to the card counters of a board and derive its progress from them.
+        # Called from card writes so that counters change in the same transaction.
+        with transaction.atomic():
+            counts = cls.objects.select_for_update().filter(id=board_id).values(*CARD_COUNT_FIELDS).first()
+            if counts is None:
+                return
+            for card_status, delta in deltas.items():
+                field = f'{card_status.lower()}_count'
+                counts[field] = max(counts[field] + delta, 0)
+            cls.objects.filter(id=board_id).bump_versions(progress=cls.compute_progress(counts), **counts)
+
+    @classmethod
+    def apply_card_changes(cls, deltas=(), member_ids=()):
+        # Board side of card writes, once per board: {board_id: {status: delta}} counter changes and
+        # {board_id: user_ids} members to check again. Shared by the card receivers and bulk card writes.
+        deltas, member_ids = dict(deltas), dict(member_ids)
+        boards = cls.objects.in_bulk(set(deltas) | set(member_ids))
+        unchanged_ids = []
+        for board_id, board in boards.items():
+            board.sync_members(member_ids.get(board_id, ()))
+            if any(deltas.get(board_id, {}).values()):
+                cls.adjust_card_counts(board_id, deltas[board_id])
+            else:
+                unchanged_ids.append(board_id)
+        # Boards whose counters did not move still get a new version, in one query
+        if unchanged_ids:
+            cls.objects.filter(id__in=unchanged_ids).bump_versions()
+        invalidate_boards(boards)
+        return boards
+
+    @classmethod
+    def rebuild_card_counts(cls, board_ids=None):
+        # Recompute the card counters and progress of boards from their cards, in bulk
+        with transaction.atomic():
+            boards = cls.objects.select_for_update().only('id', 'progress', *CARD_COUNT_FIELDS)
+            if board_ids is not None:
+                boards = boards.filter(id__in=board_ids)
+            boards = list(boards)
+
+            counts = defaultdict(dict)
+            rows = (
+                Card.objects.filter(board__in=[board.id for board in boards])
+                .values('board_id', 'status').annotate(total=Count('id')).order_by()
+            )
+            for row in rows:
+                counts[row['board_id']][f"{row['status'].lower()}_count"] = row['total']
+
+            for board in boards:
+                for field in CARD_COUNT_FIELDS:
+                    setattr(board, field, counts[board.id].get(field, 0))
+                board.progress = cls.compute_progress({field: getattr(board, field) for field in CARD_COUNT_FIELDS})
+            cls.objects.bulk_update(boards, CARD_COUNT_FIELDS + ['progress'], batch_size=500)
+            board_ids = [board.id for board in boards]
+            cls.objects.filter(id__in=board_ids).bump_versions()
+            invalidate_boards(board_ids)
+        return len(boards)
+
     def to_dict(self):
         data = model_to_dict(self, fields=[field.name for field in self._meta.fields])
         
@@ -158,19 +311,190 @@ class Card(models.Model):
     )
     board = models.ForeignKey(Board, related_name="cards", on_delete=models.CASCADE)
     members = models.ManyToManyField(TheUser, related_name="tasks")
+    # Also bumped when card members change. Used by the changes feed.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Cards of a board by status (columns, counters)
+            models.Index(fields=['board', 'status'], name='card_board_status_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember stored values to know what a later save changes
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_loaded_value(self, attname):
+        # Value of the field as it is stored in database, None for a new card
+        if self._state.adding:
+            return None
+        loaded = getattr(self, '_loaded_values', {})
+        if attname not in loaded or loaded[attname] is models.DEFERRED:
+            loaded.update(Card.objects.filter(pk=self.pk).values(attname).first() or {attname: None})
+            self._loaded_values = loaded
+        return loaded[attname]
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = (None, None)
+            if not self._state.adding:
+                # Stored board and status, locked until the counters are adjusted so that concurrent saves
+                # of the card count from each other's result and not from a stale snapshot
+                stored = Card.objects.select_for_update().filter(pk=self.pk).values_list('board_id', 'status').first()
+                if stored is not None:
+                    previous = stored
+                    # post_save receivers compare with these
+                    self._loaded_values = {**getattr(self, '_loaded_values', {}), 'board_id': stored[0], 'status': stored[1]}
+            super().save(*args, **kwargs)
+            # Keep board card counters up to date in the same transaction as the card
+            if previous == (self.board_id, self.status):
+                Board.objects.filter(id=self.board_id).bump_versions()
+            elif previous[0] == self.board_id:
+                Board.adjust_card_counts(self.board_id, {previous[1]: -1, self.status: 1})
+            else:
+                if previous[0] is not None:
+                    Board.adjust_card_counts(previous[0], {previous[1]: -1})
+                Board.adjust_card_counts(self.board_id, {self.status: 1})
+        self.remember_loaded_values()
+
+    def remember_loaded_values(self):
+        # To call once the current values are stored in database
+        self._loaded_values = {field.attname: getattr(self, field.attname) for field in self._meta.concrete_fields}
+
+
+# Sent with the (id, board_id) pairs of deleted messages. Messages have no delete receivers, so that boards and users
+# delete theirs without loading them one by one: receivers of this signal and of board and user deletions do it.
+# archived is True for messages moved to the archive (see api/archive.py), which are not deleted for clients.
+messages_deleted = Signal()
+
+
+class MessageQuerySet(models.QuerySet):
+    def delete(self, archived=False):
+        with transaction.atomic():
+            deleted = list(self.values_list('id', 'board_id'))
+            result = super().delete()
+            messages_deleted.send(sender=Message, messages=deleted, archived=archived)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
 
 class Message(models.Model):
     board = models.ForeignKey(Board, related_name="messages", on_delete=models.CASCADE)
     date_sent = models.DateTimeField(auto_now_add=True, blank=True)
     sent_by = models.ForeignKey(TheUser, related_name='sent_messages', on_delete=models.CASCADE)
     content = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Matches the keyset pagination of a board's history
+            models.Index(fields=['board', 'date_sent', 'id'], name='message_board_date_sent_idx'),
+        ]
+
+    objects = MessageQuerySet.as_manager()
 
     def __str__(self):
         return f"{str(self.board)} {self.sent_by}"
- 
 
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            deleted = [(self.pk, self.board_id)]
+            result = super().delete(*args, **kwargs)
+            messages_deleted.send(sender=Message, messages=deleted)
+        return result
+
+
+class TombstoneKind(models.TextChoices):
+    BOARD = 'board', 'Board'
+    CARD = 'card', 'Card'
+    MESSAGE = 'message', 'Message'
 
+
+class Tombstone(models.Model):
+    """
+    Trace of a board, card or message that disappeared, returned by the changes feed.
+    Without user the object was deleted for everyone. With a user it only left what this user can see
+    (user removed from the card or the board).
+    """
+    kind = models.CharField(max_length=10, choices=TombstoneKind.choices)
+    object_id = models.PositiveIntegerField()
+    user = models.ForeignKey(TheUser, related_name='+', null=True, blank=True, on_delete=models.CASCADE)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+    @classmethod
+    def record(cls, kind, object_ids, user_ids=(None,)):
+        cls.record_pairs(kind, [(object_id, user_id) for object_id in object_ids for user_id in user_ids])
+
+    @classmethod
+    def record_pairs(cls, kind, pairs):
+        # One insert for (object_id, user_id) pairs, user_id None for objects deleted for everyone
+        if pairs:
+            cls.objects.bulk_create([cls(kind=kind, object_id=object_id, user_id=user_id) for object_id, user_id in pairs])
+
+
+class SearchKind(models.TextChoices):
+    CARD = 'card', 'Card'
+    MESSAGE = 'message', 'Message'
+
+
+class SearchPosting(models.Model):
+    """
+    Inverted index of card titles and descriptions and message contents: one row per (term, document).
+    Kept up to date by signals, see api/search.py.
+    """
+    term = models.CharField(max_length=64)
+    kind = models.CharField(max_length=10, choices=SearchKind.choices)
+    object_id = models.PositiveIntegerField()
+    # Board of the document, to apply membership rules without loading documents
+    board = models.ForeignKey(Board, related_name='+', on_delete=models.CASCADE)
+    # Frequency of the term in the document normalized by the document length
+    weight = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'kind', 'board'], name='search_term_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_document_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.term} {self.kind} {self.object_id}"
+
+
+class MessageArchive(models.Model):
+    """
+    Segment of old messages of a board moved out of the Message table, see api/archive.py.
+    Messages are stored oldest first as zlib compressed JSON rows. The messages of a board that are still in the
+    Message table are always newer than its archived ones.
+    """
+    board = models.ForeignKey(Board, related_name='message_archives', on_delete=models.CASCADE)
+    # Position of the first and last message, in the (date_sent, id) order of the history
+    first_date = models.DateTimeField()
+    first_id = models.PositiveIntegerField()
+    last_date = models.DateTimeField()
+    last_id = models.PositiveIntegerField()
+    # Id range of the messages, to find an archived message by id
+    min_id = models.PositiveIntegerField()
+    max_id = models.PositiveIntegerField()
+    count = models.PositiveIntegerField()
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['board', 'last_date', 'last_id'], name='archive_board_position_idx'),
+            models.Index(fields=['min_id', 'max_id'], name='archive_id_range_idx'),
+        ]
+
+    def __str__(self):
+        return f"{str(self.board)} {self.first_date} - {self.last_date} ({self.count})"
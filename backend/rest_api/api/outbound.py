@@ -0,0 +1,105 @@
+"""
+Outbound queue of a WebSocket connection. Consumers queue their frames and a task of the connection writes them,
+so that a slow client does not stop its consumer from reading the channel layer (where channels_redis would drop
+events past its capacity). Queued frames are kept short:
+- coalesce: a frame whose key is already queued replaces the queued one in place (status of a card).
+- supersede: a frame whose key is already queued drops the queued one and goes to the end (inbox of a board).
+- release: keys a frame also carries (cards of a bulk update). Queued frames with these keys are no longer
+  coalesced, later frames with them go after this one and are not written before it.
+- A client with more than WEBSOCKET_QUEUE_MAX_SIZE frames waiting is too far behind, it is disconnected with
+  close code 4008 and reloads what it missed when it reconnects.
+Frames waiting in the process are the websocket.queued_frames gauge, next to coalesced, superseded, sent and
+slow_disconnects counters.
+"""
+import asyncio
+import threading
+from collections import deque
+from .metrics import metrics
+
+SLOW_CLIENT_CLOSE_CODE = 4008
+
+# Frames waiting in every queue of the process
+queued_lock = threading.Lock()
+queued_total = 0
+
+
+def count_queued(delta):
+    global queued_total
+    with queued_lock:
+        queued_total += delta
+        metrics.gauge('websocket.queued_frames', queued_total)
+
+
+class OutboundQueue:
+    def __init__(self, write, on_overflow, max_size):
+        # write(frame) sends a frame to the socket, on_overflow() is awaited once when the client is too far behind
+        self.write = write
+        self.on_overflow = on_overflow
+        self.max_size = max_size
+        # Entries are [key, frame] lists, queued keys point to their entry
+        self.entries = deque()
+        self.keys = {}
+        self.ready = asyncio.Event()
+        self.stopped = False
+        self.task = asyncio.ensure_future(self.run())
+
+    def put(self, frame, coalesce=None, supersede=None, release=()):
+        if self.stopped:
+            return
+        for released in release:
+            entry = self.keys.pop(released, None)
+            if entry is not None:
+                entry[0] = None
+        key = coalesce or supersede
+        entry = self.keys.get(key) if key is not None else None
+        if entry is not None and coalesce is not None:
+            entry[1] = frame
+            metrics.increment('websocket.frames_coalesced')
+            return
+        if entry is not None:
+            self.entries.remove(entry)
+            count_queued(-1)
+            metrics.increment('websocket.frames_superseded')
+        entry = [key, frame]
+        self.entries.append(entry)
+        if key is not None:
+            self.keys[key] = entry
+        count_queued(1)
+        if len(self.entries) > self.max_size:
+            metrics.increment('websocket.slow_disconnects')
+            self.stop()
+            asyncio.ensure_future(self.on_overflow())
+            return
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            if not self.entries:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+            entry = self.entries.popleft()
+            if entry[0] is not None:
+                del self.keys[entry[0]]
+            count_queued(-1)
+            try:
+                await self.write(entry[1])
+            except Exception:
+                # The socket is gone, its consumer is being disconnected
+                metrics.increment('websocket.write_errors')
+                self.stop()
+                return
+            metrics.increment('websocket.frames_sent')
+
+    def __len__(self):
+        return len(self.entries)
+
+    def stop(self):
+        # Frames still queued are dropped
+        if self.stopped:
+            return
+        self.stopped = True
+        self.task.cancel()
+        count_queued(-len(self.entries))
+        self.entries.clear()
+        self.keys.clear()
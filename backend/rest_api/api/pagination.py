@@ -0,0 +1,179 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class PageSizePagination(BasePagination):
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+
+class MessageCursorPagination(PageSizePagination):
+    """
+    Keyset pagination of messages on (date_sent, id). Pages are read with an index range
+    instead of an OFFSET, so deep pages cost the same as the first one.
+    Query parameters:
+    - page_size: number of messages per page
+    - before: cursor returning the messages older than it (the latest messages without cursor)
+    - after: cursor returning the messages newer than it
+    Pagination is only applied when one of them is given. Each page is sorted from oldest to newest.
+    Views with a read_archive(before, after, limit) method continue the history with archived messages,
+    which are older than the messages of the queryset. Cursors of archived messages are flagged as such.
+    """
+    before_query_param = 'before'
+    after_query_param = 'after'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if not any(param in params for param in (self.page_size_query_param, self.before_query_param, self.after_query_param)):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        before = self.decode_cursor(params.get(self.before_query_param))
+        after = self.decode_cursor(params.get(self.after_query_param))
+
+        read_archive = getattr(view, 'read_archive', None)
+        messages = []
+        if after is not None:
+            date_sent, message_id, archived = after
+            if archived and read_archive is not None:
+                messages = read_archive(after=(date_sent, message_id), limit=self.page_size + 1)
+            if len(messages) <= self.page_size:
+                messages += list(self.newer_than(queryset, (date_sent, message_id))[:self.page_size + 1 - len(messages)])
+            self.has_newer = len(messages) > self.page_size
+            self.has_older = True
+            messages = messages[:self.page_size]
+        else:
+            position = before[:2] if before is not None else None
+            if before is None or not before[2]:
+                messages = list(self.older_than(queryset, position)[:self.page_size + 1])
+            # The archive is only read once the messages of the queryset run out
+            if len(messages) <= self.page_size and read_archive is not None:
+                messages += read_archive(before=position, limit=self.page_size + 1 - len(messages))
+            self.has_older = len(messages) > self.page_size
+            self.has_newer = before is not None
+            messages = messages[:self.page_size][::-1]
+
+        self.page = messages
+        return messages
+
+    def older_than(self, queryset, position):
+        # Messages before the (date_sent, id) position, all of them without position, newest first
+        if position is not None:
+            date_sent, message_id = position
+            queryset = queryset.filter(date_sent__lte=date_sent).filter(Q(date_sent__lt=date_sent) | Q(id__lt=message_id))
+        return queryset.order_by('-date_sent', '-id')
+
+    def newer_than(self, queryset, position):
+        # Messages after the (date_sent, id) position, oldest first
+        date_sent, message_id = position
+        return queryset.filter(date_sent__gte=date_sent).filter(Q(date_sent__gt=date_sent) | Q(id__gt=message_id)).order_by('date_sent', 'id')
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('previous', self.get_previous_link()),
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_previous_link(self):
+        if not self.page or not self.has_older:
+            return None
+        return self.build_link(self.before_query_param, self.after_query_param, self.page[0])
+
+    def get_next_link(self):
+        if not self.page or not self.has_newer:
+            return None
+        return self.build_link(self.after_query_param, self.before_query_param, self.page[-1])
+
+    def build_link(self, param, other_param, message):
+        url = remove_query_param(self.request.build_absolute_uri(), other_param)
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(url, param, self.encode_cursor(message))
+
+    def encode_cursor(self, message):
+        position = f"{message.date_sent.isoformat()}|{message.id}"
+        if getattr(message, 'archived', False):
+            position += '|archived'
+        return urlsafe_b64encode(position.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        # (date_sent, id, archived)
+        if not cursor:
+            return None
+        try:
+            date_sent, message_id, *flags = urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+            if flags not in ([], ['archived']):
+                raise ValueError(flags)
+            return datetime.fromisoformat(date_sent), int(message_id), bool(flags)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class ChangesFeedPagination(PageSizePagination):
+    """
+    Pagination of the changes feed. Several sources, each a (name, queryset, timestamp field) tuple, are read
+    in the order of (timestamp, source index, id) and the sync token is the position of the last returned row.
+    Every source is read with an index range from that position, as for messages.
+    """
+    page_size = 100
+    max_page_size = 500
+    since_query_param = 'since'
+    invalid_token_message = 'Invalid sync token'
+
+    def paginate_sources(self, sources, request):
+        self.page_size = self.get_page_size(request)
+        token = request.query_params.get(self.since_query_param)
+        self.position = self.decode_token(token)
+
+        rows = []
+        for index, (name, queryset, field) in enumerate(sources):
+            if self.position is not None:
+                queryset = queryset.filter(self.after_position(index, field))
+            for obj in queryset.order_by(field, 'id')[:self.page_size + 1]:
+                rows.append(((getattr(obj, field), index, obj.id), name, obj))
+
+        rows.sort(key=lambda row: row[0])
+        self.has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        # Nothing changed: the client keeps its token
+        self.token = self.encode_token(rows[-1][0]) if rows else token
+        return [(name, obj) for _, name, obj in rows]
+
+    def after_position(self, index, field):
+        timestamp, position_index, position_id = self.position
+        if index < position_index:
+            return Q(**{f'{field}__gt': timestamp})
+        if index == position_index:
+            return Q(**{f'{field}__gt': timestamp}) | Q(**{field: timestamp, 'id__gt': position_id})
+        return Q(**{f'{field}__gte': timestamp})
+
+    def encode_token(self, position):
+        timestamp, index, obj_id = position
+        return urlsafe_b64encode(f"{timestamp.isoformat()}|{index}|{obj_id}".encode('utf-8')).decode('ascii')
+
+    def decode_token(self, token):
+        if not token:
+            return None
+        try:
+            timestamp, index, obj_id = urlsafe_b64decode(token.encode('ascii')).decode('utf-8').split('|')
+            return datetime.fromisoformat(timestamp), int(index), int(obj_id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_token_message)
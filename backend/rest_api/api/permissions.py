@@ -1,5 +1,6 @@
 from rest_framework import permissions
 from .models import Card, Board, Message
+from .membership import get_membership
 
 class IsAdminOrCardMember(permissions.BasePermission):
     """
@@ -10,7 +11,14 @@ class IsAdminOrCardMember(permissions.BasePermission):
     """
     def has_permission(self, request, view):
         # Allow authenticated users, we'll do more specific checks in has_object_permission
-        return request.user.is_authenticated
+        if not request.user.is_authenticated:
+            return False
+        # Card members can only change the status of cards in bulk, the view only finds cards they belong to
+        if view.action == 'bulk' and not getattr(request.user, 'is_admin', False):
+            return isinstance(request.data, list) and all(
+                isinstance(item, dict) and set(item.keys()) == {'id', 'status'} for item in request.data
+            )
+        return True
 
     def has_object_permission(self, request, view, obj):
         # Allow admin users full access
@@ -18,7 +26,7 @@ class IsAdminOrCardMember(permissions.BasePermission):
             return True
         
         # For card members
-        if isinstance(obj, Card) and request.user in obj.members.all():
+        if isinstance(obj, Card) and get_membership(request).is_card_member(obj):
             # Allow GET requests (read access)
             if request.method == 'GET' and view.action in ['retrieve', 'list']:
                 return True
@@ -29,6 +37,14 @@ class IsAdminOrCardMember(permissions.BasePermission):
         # Deny access for non-members
         return False
 
+class IsAdmin(permissions.BasePermission):
+    """
+    Only admins.
+    """
+
+    def has_permission(self, request, view):
+        return request.user.is_authenticated and getattr(request.user, 'is_admin', False)
+
 class IsMemberOfBoardOrAdmin(permissions.BasePermission):
     """
     Custom permission to only allow members of a board or admins to view it.
@@ -46,12 +62,8 @@ class IsMemberOfBoardOrAdmin(permissions.BasePermission):
             return False
         if getattr(request.user, 'is_admin', False):
             return True
-        return self.is_member_of_board(request.user, obj)
-
-    def is_member_of_board(self, user, board):
-        # Check if the user is a member of any card in the board
-        cards = Card.objects.filter(board=board)
-        return any(user in card.members.all() for card in cards)
+        # Board members are the members of its cards
+        return get_membership(request).is_board_member(obj)
 
 class IsBoardMemberOrAdminForMessage(permissions.BasePermission):
     """
@@ -63,7 +75,10 @@ class IsBoardMemberOrAdminForMessage(permissions.BasePermission):
 
     def has_permission(self, request, view):
         # Allow authenticated boards members to only retrieve, list and create message
-        if view.action in ['create', 'retrieve', 'list', 'latest_messages']:
+        if view.action == 'create' and request.user.is_authenticated:
+            board = request.data.get('board') if isinstance(request.data, dict) else None
+            return get_membership(request).can_access_board(board)
+        if view.action in ['retrieve', 'list', 'latest_messages']:
             return request.user.is_authenticated
         # Allow authenticated admins to all actions.
         return request.user.is_authenticated and getattr(request.user, 'is_admin', False)
@@ -75,12 +90,9 @@ class IsBoardMemberOrAdminForMessage(permissions.BasePermission):
 
         # For board members
         if isinstance(obj, Message):
-            return self.is_board_member(request.user, obj.board)
+            return get_membership(request).is_board_member(obj.board_id)
         elif isinstance(obj, Board):
-            return self.is_board_member(request.user, obj)
+            return get_membership(request).is_board_member(obj)
 
         # Deny access for non-members
-        return False
-
-    def is_board_member(self, user, board):
-        return user in board.members.all()
\ No newline at end of file
+        return False
\ No newline at end of file
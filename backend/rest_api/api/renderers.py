@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models.fields.files import FieldFile
+from django.utils.timezone import is_aware
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.exceptions import ParseError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Date and image fields json encoder used when sending message to connected clients.
+class CombinedEncoder(DjangoJSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, FieldFile):
+            try:
+                return obj.url
+            except ValueError:
+                return None
+        elif isinstance(obj, datetime):
+            if is_aware(obj):
+                obj = obj.astimezone()
+            return obj.isoformat()
+        return super().default(obj)
+
+
+def use_orjson():
+    # API_JSON_BACKEND = 'json' forces the standard library, orjson is only used when installed
+    return orjson is not None and getattr(settings, 'API_JSON_BACKEND', 'orjson') == 'orjson'
+
+
+if orjson is not None:
+    # Dates go through the encoders' default() so that their output is unchanged, everything else is encoded in C
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(data):
+    """
+    Text of a WebSocket frame, same as json.dumps(data, cls=CombinedEncoder).
+    """
+    if use_orjson():
+        return orjson.dumps(data, default=CombinedEncoder().default, option=ORJSON_OPTIONS).decode('utf-8')
+    return json.dumps(data, cls=CombinedEncoder)
+
+
+def loads(data):
+    if use_orjson():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding with orjson when available. The output is the same as the default renderer:
+    compact, unescaped unicode except U+2028 and U+2029, other types handled by encoder_class.
+    Indented output (`; indent=` in the Accept header) is left to the default renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None or not use_orjson() or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=ORJSON_OPTIONS)
+        except TypeError:
+            # Integers over 64 bits for instance, let the default renderer handle or report them
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode('utf-8'), b'\\u2028').replace('\u2029'.encode('utf-8'), b'\\u2029')
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser decoding with orjson when available. Only UTF-8 bodies, the JSON default, take the fast path.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if not use_orjson() or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -5,5 +5,7 @@ websocket_urlpatterns = [
     re_path(r"^ws/chat/(?P<board_id>\w+)/$", ChatConsumer.as_asgi()),
     re_path(r'ws/latest_message_update/$', MessageHomeConsumer.as_asgi()),
     re_path(r'ws/cards_status_update/(?P<board_id>\w+)/$', CardTaskConsumer.as_asgi()),
-    re_path(r'ws/echo/$', EchoConsumer.as_asgi())
+    re_path(r'ws/echo/$', EchoConsumer.as_asgi()),
+    # Every board and inbox stream of a client on one socket
+    re_path(r'ws/multiplex/$', MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Full-text search over card titles and descriptions and message contents.
+Documents are split into normalized terms (lowercase, without accents) stored in SearchPosting, an inverted index
+updated by signals when a card or a message is saved. A search returns the documents containing every term of
+the query, ranked by the sum of the TF-IDF weight of the terms, with highlighted snippets.
+It only relies on plain tables and indexes, so it behaves the same on MySQL and on SQLite.
+"""
+import math
+import re
+import unicodedata
+from collections import Counter
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, Max, Q, Sum, Value, When
+from django.utils.html import escape
+from .models import Card, Message, SearchKind, SearchPosting
+
+WORD_RE = re.compile(r'\w+')
+TERM_MAX_LENGTH = 64
+# Title words count as many times their description counterparts
+TITLE_WEIGHT = 3
+# Characters kept around the first match of a snippet
+SNIPPET_RADIUS = 60
+HIGHLIGHT_START, HIGHLIGHT_END = '<mark>', '</mark>'
+
+
+def normalize(word):
+    # "Étape" and "etape" are the same term
+    word = unicodedata.normalize('NFKD', word.lower())
+    return ''.join(char for char in word if not unicodedata.combining(char))[:TERM_MAX_LENGTH]
+
+
+def tokenize(text):
+    return [normalize(match.group()) for match in WORD_RE.finditer(text or '')]
+
+
+def document_fields(kind, obj):
+    # (field name, text, weight) of a document
+    if kind == SearchKind.CARD:
+        return [('title', obj.title, TITLE_WEIGHT), ('description', obj.description, 1)]
+    return [('content', obj.content, 1)]
+
+
+def document_postings(kind, obj):
+    frequencies, length = Counter(), 0
+    for _, text, weight in document_fields(kind, obj):
+        terms = tokenize(text)
+        length += len(terms)
+        for term in terms:
+            frequencies[term] += weight
+    norm = math.sqrt(length) or 1
+    return [
+        SearchPosting(term=term, kind=kind, object_id=obj.pk, board_id=obj.board_id, weight=frequency / norm)
+        for term, frequency in frequencies.items()
+    ]
+
+
+def index_documents(kind, objects):
+    # Replace the postings of the documents, in two queries whatever their number
+    objects = list(objects)
+    if not objects:
+        return
+    with transaction.atomic():
+        SearchPosting.objects.filter(kind=kind, object_id__in=[obj.pk for obj in objects]).delete()
+        SearchPosting.objects.bulk_create([posting for obj in objects for posting in document_postings(kind, obj)], batch_size=1000)
+
+
+def remove_documents(kind, object_ids):
+    SearchPosting.objects.filter(kind=kind, object_id__in=list(object_ids)).delete()
+
+
+def highlight(text, terms):
+    """
+    Escaped snippet of text around its first matching word, matching words wrapped in <mark> tags.
+    None when no word matches.
+    """
+    matches = [match for match in WORD_RE.finditer(text or '') if normalize(match.group()) in terms]
+    if not matches:
+        return None
+    start = max(0, matches[0].start() - SNIPPET_RADIUS)
+    end = min(len(text), matches[0].end() + SNIPPET_RADIUS)
+    parts, position = [], start
+    for match in matches:
+        if match.start() >= end:
+            break
+        parts += [escape(text[position:match.start()]), HIGHLIGHT_START, escape(match.group()), HIGHLIGHT_END]
+        position = match.end()
+    parts.append(escape(text[position:end]))
+    return ('…' if start > 0 else '') + ''.join(parts) + ('…' if end < len(text) else '')
+
+
+def search(membership, query, kinds=None, board_id=None, limit=20):
+    """
+    Ranked documents matching every term of the query that the user of membership (a MembershipResolver) can see:
+    cards they are a member of and messages of their boards, everything for admins.
+    Returns (kind, document, score, highlights) tuples.
+    """
+    terms = list(dict.fromkeys(term for term in tokenize(query) if term))
+    if not terms:
+        return []
+
+    postings = SearchPosting.objects.filter(term__in=terms)
+    if kinds:
+        postings = postings.filter(kind__in=kinds)
+    if board_id is not None:
+        postings = postings.filter(board_id=board_id)
+    if not membership.is_admin:
+        postings = postings.filter(
+            Q(kind=SearchKind.CARD, object_id__in=membership.card_ids)
+            | Q(kind=SearchKind.MESSAGE, board_id__in=membership.board_ids)
+        )
+
+    # Rare terms weigh more. The number of documents is estimated from the largest ids, an index lookup.
+    frequencies = dict(SearchPosting.objects.filter(term__in=terms).values_list('term').annotate(total=Count('id')).order_by())
+    if len(frequencies) < len(terms):
+        return []
+    documents = sum(model.objects.aggregate(last=Max('id'))['last'] or 0 for model in (Card, Message))
+    idf = {term: math.log(1 + documents / frequency) for term, frequency in frequencies.items()}
+
+    rows = (
+        postings.values('kind', 'object_id')
+        .annotate(
+            matched=Count('id'),
+            score=Sum(Case(
+                *[When(term=term, then=F('weight') * Value(weight)) for term, weight in idf.items()],
+                output_field=FloatField(),
+            )),
+        )
+        .filter(matched=len(terms))
+        .order_by('-score', 'kind', '-object_id')[:limit]
+    )
+    rows = list(rows)
+
+    loaded = {
+        SearchKind.CARD: Card.objects.prefetch_related('members').in_bulk([row['object_id'] for row in rows if row['kind'] == SearchKind.CARD]),
+        SearchKind.MESSAGE: Message.objects.in_bulk([row['object_id'] for row in rows if row['kind'] == SearchKind.MESSAGE]),
+    }
+    results = []
+    for row in rows:
+        obj = loaded[row['kind']].get(row['object_id'])
+        if obj is None:
+            # Deleted meanwhile
+            continue
+        highlights = {}
+        for name, text, _ in document_fields(row['kind'], obj):
+            snippet = highlight(text, set(terms))
+            if snippet is not None:
+                highlights[name] = snippet
+        results.append((row['kind'], obj, row['score'], highlights))
+    return results
@@ -1,15 +1,15 @@
 from rest_framework import serializers
 from .models import Board, Card, TheUser, Message
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from .authentication import add_user_claims
 
 class SignInSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
 
-        # Add custom claims if needed
-        token['email'] = user.email
-        return token
+        # Requests build their user from these claims instead of loading it
+        return add_user_claims(token, user)
 
     def validate(self, attrs):
         # Use email to authenticate instead of username
@@ -18,32 +18,68 @@ class SignInSerializer(TokenObtainPairSerializer):
             attrs["username"] = user.email  # trick the default behavior
         return super().validate(attrs)
 
-class TheUserSerializer(serializers.ModelSerializer):
+class ExpandableFieldsMixin:
+    """
+    Serializer mixin returning related objects as primary keys unless they are asked for:
+    - expand: names of the related fields to nest, dotted names expand deeper levels (e.g. `board.members`)
+    - fields: names of the only fields to keep in the output
+    """
+    # field name -> (serializer class, keyword arguments) used when the field is expanded
+    expandable_fields = {}
+
+    def __init__(self, *args, expand=None, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = set(expand or [])
+        for name, (serializer_class, options) in self.expandable_fields.items():
+            nested = [path.split('.', 1)[1] for path in expand if path.startswith(f'{name}.')]
+            if name in expand or nested:
+                self.fields[name] = serializer_class(expand=nested, read_only=True, **options)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class TheUserSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = TheUser
         fields =  ['id', 'first_name', 'last_name', 'is_admin', 'email']
 
 
-class BoardSerializer(serializers.ModelSerializer):
-    members = TheUserSerializer(many=True, read_only=True)
-    
+class BoardSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    members = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    expandable_fields = {
+        'members': (TheUserSerializer, {'many': True}),
+    }
+
     class Meta:
         model = Board
-        fields = '__all__'
+        # The last message pointer changes with every message without changing the board version,
+        # inboxes read it from the latest messages endpoint
+        exclude = ['last_message']
+        # Maintained from card writes
+        read_only_fields = [
+            'progress', 'todo_count', 'doing_count', 'blocked_count', 'done_count', 'version', 'updated_at'
+        ]
 
 
-class MessageSerializer(serializers.ModelSerializer):
-    board = BoardSerializer()
-    sent_by = TheUserSerializer()
+class MessageSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {
+        'board': (BoardSerializer, {}),
+        'sent_by': (TheUserSerializer, {}),
+    }
 
     class Meta:
         model = Message
         fields = '__all__'
 
-class CardSerializer(serializers.ModelSerializer):
-    board =  serializers.PrimaryKeyRelatedField(queryset=Board.objects.all(), write_only=True)
-    board_details = BoardSerializer(source='board', read_only=True)
-    members = TheUserSerializer(many=True, read_only=True)
+class CardSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    board = serializers.PrimaryKeyRelatedField(queryset=Board.objects.all())
+    board_details = serializers.PrimaryKeyRelatedField(source='board', read_only=True)
+    members = serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+    expandable_fields = {
+        'board_details': (BoardSerializer, {'source': 'board'}),
+        'members': (TheUserSerializer, {'many': True}),
+    }
 
     # This is an extra field not in the model, used only for input
     emails = serializers.ListField(
@@ -54,7 +90,7 @@ class CardSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Card
-        fields = ['id', 'title', 'priority', 'status', 'start_date', 'due_date', 'board', 'board_details', 'description', 'members', 'emails']  # Matching the Card model fields
+        fields = ['id', 'title', 'priority', 'status', 'start_date', 'due_date', 'board', 'board_details', 'description', 'members', 'emails', 'updated_at']  # Matching the Card model fields
 
     
     def create(self, validated_data):
@@ -79,3 +115,27 @@ class CardSerializer(serializers.ModelSerializer):
 
 
 
+
+
+class PreloadedBoardField(serializers.PrimaryKeyRelatedField):
+    # Boards are looked up in context['boards'], loaded with one query for all the items of a bulk request
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            board = self.context['boards'].get(int(data))
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if board is None:
+            self.fail('does_not_exist', pk_value=data)
+        return board
+
+
+class CardBulkSerializer(CardSerializer):
+    """
+    CardSerializer for the items of CardViewSet.bulk: no query per item, the view checks titles for the whole bulk.
+    """
+    board = PreloadedBoardField(queryset=Board.objects.all())
+
+    class Meta(CardSerializer.Meta):
+        extra_kwargs = {'title': {'validators': []}}
@@ -1,69 +1,290 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, m2m_changed
+from django.db import transaction
+from django.db.models import IntegerField, OuterRef, Subquery, Value
 from django.dispatch import receiver, Signal
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
-from .models import Message, Card, TheUser
+from .models import Message, Card, TheUser, Board, Tombstone, TombstoneKind, SearchKind, deleting_board_ids, messages_deleted
+from .search import index_documents, remove_documents
+from .broadcast import broadcaster, card_events, latest_message_sends
+from .caching import invalidate_boards
+from .authentication import user_cache
+from django.utils import timezone
 import logging
+from collections import defaultdict
 
 
 logger = logging.getLogger('api')
 
+# Fields of a card sent in card_status_update events, in this order
+CARD_EVENT_FIELDS = ('board_id', 'status')
+
+def get_message_data(message, board=None, sent_by=None):
+    # Payload of a new message in WebSocket events. board and sent_by are dicts, built from the message when missing.
+    return {
+        'id': message.id,
+        'board': board if board is not None else message.board.to_dict(),
+        'sent_by': sent_by if sent_by is not None else message.sent_by.to_dict(),
+        'content': message.content,
+        'date_sent': message.date_sent.isoformat()
+    }
+
+
+def get_latest_message_recipients(board_ids):
+    # Ids of the users whose inbox shows the new messages of each board: its members and the admins, in one query
+    members = Board.members.through.objects.filter(board_id__in=board_ids).values_list('theuser_id', 'board_id')
+    # Annotations come after the fields in the SQL, whatever the order of values_list()
+    admins = TheUser.objects.filter(is_admin=True).annotate(any_board=Value(None, output_field=IntegerField())).values_list('id', 'any_board')
+    recipients, admin_ids = defaultdict(set), set()
+    for user_id, board_id in members.order_by().union(admins.order_by(), all=True):
+        (recipients[board_id] if board_id is not None else admin_ids).add(user_id)
+    return {board_id: recipients[board_id] | admin_ids for board_id in board_ids}
+
+
 @receiver(post_save, sender=Message)
-def message_post_save(sender, instance, created, **kwargs):
+def message_post_save(sender, instance, created, raw=False, **kwargs):
     # This function is called whenever a Message instance is saved. 
     # latest_message_update in related Consumer is called went this type of message is sent by signal
+    # Raw saves come from fixtures and chat batches (see api/chat.py), which handle their messages themselves.
+    if created and not raw:
+        message_data = get_message_data(instance)
+        board_id = instance.board_id
+
+        # Sent to all members of the board and to all admin users once committed, without waiting for the sends
+        broadcaster.submit_on_commit(lambda: latest_message_sends(message_data, get_latest_message_recipients([board_id])[board_id]))
+
+
+@receiver(post_save, sender=Message)
+def update_board_last_message(sender, instance, created, raw=False, **kwargs):
+    # Move the board's last message pointer forward. Ids only grow, so an older message never overrides a newer one.
+    # A plain update: the pointer is only read by inboxes, messages leave board versions and cached lists alone.
+    if created and not raw:
+        Board.objects.filter(id=instance.board_id).exclude(last_message_id__gt=instance.id).update(last_message=instance)
+
+
+def messages_created(messages):
+    # What the post_save receivers above and index_message do, for messages inserted in bulk or with raw saves
+    last_messages = {}
+    for message in messages:
+        last_messages[message.board_id] = max(last_messages.get(message.board_id, 0), message.id)
+    for board_id, message_id in last_messages.items():
+        Board.objects.filter(id=board_id).exclude(last_message_id__gt=message_id).update(last_message_id=message_id)
+    index_documents(SearchKind.MESSAGE, messages)
+
+
+@receiver(messages_deleted)
+def reset_board_last_message(sender, messages, **kwargs):
+    # Pointers were set to NULL by the deletion if they targeted these messages, fall back to the latest remaining one.
+    # Once per board, boards being deleted with their messages are not concerned.
+    board_ids = {board_id for _, board_id in messages}
+    latest = Message.objects.filter(board=OuterRef('pk')).order_by('-date_sent', '-id').values('id')[:1]
+    Board.objects.filter(id__in=board_ids, last_message__isnull=True).update(last_message=Subquery(latest))
+
+
+@receiver(post_save, sender=Board)
+def board_saved(sender, instance, created, **kwargs):
+    # A new board is only in the lists of admins until it gets members
+    invalidate_boards([instance.pk], admins=created)
+
+
+@receiver(pre_delete, sender=Board)
+def board_pre_delete(sender, instance, **kwargs):
+    # Board members rows are removed without m2m_changed signal
+    invalidate_boards([instance.pk], user_ids=instance.members.values_list('id', flat=True), admins=True)
+    # Messages are deleted with the board without signals and cards without their own receivers doing anything
+    # (see deleting_board_ids), their tombstones are written at once
+    Tombstone.record(TombstoneKind.MESSAGE, instance.messages.values_list('id', flat=True))
+    Tombstone.record(TombstoneKind.CARD, instance.cards.values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Card)
+def card_saved(sender, instance, created, **kwargs):
+    # Counters and progress of the board changed, and those of the previous board for a card moved to another one.
+    # Card.save() remembers the new values after post_save.
+    board_ids = [instance.board_id]
+    if not created:
+        board_ids.append(instance.get_loaded_value('board_id'))
+    invalidate_boards(board_ids)
+
+
+@receiver(post_save, sender=Card)
+def card_status_updated(sender, instance, created, raw=False, **kwargs):
+    # card_status_update in related Consumer is called when this type of message is sent.
+    # Only for new cards and changes of the fields boards show (see CARD_EVENT_FIELDS), sent after commit and
+    # coalesced per card by api/broadcast.py. Card.save() remembers the new values after post_save.
     if created:
-        channel_layer = get_channel_layer()
-        board = instance.board
-        message_data = {
-            'id': instance.id,
-            'board': instance.board.to_dict(),
-            'sent_by': instance.sent_by.to_dict(),
-            'content': instance.content,
-            'date_sent': instance.date_sent.isoformat()
-        }
-        
-        # Send to all members of the board
-        for member in board.members.all():
+        # Nothing to read back, the card was not stored before
+        before = (None,) * len(CARD_EVENT_FIELDS)
+    else:
+        before = tuple(instance.get_loaded_value(field) for field in CARD_EVENT_FIELDS)
+    after = tuple(getattr(instance, field) for field in CARD_EVENT_FIELDS)
+    if raw or before == after:
+        return
+    card_id = instance.id
+    transaction.on_commit(lambda: card_events.add(card_id, before, after))
+
+
+def cards_bulk_updated(cards):
+    # Send one event per board for cards written together, instead of one per card
+    channel_layer = get_channel_layer()
+    changes = defaultdict(list)
+    for card in cards:
+        changes[card.board_id].append({"card_id": card.id, "new_status": card.status})
+
+    for board_id, board_changes in changes.items():
+        board_name = f"board_{board_id}"
+        try:
             async_to_sync(channel_layer.group_send)(
-                f"user_{member.id}_latest_messages",
+                board_name,
                 {
-                    "type": "latest_message_update",
-                    "message": message_data
+                    "type": "cards_bulk_update",
+                    "board": board_id,
+                    "message": {
+                        "cards": board_changes,
+                    }
                 }
             )
+            logger.debug(f"Message sent successfully to group {board_name}")
+        except Exception as e:
+            logger.error(f"Error sending cards bulk update message: {str(e)}")
 
-         # Send to all admin users
-        admin_users = TheUser.objects.filter(is_admin=True)
-        for admin in admin_users:
-            if admin not in board.members.all():
-                async_to_sync(channel_layer.group_send)(
-                f"user_{admin.id}_latest_messages",
-                {
-                    "type": "latest_message_update",
-                    "message": message_data
-                }
-            )
+
+@receiver(m2m_changed, sender=Card.members.through)
+def card_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Keep board members in sync with the members of its cards, only for the users that changed
+    if action == 'pre_clear':
+        if reverse:
+            instance._cleared_card_ids = set(instance.tasks.values_list('id', flat=True))
+        else:
+            instance._cleared_member_ids = set(instance.members.values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_card_ids' if reverse else '_cleared_member_ids', set())
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    if not pk_set:
+        return
+    removed = action != 'post_add'
+    if reverse:
+        # instance is a user and pk_set holds card ids
+        board_ids = set(Card.objects.filter(id__in=pk_set).values_list('board_id', flat=True))
+        Board.apply_card_changes(member_ids={board_id: [instance.pk] for board_id in board_ids})
+        Card.objects.filter(id__in=pk_set).update(updated_at=timezone.now())
+        if removed:
+            Tombstone.record(TombstoneKind.CARD, pk_set, [instance.pk])
+    else:
+        Board.apply_card_changes(member_ids={instance.board_id: pk_set})
+        Card.objects.filter(id=instance.pk).update(updated_at=timezone.now())
+        if removed:
+            Tombstone.record(TombstoneKind.CARD, [instance.pk], pk_set)
+
+
+@receiver(m2m_changed, sender=Board.members.through)
+def board_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    # Board members are part of its representation
+    if action == 'pre_clear':
+        instance._cleared_ids = set((instance.boards if reverse else instance.members).values_list('id', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = instance._cleared_ids
+    elif action not in ('post_add', 'post_remove'):
+        return
+
+    if not pk_set:
+        return
+    board_ids, user_ids = (pk_set, [instance.pk]) if reverse else ([instance.pk], pk_set)
+    Board.objects.filter(id__in=board_ids).bump_versions()
+    invalidate_boards(board_ids, user_ids=user_ids)
+    if action != 'post_add':
+        # The board, its cards and its messages left what these users can see
+        Tombstone.record(TombstoneKind.BOARD, board_ids, user_ids)
+
+
+def deleted_with_board(card):
+    # Cards of a board being deleted leave the board, its tombstones and its postings to the board receivers
+    return card.board_id in deleting_board_ids.get()
+
+
+@receiver(pre_delete, sender=Card)
+def card_pre_delete(sender, instance, **kwargs):
+    if deleted_with_board(instance):
+        return
+    # Card members rows are removed without m2m_changed signal, remember them to update the board afterwards
+    instance._deleted_member_ids = set(instance.members.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Card)
+def card_post_delete(sender, instance, **kwargs):
+    # Runs inside the deletion transaction
+    if deleted_with_board(instance):
+        return
+    Board.apply_card_changes(
+        deltas={instance.board_id: {instance.status: -1}},
+        member_ids={instance.board_id: getattr(instance, '_deleted_member_ids', set())},
+    )
+
+
+@receiver(post_delete, sender=Board)
+@receiver(post_delete, sender=Card)
+def record_tombstone(sender, instance, **kwargs):
+    if sender is Card and deleted_with_board(instance):
+        return
+    # Tombstone kinds are named after the models
+    Tombstone.record(sender._meta.model_name, [instance.pk])
+
+
+@receiver(messages_deleted)
+def record_message_tombstones(sender, messages, archived=False, **kwargs):
+    # Archived messages are still part of the history, the changes feed keeps them
+    if archived:
+        return
+    Tombstone.record(TombstoneKind.MESSAGE, [message_id for message_id, _ in messages])
 
 
 @receiver(post_save, sender=Card)
-def card_status_updated(sender, instance, created, **kwargs):
-    # This function is called whenever a Message instance is saved. 
-    # card_status_update in related Consumer is called went this type of message is sent by signal
-    try:
-        channel_layer = get_channel_layer()
-        board_name = f"board_{instance.board.id}"
-        
-        async_to_sync(channel_layer.group_send)(
-            board_name,
-            {
-                "type": "card_status_update",
-                "message": {
-                    "card_id": instance.id,
-                    "new_status": instance.status,
-                }
-            }
-        )
-        logger.debug(f"Message sent successfully to group {board_name}")
-    except Exception as e:
-        logger.error(f"Error sending card update message: {str(e)}")
\ No newline at end of file
+def index_card(sender, instance, created, **kwargs):
+    # Search postings only depend on the texts and the board. Card.save() remembers the new values after post_save.
+    fields = ('title', 'description', 'board_id')
+    if created or any(instance.get_loaded_value(field) != getattr(instance, field) for field in fields):
+        index_documents(SearchKind.CARD, [instance])
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, raw=False, **kwargs):
+    # Indexed once the message is committed, the insert does not wait for its postings
+    if not raw:
+        transaction.on_commit(lambda: index_documents(SearchKind.MESSAGE, [instance]))
+
+
+@receiver(post_delete, sender=Card)
+def unindex_document(sender, instance, **kwargs):
+    # Postings of the cards of a deleted board go with the board (SearchPosting.board cascades)
+    if deleted_with_board(instance):
+        return
+    remove_documents(sender._meta.model_name, [instance.pk])
+
+
+@receiver(messages_deleted)
+def unindex_messages(sender, messages, **kwargs):
+    # Postings of the messages of a deleted board go with the board (SearchPosting.board cascades)
+    remove_documents(SearchKind.MESSAGE, [message_id for message_id, _ in messages])
+
+
+@receiver(pre_delete, sender=TheUser)
+def user_pre_delete(sender, instance, **kwargs):
+    # Messages of the user are deleted without signals, see messages_deleted
+    instance._deleted_messages = list(instance.sent_messages.values_list('id', 'board_id'))
+
+
+@receiver(post_delete, sender=TheUser)
+def user_post_delete(sender, instance, **kwargs):
+    deleted = getattr(instance, '_deleted_messages', None)
+    if deleted:
+        messages_deleted.send(sender=Message, messages=deleted)
+
+
+@receiver(post_save, sender=TheUser)
+@receiver(post_delete, sender=TheUser)
+def forget_cached_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
@@ -1,12 +1,48 @@
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
-from rest_framework.test import APITestCase
-from .models import TheUser, Board, Card
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework.request import Request
+from .models import TheUser, Board, Card, Message, MessageArchive, SearchKind, SearchPosting, Tombstone
+from .archive import archive_messages, compact_archives, restore_messages
+from .authentication import UserCache, user_cache
+from .hashing import HashingPool, PoolFull, password_hashing
+from .broadcast import broadcaster, card_events, group_send_many
+from .chat import write_messages
+from .consumers import ChatConsumer, EchoConsumer, MultiplexConsumer
+from .middleware import JwtAuthMiddleware
+from .tickets import RedisTicketStore, ticket_stores
+from .outbound import OutboundQueue
+from .pagination import ChangesFeedPagination, MessageCursorPagination
+from .views import BoardViewSet, CardViewSet, ChangesView, MessageViewSet
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+import msgpack
+from .metrics import metrics
+import asyncio
+import threading
+from rest_framework_simplejwt.tokens import AccessToken
+from .caching import get_or_build
+from .membership import MembershipResolver
+from .renderers import CombinedEncoder, FastJSONRenderer, dumps
+from rest_framework.renderers import JSONRenderer
+from decimal import Decimal
+import json
 from datetime import datetime
+from io import StringIO
 from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext
+from django.test import override_settings
+from django.core.cache import cache
+from unittest import mock
 
 
+# Tests do not share the cache of the development server, and ids of rolled back rows are reused between tests
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
 class BaseAPITestCase(APITestCase):
     # Class-level counter for generating unique emails
     test_counter = 0
@@ -17,6 +53,7 @@ class BaseAPITestCase(APITestCase):
         cls.test_counter = 0
 
     def setUp(self):
+        cache.clear()
         # Increment the counter for each test
         self.__class__.test_counter += 1
 
@@ -309,4 +346,1705 @@ class CardAPITest(BaseAPITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
-# You can similarly refactor MessageAPITest and GroupMessageAPITest
\ No newline at end of file
+# You can similarly refactor MessageAPITest and GroupMessageAPITest
+
+
+class LatestMessagesAPITest(BaseAPITestCase):
+    def create_boards_with_messages(self, count):
+        for i in range(count):
+            board = Board.objects.create(name=f'Inbox Board {Board.objects.count()}')
+            board.members.add(self.user)
+            for j in range(3):
+                Message.objects.create(board=board, sent_by=self.user, content=f'Message {j}')
+
+    def test_board_points_to_last_message(self):
+        self.create_boards_with_messages(1)
+        board = Board.objects.get()
+        last = Message.objects.create(board=board, sent_by=self.admin, content='Last one')
+        board.refresh_from_db()
+        self.assertEqual(board.last_message_id, last.id)
+
+        last.delete()
+        board.refresh_from_db()
+        self.assertEqual(board.last_message_id, Message.objects.filter(board=board).latest('id').id)
+
+    def test_last_message_after_deletions(self):
+        self.create_boards_with_messages(2)
+        board, other_board = Board.objects.order_by('id')
+        with CaptureQueriesContext(connection) as queries:
+            Message.objects.filter(board__in=[board, other_board], content='Message 2').delete()
+        board.refresh_from_db()
+        self.assertEqual(board.last_message_id, Message.objects.filter(board=board).latest('id').id)
+        # Pointers set to NULL by the deletion, then reset once for all the boards
+        board_updates = [query for query in queries if query['sql'].startswith(f"UPDATE {connection.ops.quote_name('api_board')}")]
+        self.assertEqual(len(board_updates), 2)
+
+        # Messages of a deleted board are not loaded one by one
+        with CaptureQueriesContext(connection) as queries:
+            other_board.delete()
+        self.assertFalse([query for query in queries if 'content' in query['sql']])
+
+    def test_latest_messages(self):
+        self.create_boards_with_messages(3)
+        self.authenticate_as_user()
+        response = self.client.get(reverse('users-latest-messages'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        self.assertTrue(all(message['content'] == 'Message 2' for message in response.data))
+
+    def test_latest_messages_query_count(self):
+        # The number of queries must not depend on the number of boards
+        self.authenticate_as_user()
+        for count in [2, 20]:
+            self.create_boards_with_messages(count)
+            # Messages with their boards and senders, board members. The user comes from the token.
+            with self.assertNumQueries(2):
+                self.client.get(reverse('users-latest-messages'), {'expand': 'board,sent_by'})
+
+
+class BoardMembershipTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Membership Board')
+
+    def create_cards(self, count, members):
+        for i in range(count):
+            card = Card.objects.create(title=f'Membership Card {Card.objects.count()}', board=self.board)
+            card.members.set(members)
+        return card
+
+    def test_members_follow_cards(self):
+        other = TheUser.objects.create_user('other@example.com', 'Other', 'User', 'password123')
+        card = self.create_cards(1, [self.user, other])
+        second_card = self.create_cards(1, [other])
+        self.assertEqual(set(self.board.members.all()), {self.user, other})
+
+        card.members.remove(other)
+        self.assertEqual(set(self.board.members.all()), {self.user, other})
+
+        card.members.clear()
+        self.assertEqual(set(self.board.members.all()), {other})
+
+        second_card.delete()
+        self.assertEqual(self.board.members.count(), 0)
+
+    def test_card_moved_to_another_board(self):
+        card = self.create_cards(1, [self.user])
+        new_board = Board.objects.create(name='Another Membership Board')
+        self.authenticate_as_admin()
+        response = self.client.patch(reverse('cards-detail', args=[card.id]), {'board': new_board.id}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.board.members.count(), 0)
+        self.assertEqual(list(new_board.members.all()), [self.user])
+
+    def test_status_update_query_count(self):
+        # Updating a card must not cost more queries on a bigger board
+        self.authenticate_as_user()
+        query_counts = []
+        for count in [2, 30]:
+            card = self.create_cards(count, [self.user])
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.patch(reverse('cards-detail', args=[card.id]), {'status': 'DOING'}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            query_counts.append(len(context.captured_queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+
+
+class BoardCardCountersTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Counters Board')
+
+    def assertCounts(self, todo, doing, blocked, done, progress):
+        self.board.refresh_from_db()
+        self.assertEqual(
+            [self.board.todo_count, self.board.doing_count, self.board.blocked_count, self.board.done_count],
+            [todo, doing, blocked, done]
+        )
+        self.assertEqual(self.board.progress, progress)
+
+    def test_counters_follow_card_writes(self):
+        cards = [Card.objects.create(title=f'Counter Card {i}', board=self.board) for i in range(4)]
+        self.assertCounts(4, 0, 0, 0, 0)
+
+        cards[0].status = 'DONE'
+        cards[0].save()
+        cards[1].status = 'BLOCKED'
+        cards[1].save()
+        cards[1].title = 'Renamed Counter Card'
+        cards[1].save()
+        self.assertCounts(2, 0, 1, 1, 25)
+
+        Card.objects.get(id=cards[2].id).delete()
+        self.assertCounts(1, 0, 1, 1, 33.33)
+
+        other_board = Board.objects.create(name='Other Counters Board')
+        cards[0].board = other_board
+        cards[0].save()
+        self.assertCounts(1, 0, 1, 0, 0)
+        other_board.refresh_from_db()
+        self.assertEqual((other_board.done_count, other_board.progress), (1, 100))
+
+    def test_counters_of_stale_instances(self):
+        card = Card.objects.create(title='Counter Card', board=self.board)
+        first, second = Card.objects.get(id=card.id), Card.objects.get(id=card.id)
+        first.status = 'DOING'
+        first.save()
+        # Loaded while the card was TODO, the counters still start from its stored status
+        second.status = 'DONE'
+        with CaptureQueriesContext(connection) as queries:
+            second.save()
+        self.assertCounts(0, 0, 0, 1, 100)
+        # Both counters of the board are changed at once
+        board_updates = [query for query in queries if query['sql'].startswith(f"UPDATE {connection.ops.quote_name('api_board')}")]
+        self.assertEqual(len(board_updates), 1)
+
+    def test_board_save_keeps_maintained_fields(self):
+        board = Board.objects.get(id=self.board.id)
+        Card.objects.create(title='Counter Card', board=self.board, status='DONE')
+        message = Message.objects.create(board=self.board, sent_by=self.user, content='Counted')
+        version = Board.objects.get(id=self.board.id).version
+        # Loaded before the card and the message
+        board.name = 'Renamed Counters Board'
+        board.save()
+        self.assertCounts(0, 0, 0, 1, 100)
+        self.assertEqual((self.board.name, self.board.last_message_id, self.board.version), ('Renamed Counters Board', message.id, version + 1))
+        self.assertEqual((board.done_count, board.version), (1, version + 1))
+
+    def test_status_update_through_api(self):
+        card = Card.objects.create(title='Counter Card', board=self.board)
+        self.authenticate_as_admin()
+        response = self.client.patch(reverse('cards-detail', args=[card.id]), {'status': 'DONE'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertCounts(0, 0, 0, 1, 100)
+
+    def test_rebuild_board_counters(self):
+        Card.objects.create(title='Counter Card', board=self.board, status='DOING')
+        Board.objects.filter(id=self.board.id).update(todo_count=7, doing_count=0, progress=50)
+        call_command('rebuild_board_counters', stdout=StringIO())
+        self.assertCounts(0, 1, 0, 0, 0)
+
+
+class MessagePaginationTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Pagination Board')
+        self.board.members.add(self.user)
+        self.messages = [
+            Message.objects.create(board=self.board, sent_by=self.user, content=f'Message {i}') for i in range(7)
+        ]
+        # Same timestamp for some messages, the id keeps the order stable
+        Message.objects.filter(id__in=[m.id for m in self.messages[2:5]]).update(date_sent=datetime(2024, 1, 1))
+        Message.objects.filter(id__in=[m.id for m in self.messages[:2]]).update(date_sent=datetime(2023, 1, 1))
+        self.url = reverse('users-list')
+
+    def contents(self, response):
+        return [message['content'] for message in response.data['results']]
+
+    def test_unpaginated_without_parameters(self):
+        self.authenticate_as_user()
+        response = self.client.get(self.url, {'board': self.board.id})
+        self.assertEqual(len(response.data), 7)
+
+    def test_walk_history_backwards_and_forwards(self):
+        self.authenticate_as_user()
+        response = self.client.get(self.url, {'board': self.board.id, 'page_size': 3})
+        self.assertEqual(self.contents(response), ['Message 4', 'Message 5', 'Message 6'])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.contents(response), ['Message 1', 'Message 2', 'Message 3'])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.contents(response), ['Message 0'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.contents(response), ['Message 1', 'Message 2', 'Message 3'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.contents(response), ['Message 4', 'Message 5', 'Message 6'])
+        self.assertIsNone(response.data['next'])
+
+    def test_invalid_cursor(self):
+        self.authenticate_as_user()
+        response = self.client.get(self.url, {'board': self.board.id, 'before': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ExpandableFieldsTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Expand Board')
+        self.card = Card.objects.create(title='Expand Card', board=self.board)
+        self.card.members.set([self.user])
+        self.message = Message.objects.create(board=self.board, sent_by=self.user, content='Hello')
+
+    def test_related_objects_are_ids_by_default(self):
+        self.authenticate_as_user()
+        response = self.client.get(reverse('users-detail', args=[self.message.id]))
+        self.assertEqual(response.data['board'], self.board.id)
+        self.assertEqual(response.data['sent_by'], self.user.id)
+
+        response = self.client.get(reverse('cards-detail', args=[self.card.id]))
+        self.assertEqual(response.data['board_details'], self.board.id)
+        self.assertEqual(response.data['members'], [self.user.id])
+
+    def test_expand(self):
+        self.authenticate_as_user()
+        url = reverse('users-detail', args=[self.message.id])
+        response = self.client.get(url, {'expand': 'board.members,sent_by'})
+        self.assertEqual(response.data['board']['name'], 'Expand Board')
+        self.assertEqual(response.data['board']['members'][0]['email'], self.user.email)
+        self.assertEqual(response.data['sent_by']['email'], self.user.email)
+
+        response = self.client.get(url, {'expand': 'board'})
+        self.assertEqual(response.data['board']['members'], [self.user.id])
+
+        response = self.client.get(reverse('cards-detail', args=[self.card.id]), {'expand': 'board_details,members'})
+        self.assertEqual(response.data['board_details']['id'], self.board.id)
+        self.assertEqual(response.data['members'][0]['email'], self.user.email)
+
+    def test_fields(self):
+        self.authenticate_as_user()
+        response = self.client.get(reverse('cards-list'), {'fields': 'id,status'})
+        self.assertEqual(response.data, [{'id': self.card.id, 'status': 'TODO'}])
+
+
+class QueryBudgetTestCase(BaseAPITestCase):
+    """
+    Reusable harness checking that endpoints run a bounded number of queries whatever the amount of data.
+    Subclasses override seed(size) to add data and call assertQueryBudget for their endpoints:
+    the budget is checked once the data of every size in `sizes` has been added.
+    """
+    sizes = [1, 10]
+
+    def seed(self, size):
+        # Adds nothing, subclasses add `size` more rows of what their endpoints return
+        pass
+
+    def assertQueryBudget(self, url, budget, params=None):
+        for size in self.sizes:
+            self.seed(size)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(
+                len(context), budget,
+                msg=f"{url} {params or ''} ran {len(context)} queries with seed size {size}, budget is {budget}:\n"
+                    + '\n'.join(query['sql'] for query in context.captured_queries)
+            )
+
+
+class EndpointQueryBudgetTest(QueryBudgetTestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Budget Board 0')
+
+    def seed(self, size):
+        start = Board.objects.count()
+        for i in range(start, start + size):
+            board = Board.objects.create(name=f'Budget Board {i}')
+            member = TheUser.objects.create(email=f'budget{i}@example.com', first_name='Budget', last_name='User')
+            for j in range(2):
+                card = Card.objects.create(title=f'Budget Card {i}-{j}', board=board)
+                card.members.set([self.user, member])
+                Card.objects.create(title=f'Budget Card {i}-{j} bis', board=self.board).members.set([self.user, member])
+            Message.objects.create(board=board, sent_by=member, content='Hello')
+            Message.objects.create(board=self.board, sent_by=member, content='Hello')
+
+    def test_boards(self):
+        for authenticate in [self.authenticate_as_admin, self.authenticate_as_user]:
+            authenticate()
+            # The user comes from the token. Lists and card retrieves read board versions for their ETag first.
+            # Board lists also read the visible board ids, seeding drops both from the cache.
+            self.assertQueryBudget(reverse('boards-list'), 4)
+            self.assertQueryBudget(reverse('boards-list'), 4, {'expand': 'members'})
+            self.assertQueryBudget(reverse('boards-detail', args=[self.board.id]), 3, {'expand': 'members'})
+
+    def test_cards(self):
+        for authenticate in [self.authenticate_as_admin, self.authenticate_as_user]:
+            authenticate()
+            self.assertQueryBudget(reverse('cards-list'), 3)
+            self.assertQueryBudget(reverse('cards-list'), 4, {'expand': 'board_details.members,members'})
+            self.assertQueryBudget(reverse('cards-list'), 3, {'board': self.board.id})
+            card = Card.objects.filter(board=self.board).first()
+            self.assertQueryBudget(reverse('cards-detail', args=[card.id]), 4, {'expand': 'board_details,members'})
+
+    def test_messages(self):
+        for authenticate in [self.authenticate_as_admin, self.authenticate_as_user]:
+            authenticate()
+            self.assertQueryBudget(reverse('users-list'), 1, {'board': self.board.id})
+            self.assertQueryBudget(reverse('users-list'), 3, {'board': self.board.id, 'expand': 'board.members,sent_by'})
+            self.assertQueryBudget(reverse('users-list'), 1, {'board': self.board.id, 'page_size': 5})
+            self.assertQueryBudget(reverse('users-latest-messages'), 2, {'expand': 'board.members,sent_by'})
+
+    def test_users(self):
+        self.authenticate_as_user()
+        # The full user, then from the user cache
+        self.assertQueryBudget(reverse('users-me'), 1)
+
+
+class BoardETagTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='ETag Board')
+        self.card = Card.objects.create(title='ETag Card', board=self.board)
+        self.card.members.set([self.user])
+        self.authenticate_as_user()
+
+    def assertNotModified(self, url, etag, expected=True, params=None):
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED if expected else status.HTTP_200_OK)
+        return response
+
+    def test_board_etag(self):
+        url = reverse('boards-detail', args=[self.board.id])
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertNotModified(url, etag)
+        self.assertNotModified(url, etag, expected=False, params={'expand': 'members'})
+
+        self.card.title = 'Renamed ETag Card'
+        self.card.save()
+        response = self.assertNotModified(url, etag, expected=False)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_card_list_etag(self):
+        url = reverse('cards-list')
+        etag = self.client.get(url, {'board': self.board.id})['ETag']
+        self.assertNotModified(url, etag, params={'board': self.board.id})
+
+        other = TheUser.objects.create(email='etag@example.com', first_name='ETag', last_name='User')
+        self.card.members.add(other)
+        self.assertNotModified(url, etag, expected=False, params={'board': self.board.id})
+
+    def test_messages_keep_etags(self):
+        url = reverse('cards-list')
+        etag = self.client.get(url, {'board': self.board.id})['ETag']
+        board_etag = self.client.get(reverse('boards-list'))['ETag']
+        Message.objects.create(board=self.board, sent_by=self.user, content='Not a board change')
+        self.assertNotModified(url, etag, params={'board': self.board.id})
+        self.assertNotModified(reverse('boards-list'), board_etag)
+
+    def test_unchanged_board_is_not_serialized(self):
+        url = reverse('boards-list')
+        etag = self.client.get(url)['ETag']
+        # Nothing, the list is cached and the user comes from the token
+        with self.assertNumQueries(0):
+            self.assertNotModified(url, etag)
+
+
+class CardBulkAPITest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Bulk Board')
+        self.other_board = Board.objects.create(name='Other Bulk Board')
+        self.card = Card.objects.create(title='Bulk Card', board=self.board)
+        self.card.members.set([self.user])
+
+    def post_bulk(self, items):
+        channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch('api.signals.get_channel_layer', return_value=channel_layer):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('cards-bulk'), items, format='json')
+        return response, channel_layer.group_send
+
+    def test_admin_bulk_create_and_update(self):
+        self.authenticate_as_admin()
+        response, group_send = self.post_bulk([
+            {'id': self.card.id, 'status': 'DONE'},
+            {'title': 'Bulk Card 2', 'board': self.board.id, 'emails': [self.admin.email]},
+            {'title': 'Bulk Card 3', 'board': self.other_board.id, 'status': 'DOING'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+
+        self.board.refresh_from_db()
+        self.other_board.refresh_from_db()
+        self.assertEqual((self.board.todo_count, self.board.done_count, self.board.progress), (1, 1, 50))
+        self.assertEqual(self.other_board.doing_count, 1)
+        self.assertEqual(set(self.board.members.all()), {self.user, self.admin})
+        # One event per board
+        self.assertEqual(group_send.call_count, 2)
+
+    def test_bulk_is_validated_as_a_whole(self):
+        self.authenticate_as_admin()
+        response, group_send = self.post_bulk([
+            {'id': self.card.id, 'status': 'DONE'},
+            {'title': 'Bulk Card', 'board': self.board.id},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['err'][0], {})
+        self.assertIn('title', response.data['err'][1])
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.status, 'TODO')
+        group_send.assert_not_called()
+
+    def test_bulk_rejects_repeated_cards(self):
+        self.authenticate_as_admin()
+        response, group_send = self.post_bulk([
+            {'id': self.card.id, 'status': 'DOING'},
+            {'id': self.card.id, 'status': 'DONE'},
+        ])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('id', response.data['err'][0])
+        self.board.refresh_from_db()
+        self.assertEqual((self.board.todo_count, self.board.doing_count, self.board.done_count), (1, 0, 0))
+        group_send.assert_not_called()
+
+    def test_bulk_rejects_malformed_titles(self):
+        self.authenticate_as_admin()
+        response, _ = self.post_bulk([{'title': ['Bulk Card'], 'board': self.board.id}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('title', response.data['err'][0])
+
+    def test_bulk_validation_queries_do_not_grow_with_items(self):
+        self.authenticate_as_admin()
+        items = [{'title': f'Bulk Card {i}', 'board': self.board.id, 'status': 'DOING'} for i in range(2, 12)]
+        items.append({'title': 'Unknown Board Card', 'board': 0})
+        with self.assertNumQueries(2):
+            response, _ = self.post_bulk(items)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('board', response.data['err'][-1])
+
+    def test_member_bulk_status_update(self):
+        self.authenticate_as_user()
+        response, _ = self.post_bulk([{'id': self.card.id, 'status': 'BLOCKED'}])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.blocked_count, 1)
+
+    def test_member_cannot_bulk_update_other_fields(self):
+        self.authenticate_as_user()
+        response, _ = self.post_bulk([{'id': self.card.id, 'status': 'DONE', 'title': 'Renamed Bulk Card'}])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response, _ = self.post_bulk([{'title': 'New Bulk Card', 'board': self.board.id}])
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ChangesFeedTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Sync Board')
+        self.card = Card.objects.create(title='Sync Card', board=self.board)
+        self.card.members.set([self.user])
+        self.message = Message.objects.create(board=self.board, sent_by=self.user, content='Sync message')
+        self.authenticate_as_user()
+
+    def get_changes(self, since=None, **params):
+        if since is not None:
+            params['since'] = since
+        response = self.client.get(reverse('changes'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def ids(self, data, name):
+        return [obj['id'] for obj in data[name]]
+
+    def test_full_then_incremental_sync(self):
+        data = self.get_changes()
+        self.assertEqual(self.ids(data, 'boards'), [self.board.id])
+        self.assertEqual(self.ids(data, 'cards'), [self.card.id])
+        self.assertEqual(self.ids(data, 'messages'), [self.message.id])
+        self.assertFalse(data['has_more'])
+
+        token = data['sync_token']
+        data = self.get_changes(token)
+        self.assertEqual((data['boards'], data['cards'], data['messages']), ([], [], []))
+        self.assertEqual(data['sync_token'], token)
+
+        self.card.status = 'DONE'
+        self.card.save()
+        message_id = self.message.id
+        self.message.delete()
+        data = self.get_changes(token)
+        self.assertEqual(self.ids(data, 'cards'), [self.card.id])
+        self.assertEqual(data['cards'][0]['status'], 'DONE')
+        self.assertEqual(self.ids(data, 'messages'), [])
+        self.assertEqual(data['deleted']['messages'], [message_id])
+
+    def test_deleted_board_tombstones(self):
+        Message.objects.bulk_create([Message(board=self.board, sent_by=self.user, content=f'Sync {i}') for i in range(5)])
+        message_ids = set(Message.objects.filter(board=self.board).values_list('id', flat=True))
+        board_id = self.board.id
+        with CaptureQueriesContext(connection) as queries:
+            self.board.delete()
+        self.assertEqual(set(Tombstone.objects.filter(kind='message').values_list('object_id', flat=True)), message_ids)
+        self.assertEqual(set(Tombstone.objects.exclude(kind='message').values_list('kind', 'object_id')), {('board', board_id), ('card', self.card.id)})
+        # Message tombstones are written at once, not per message
+        tombstone_inserts = [query for query in queries if query['sql'].startswith(f"INSERT INTO {connection.ops.quote_name('api_tombstone')}")]
+        self.assertEqual(len([query for query in tombstone_inserts if "'message'" in query['sql']]), 1)
+
+    def test_deleted_board_cards_are_handled_at_once(self):
+        for i in range(5):
+            Card.objects.create(title=f'Sync Card {i}', board=self.board).members.add(self.user)
+        card_ids = set(Card.objects.filter(board=self.board).values_list('id', flat=True))
+        board_id = self.board.id
+        with CaptureQueriesContext(connection) as queries:
+            self.board.delete()
+        self.assertEqual(set(Tombstone.objects.filter(kind='card').values_list('object_id', flat=True)), card_ids)
+        self.assertFalse(SearchPosting.objects.filter(board_id=board_id).exists())
+        # One tombstone insert for the cards, and no maintenance of the board being deleted
+        tombstone_inserts = [query for query in queries if query['sql'].startswith(f"INSERT INTO {connection.ops.quote_name('api_tombstone')}")]
+        self.assertEqual(len([query for query in tombstone_inserts if "'card'" in query['sql']]), 1)
+        version_bumps = [
+            query for query in queries
+            if query['sql'].startswith(f"UPDATE {connection.ops.quote_name('api_board')}") and 'version' in query['sql']
+        ]
+        self.assertEqual(version_bumps, [])
+        self.assertNotIn('FOR UPDATE', ' '.join(query['sql'] for query in queries))
+
+    def test_deleted_boards_queryset(self):
+        other = Board.objects.create(name='Other Sync Board')
+        other_card = Card.objects.create(title='Other Sync Card', board=other)
+        Board.objects.filter(id__in=[self.board.id, other.id]).delete()
+        self.assertEqual(set(Tombstone.objects.filter(kind='card').values_list('object_id', flat=True)), {self.card.id, other_card.id})
+        self.assertEqual(Tombstone.objects.filter(kind='board').count(), 2)
+
+    def test_pages_with_equal_timestamps(self):
+        Card.objects.bulk_create([Card(title=f'Sync Card {i}', board=self.board) for i in range(6)])
+        for card in Card.objects.filter(title__startswith='Sync Card '):
+            card.members.add(self.user)
+        Card.objects.update(updated_at=timezone.now().replace(microsecond=0))
+
+        card_ids, token, pages = [], None, 0
+        while True:
+            data = self.get_changes(token, page_size=2)
+            card_ids += self.ids(data, 'cards')
+            token, pages = data['sync_token'], pages + 1
+            if not data['has_more']:
+                break
+        self.assertEqual(sorted(card_ids), sorted(Card.objects.values_list('id', flat=True)))
+        self.assertEqual(pages, 5)
+
+    def test_removed_member_gets_tombstones(self):
+        token = self.get_changes()['sync_token']
+        self.card.members.remove(self.user)
+        data = self.get_changes(token)
+        self.assertEqual(data['deleted']['cards'], [self.card.id])
+        self.assertEqual(data['deleted']['boards'], [self.board.id])
+        self.assertEqual(self.ids(data, 'boards'), [])
+
+        self.card.members.add(self.user)
+        data = self.get_changes(token)
+        self.assertEqual(self.ids(data, 'cards'), [self.card.id])
+        self.assertEqual(data['deleted']['cards'], [])
+
+    def test_expired_token(self):
+        token = self.get_changes()['sync_token']
+        Card.objects.update(updated_at=datetime(2020, 1, 1))
+        Board.objects.update(updated_at=datetime(2020, 1, 1))
+        Message.objects.update(updated_at=datetime(2020, 1, 1))
+        old_token = self.get_changes(page_size=1)['sync_token']
+        response = self.client.get(reverse('changes'), {'since': old_token})
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.client.get(reverse('changes'), {'since': token}).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(reverse('changes'), {'since': 'invalid'}).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BoardListCacheTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Cached Board')
+        self.card = Card.objects.create(title='Cached Card', board=self.board)
+        self.card.members.set([self.user])
+        self.authenticate_as_user()
+
+    def get_boards(self):
+        response = self.client.get(reverse('boards-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {board['id']: board for board in response.data}
+
+    def test_cached_list_is_invalidated(self):
+        self.get_boards()
+        with self.assertNumQueries(0):
+            self.get_boards()
+
+        self.card.status = 'DONE'
+        self.card.save()
+        self.assertEqual(self.get_boards()[self.board.id]['done_count'], 1)
+
+        other_board = Board.objects.create(name='Other Cached Board')
+        other_card = Card.objects.create(title='Other Cached Card', board=other_board)
+        other_card.members.add(self.user)
+        self.assertEqual(set(self.get_boards()), {self.board.id, other_board.id})
+
+        # Messages do not change cached lists
+        self.get_boards()
+        Message.objects.create(board=self.board, sent_by=self.user, content='Cached message')
+        with self.assertNumQueries(0):
+            self.get_boards()
+
+        other_card.members.remove(self.user)
+        self.assertEqual(set(self.get_boards()), {self.board.id})
+        self.board.delete()
+        self.assertEqual(self.get_boards(), {})
+
+    def test_lists_are_cached_per_user(self):
+        self.get_boards()
+        self.authenticate_as_admin()
+        Board.objects.create(name='Admin Cached Board')
+        response = self.client.get(reverse('boards-list'))
+        self.assertEqual(len(response.data), 2)
+
+    def test_concurrent_rebuild_waits_for_the_entry(self):
+        build = mock.Mock(return_value='built')
+        # Another request holds the lock and stores the entry meanwhile
+        cache.add('stampede:lock', 1)
+        with mock.patch('api.caching.time.sleep', side_effect=lambda delay: cache.set('stampede', 'cached')):
+            self.assertEqual(get_or_build('stampede', build, 60), 'cached')
+        build.assert_not_called()
+
+        cache.delete_many(['stampede', 'stampede:lock'])
+        self.assertEqual(get_or_build('stampede', build, 60), 'built')
+        self.assertEqual(get_or_build('stampede', build, 60), 'built')
+        build.assert_called_once()
+
+
+class FastJSONTest(BaseAPITestCase):
+    def payload(self):
+        board = Board.objects.create(name='JSON Board   é')
+        return {
+            'board': board.to_dict(),
+            'pic': board.pic,
+            'naive': datetime(2024, 5, 1, 12, 30, 15, 123456),
+            'aware': timezone.make_aware(datetime(2024, 5, 1, 12, 30), timezone.utc),
+            'day': datetime(2024, 5, 1).date(),
+            'amount': Decimal('1.50'),
+            1: 'integer key',
+        }
+
+    def test_frames_match_combined_encoder(self):
+        payload = self.payload()
+        self.assertEqual(json.loads(dumps(payload)), json.loads(json.dumps(payload, cls=CombinedEncoder)))
+        with self.settings(API_JSON_BACKEND='json'):
+            self.assertEqual(dumps(payload), json.dumps(payload, cls=CombinedEncoder))
+
+    def test_renderer_matches_default_renderer(self):
+        payload = self.payload()
+        payload.pop('pic')
+        payload['separators'] = 'line\u2028paragraph\u2029'
+        self.assertEqual(FastJSONRenderer().render(payload), JSONRenderer().render(payload))
+
+    def test_parser(self):
+        self.authenticate_as_admin()
+        response = self.client.post(reverse('boards-list'), '{"name": "Parsed é Board"}', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['name'], 'Parsed é Board')
+        response = self.client.post(reverse('boards-list'), '{"name": ', content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class MembershipResolverTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Resolver Board')
+        self.other_board = Board.objects.create(name='Other Resolver Board')
+        self.card = Card.objects.create(title='Resolver Card', board=self.board)
+        self.card.members.set([self.user])
+        for i in range(20):
+            Card.objects.create(title=f'Resolver Card {i}', board=self.board).members.set([self.admin])
+        self.authenticate_as_user()
+
+    def test_resolver(self):
+        membership = MembershipResolver(self.user)
+        with self.assertNumQueries(2):
+            self.assertTrue(membership.is_board_member(self.board))
+            self.assertTrue(membership.is_board_member(str(self.board.id)))
+            self.assertFalse(membership.is_board_member(self.other_board.id))
+            self.assertTrue(membership.is_card_member(self.card))
+            self.assertFalse(membership.can_access_board(None))
+        self.assertTrue(MembershipResolver(self.admin).can_access_board(self.other_board))
+
+    def test_object_permissions_do_not_load_members(self):
+        # Card with its members (reused by the permission check) and board versions
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('cards-detail', args=[self.card.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        message = Message.objects.create(board=self.board, sent_by=self.admin, content='Hi')
+        # Message and the boards of the user, neither the board nor its members
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('users-detail', args=[message.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_message_creation_requires_membership(self):
+        url = reverse('users-list')
+        response = self.client.post(url, {'board': self.other_board.id, 'sent_by': self.user.id, 'content': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(url, {'board': self.board.id, 'sent_by': self.user.id, 'content': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class SearchAPITest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Search Board')
+        self.other_board = Board.objects.create(name='Other Search Board')
+        self.title_card = Card.objects.create(title='Deploy the release', description='Before friday', board=self.board)
+        self.description_card = Card.objects.create(title='Friday tasks', description='Deploy <b>everything</b>', board=self.board)
+        self.hidden_card = Card.objects.create(title='Deploy the hidden release', board=self.board)
+        self.other_card = Card.objects.create(title='Deploy elsewhere', board=self.other_board)
+        self.title_card.members.set([self.user])
+        self.description_card.members.set([self.user])
+        self.hidden_card.members.set([self.admin])
+        self.other_card.members.set([self.admin])
+        # Messages are indexed once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            self.message = Message.objects.create(board=self.board, sent_by=self.user, content="L'étape du déploiement est prête")
+            self.other_message = Message.objects.create(board=self.other_board, sent_by=self.admin, content='Déploiement ailleurs')
+        self.authenticate_as_user()
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_ranking_and_highlights(self):
+        results = self.search(q='deploy')
+        # Only the cards of the user, the title match first
+        self.assertEqual([(result['type'], result['id']) for result in results], [('card', self.title_card.id), ('card', self.description_card.id)])
+        self.assertGreater(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[0]['highlights'], {'title': '<mark>Deploy</mark> the release'})
+        self.assertEqual(results[1]['highlights'], {'description': '<mark>Deploy</mark> &lt;b&gt;everything&lt;/b&gt;'})
+        self.assertEqual(results[0]['object']['title'], 'Deploy the release')
+
+        # Every word has to match
+        self.assertEqual({result['id'] for result in self.search(q='deploy FRIDAY')}, {self.title_card.id, self.description_card.id})
+        self.assertEqual(self.search(q='deploy release nothing'), [])
+
+    def test_accents_and_messages(self):
+        results = self.search(q='DEPLOIEMENT etape')
+        self.assertEqual([(result['type'], result['id']) for result in results], [('message', self.message.id)])
+        self.assertEqual(results[0]['highlights']['content'], "L&#x27;<mark>étape</mark> du <mark>déploiement</mark> est prête")
+
+    def test_filters(self):
+        self.assertEqual(self.search(q='deploy', type='messages'), [])
+        self.assertEqual(len(self.search(q='deploy', type='cards', board=self.board.id)), 2)
+        self.assertEqual(self.search(q='deploy', board=self.other_board.id), [])
+
+        self.authenticate_as_admin()
+        self.assertEqual(len(self.search(q='deploy')), 4)
+        self.assertEqual([result['id'] for result in self.search(q='deploiement', board=self.other_board.id)], [self.other_message.id])
+
+        for params in [{}, {'q': '  '}, {'q': 'deploy', 'type': 'boards'}, {'q': 'deploy', 'limit': 'all'}]:
+            response = self.client.get(reverse('search'), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_index_follows_changes(self):
+        self.title_card.title = 'Ship the release'
+        self.title_card.save()
+        self.assertEqual([result['id'] for result in self.search(q='deploy')], [self.description_card.id])
+        self.assertEqual([result['id'] for result in self.search(q='ship')], [self.title_card.id])
+
+        card_id = self.description_card.id
+        self.description_card.delete()
+        self.message.delete()
+        self.assertEqual(self.search(q='deploy'), [])
+        self.assertEqual(self.search(q='etape'), [])
+        self.assertFalse(SearchPosting.objects.filter(kind='card', object_id=card_id).exists())
+
+    def test_cascades_remove_postings(self):
+        self.admin.delete()
+        self.assertFalse(SearchPosting.objects.filter(kind='message', object_id=self.other_message.id).exists())
+        self.board.delete()
+        self.assertFalse(SearchPosting.objects.filter(board_id=self.board.id).exists())
+        self.assertEqual(self.search(q='etape'), [])
+
+    def test_bulk_cards_are_indexed(self):
+        self.authenticate_as_admin()
+        response = self.client.post(reverse('cards-bulk'), [
+            {'id': self.hidden_card.id, 'title': 'Archived notes', 'board': self.board.id},
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['id'] for result in self.search(q='archived notes')], [self.hidden_card.id])
+        self.assertEqual(len(self.search(q='hidden')), 0)
+
+    def test_rebuild_command(self):
+        postings = SearchPosting.objects.count()
+        SearchPosting.objects.all().delete()
+        self.assertEqual(self.search(q='deploy'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('4 cards indexed', out.getvalue())
+        self.assertEqual(SearchPosting.objects.count(), postings)
+        self.assertEqual(len(self.search(q='deploy')), 2)
+
+
+class MessageArchiveTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Archive Board')
+        self.board.members.set([self.user])
+        self.messages = [
+            Message.objects.create(board=self.board, sent_by=self.user, content=f'Message {i}') for i in range(12)
+        ]
+        for i, message in enumerate(self.messages[:9]):
+            Message.objects.filter(id=message.id).update(date_sent=datetime(2020, 1, 1, 12, i))
+        self.url = reverse('users-list')
+
+    def contents(self, response):
+        return [message['content'] for message in response.data['results']]
+
+    def test_archive_and_walk_history(self):
+        self.assertEqual(archive_messages(datetime(2021, 1, 1), segment_size=4), 9)
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertEqual(list(MessageArchive.objects.order_by('first_date').values_list('count', flat=True)), [4, 4, 1])
+        self.assertFalse(SearchPosting.objects.filter(kind='message', object_id=self.messages[0].id).exists())
+        # Still in the history, clients are not told the messages were deleted
+        self.assertFalse(Tombstone.objects.filter(kind='message').exists())
+        self.assertEqual(Board.objects.get(id=self.board.id).last_message_id, self.messages[-1].id)
+
+        self.authenticate_as_user()
+        response = self.client.get(self.url, {'board': self.board.id, 'page_size': 5})
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(7, 12)])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(2, 7)])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual(self.contents(response), ['Message 0', 'Message 1'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(2, 7)])
+        response = self.client.get(response.data['next'])
+        self.assertEqual(self.contents(response), [f'Message {i}' for i in range(7, 12)])
+        self.assertIsNone(response.data['next'])
+
+        # Without pagination the archive is not read
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'board': self.board.id, 'expand': 'sent_by'})
+        self.assertEqual([message['content'] for message in response.data], [f'Message {i}' for i in range(9, 12)])
+        self.assertEqual(response.data[0]['sent_by']['email'], self.user.email)
+
+        response = self.client.get(self.url, {'board': self.board.id, 'page_size': 12})
+        self.assertEqual(self.contents(response)[0], 'Message 0')
+        self.assertEqual(response.data['results'][0]['date_sent'], '2020-01-01T12:00:00')
+
+        response = self.client.get(reverse('users-detail', args=[self.messages[3].id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['content'], 'Message 3')
+
+    def test_archive_is_private(self):
+        archive_messages(datetime(2021, 1, 1))
+        self.board.members.clear()
+        self.authenticate_as_user()
+        response = self.client.get(self.url, {'board': self.board.id, 'page_size': 20})
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(reverse('users-detail', args=[self.messages[3].id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_last_message_stays(self):
+        Message.objects.filter(board=self.board).update(date_sent=datetime(2020, 1, 1))
+        self.assertEqual(archive_messages(datetime(2021, 1, 1)), 11)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.last_message_id, self.messages[-1].id)
+
+    def test_compact_and_restore(self):
+        archive_messages(datetime(2021, 1, 1), segment_size=2)
+        self.assertEqual(MessageArchive.objects.count(), 5)
+        self.assertEqual(compact_archives(segment_size=4), 2)
+        self.assertEqual(list(MessageArchive.objects.order_by('first_date').values_list('count', flat=True)), [4, 4, 1])
+
+        self.assertEqual(restore_messages(since=datetime(2020, 1, 1, 12, 6)), 3)
+        self.assertEqual(list(MessageArchive.objects.order_by('first_date').values_list('count', flat=True)), [4, 2])
+        restored = Message.objects.get(id=self.messages[6].id)
+        self.assertEqual((restored.content, restored.date_sent), ('Message 6', datetime(2020, 1, 1, 12, 6)))
+        self.assertTrue(SearchPosting.objects.filter(kind='message', object_id=restored.id).exists())
+
+        out = StringIO()
+        call_command('archive_messages', '--restore', stdout=out)
+        self.assertIn('6 message(s) restored', out.getvalue())
+        self.assertFalse(MessageArchive.objects.exists())
+        self.assertEqual(Message.objects.filter(board=self.board).count(), 12)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('archive_messages', '--days', '365', stdout=out)
+        self.assertIn('9 message(s) archived', out.getvalue())
+        self.assertEqual(MessageArchive.objects.get().count, 9)
+
+
+class DashboardSummaryTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Summary Board')
+        self.other_board = Board.objects.create(name='Other Summary Board')
+        past = timezone.now() - timezone.timedelta(days=1)
+        cards = [
+            Card.objects.create(title='Summary Card 1', board=self.board, priority='HIGH', due_date=past),
+            Card.objects.create(title='Summary Card 2', board=self.board, status='DONE', priority='HIGH', due_date=past),
+            Card.objects.create(title='Summary Card 3', board=self.board, status='DOING'),
+        ]
+        for card in cards:
+            card.members.set([self.user])
+        cards[0].members.add(self.admin)
+        Card.objects.create(title='Summary Card 4', board=self.other_board).members.set([self.admin])
+        self.message = Message.objects.create(board=self.board, sent_by=self.user, content='Hi')
+        self.url = reverse('boards-summary')
+
+    def test_summary(self):
+        self.authenticate_as_user()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['boards']), 1)
+        board = response.data['boards'][0]
+        self.assertEqual((board['id'], board['members']), (self.board.id, 2))
+        self.assertEqual(board['last_message_at'], Message.objects.get(id=self.message.id).date_sent)
+        self.assertEqual(board['cards']['total'], 3)
+        self.assertEqual(board['cards']['overdue'], 1)
+        self.assertEqual(board['cards']['by_status'], {'TODO': 1, 'DOING': 1, 'BLOCKED': 0, 'DONE': 1})
+        self.assertEqual(board['cards']['by_priority'], {'LOW': 0, 'MEDIUM': 1, 'HIGH': 2, 'CRITICAL': 0})
+
+        self.authenticate_as_admin()
+        totals = self.client.get(self.url).data['totals']
+        self.assertEqual((totals['boards'], totals['cards'], totals['overdue']), (2, 4, 1))
+        self.assertEqual(totals['by_status']['TODO'], 2)
+
+    def test_constant_queries(self):
+        self.authenticate_as_admin()
+        self.client.get(self.url)
+        for i in range(10):
+            board = Board.objects.create(name=f'Summary Board {i}')
+            Card.objects.create(title=f'Extra Summary Card {i}', board=board)
+        cache.clear()
+        # Tokens issued before the versions of the users were cleared are checked against the database
+        self.admin_jwt = self.get_jwt_token(self.admin_creds)
+        self.authenticate_as_admin()
+        # One query, without the list of visible boards
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['boards']), 12)
+
+
+class ClaimsAuthenticationTest(BaseAPITestCase):
+    def test_user_comes_from_the_token(self):
+        self.authenticate_as_admin()
+        self.client.get(reverse('boards-list'))
+        # Cached list, the admin is not loaded
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('boards-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(AccessToken(self.admin_jwt)['is_admin'], True)
+
+        # Tokens issued without the claims still work, from the user cache
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+        response = self.client.get(reverse('users-me'))
+        self.assertEqual(response.data['email'], self.user.email)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('users-me'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_claims_of_a_changed_user_are_not_trusted(self):
+        self.authenticate_as_user()
+        self.client.get(reverse('users-me'))
+        # The user comes from the claims while it is unchanged
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('boards-list')).status_code, status.HTTP_200_OK)
+        self.assertNotIn(connection.ops.quote_name('api_theuser'), ' '.join(query['sql'] for query in queries))
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse('boards-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_invalidation_reaches_other_processes(self):
+        # Caches of two processes sharing the default cache
+        users, other_users = UserCache(size=8, timeout=60), UserCache(size=8, timeout=60)
+        users.get(self.user.id)
+        other_users.get(self.user.id)
+        TheUser.objects.filter(id=self.user.id).update(first_name='Elsewhere')
+        other_users.invalidate(self.user.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(users.get(self.user.id).first_name, 'Elsewhere')
+        with self.assertNumQueries(0):
+            users.get(self.user.id)
+
+    def test_refresh_reads_the_user_again(self):
+        response = self.client.post(reverse('get_token'), {'email': self.user.email, 'password': 'password123'}, format='json')
+        refresh = response.data['refresh']
+        self.user.is_admin = True
+        self.user.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': refresh}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(AccessToken(response.data['access'])['is_admin'])
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse('token_refresh'), {'refresh': response.data['refresh']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_cache(self):
+        user_cache.get(self.user.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(user_cache.get(self.user.id).email, self.user.email)
+        # Saving the user drops it
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertEqual(user_cache.get(self.user.id).first_name, 'Renamed')
+        self.assertIsNot(user_cache.get(self.user.id), user_cache.get(self.user.id))
+
+        users = UserCache(size=1, timeout=60)
+        users.get(self.user.id)
+        users.get(self.admin.id)
+        self.assertEqual(list(users.entries), [self.admin.id])
+        expired = UserCache(size=1, timeout=0)
+        expired.get(self.user.id)
+        with self.assertNumQueries(1):
+            expired.get(self.user.id)
+
+
+class PasswordHashingPoolTest(BaseAPITestCase):
+    def test_signup_and_signin(self):
+        metrics.reset()
+        response = self.client.post(reverse('signup'), {
+            'email': 'pool@example.com', 'first_name': 'Pool', 'last_name': 'User', 'password': 'poolpassword',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(TheUser.objects.get(email='pool@example.com').check_password('poolpassword'))
+
+        response = self.client.post(reverse('get_token'), {'email': 'pool@example.com', 'password': 'poolpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        response = self.client.post(reverse('get_token'), {'email': 'unknown@example.com', 'password': 'poolpassword'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.post(reverse('get_token'), {'email': 'pool@example.com'}, format='json')
+        self.assertEqual(response.data, {'password': ['This field is required.']})
+
+        # Signup, two signins
+        self.assertEqual(metrics.snapshot()['counters']['password_hashing.completed'], 3)
+        self.authenticate_as_admin()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.data['timings']['password_hashing.duration']['count'], 3)
+        self.authenticate_as_user()
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_full_pool_refuses_requests(self):
+        with mock.patch.object(password_hashing, 'max_pending', 0):
+            response = self.client.post(reverse('get_token'), {'email': self.user.email, 'password': 'password123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_pending_jobs_are_bounded(self):
+        pool = HashingPool('test_pool', workers=1, max_pending=2)
+        release = threading.Event()
+
+        async def scenario():
+            jobs = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+            await asyncio.sleep(0)
+            with self.assertRaises(PoolFull):
+                await pool.run(release.wait)
+            release.set()
+            await asyncio.gather(*jobs)
+            return await pool.run(lambda: 'done')
+
+        self.assertEqual(asyncio.run(scenario()), 'done')
+        self.assertEqual(pool.pending, 0)
+        self.assertEqual(metrics.snapshot()['counters']['test_pool.rejected'], 1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatWritePathTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Chat Board')
+        self.board.members.add(self.user)
+
+    def connect(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), f'/ws/chat/{self.board.id}/')
+        communicator.scope['user'] = user
+        communicator.scope['url_route'] = {'kwargs': {'board_id': str(self.board.id)}}
+        return communicator
+
+    def test_messages_are_batched_and_acknowledged(self):
+        metrics.reset()
+
+        # Run in the test thread, database calls of the consumers use the test transaction
+        @async_to_sync
+        async def scenario():
+            sender, reader = self.connect(self.user), self.connect(self.admin)
+            self.assertTrue((await sender.connect())[0])
+            self.assertTrue((await reader.connect())[0])
+            # sent_by is ignored, the messages are sent by the connected user
+            for i in range(3):
+                await sender.send_json_to({'board': self.board.id, 'sent_by': self.admin.id, 'content': f'Batched {i}', 'client_id': f'c{i}'})
+            frames = [await sender.receive_json_from() for _ in range(6)]
+            received = [await reader.receive_json_from() for _ in range(3)]
+            await sender.send_json_to({'board': self.board.id, 'content': 'No ack'})
+            received.append(await reader.receive_json_from())
+            # The sender is in the board group too, only its broadcast comes back
+            self.assertEqual((await sender.receive_json_from())['content'], 'No ack')
+            self.assertTrue(await sender.receive_nothing())
+            await sender.disconnect()
+            await reader.disconnect()
+            return frames, received
+
+        frames, received = scenario()
+        messages = list(Message.objects.filter(board=self.board).order_by('id'))
+        self.assertEqual([message.content for message in messages], ['Batched 0', 'Batched 1', 'Batched 2', 'No ack'])
+        self.assertTrue(all(message.sent_by_id == self.user.id for message in messages))
+        # Board members get the messages in order, the sender gets an acknowledgement of each one
+        self.assertEqual([message['id'] for message in received], [message.id for message in messages])
+        self.assertEqual(received[0]['sent_by']['id'], self.user.id)
+        acks = [frame for frame in frames if frame.get('type') == 'ack']
+        self.assertEqual([(ack['client_id'], ack['id']) for ack in acks], [(f'c{i}', messages[i].id) for i in range(3)])
+
+        counters = metrics.snapshot()['counters']
+        self.assertEqual(counters['chat.messages'], 4)
+        self.assertEqual(counters['chat.batches'], 2)
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.last_message_id, messages[-1].id)
+        self.assertEqual(SearchPosting.objects.filter(kind=SearchKind.MESSAGE, object_id__in=[m.id for m in messages]).values('object_id').distinct().count(), 4)
+
+    def test_rejected_frames(self):
+        other_board = Board.objects.create(name='Other Chat Board')
+
+        @async_to_sync
+        async def scenario():
+            sender = self.connect(self.user)
+            await sender.connect()
+            await sender.send_json_to({'board': other_board.id, 'content': 'Not a member', 'client_id': 'c1'})
+            await sender.send_json_to({'board': self.board.id, 'content': '', 'client_id': 'c2'})
+            nothing = await sender.receive_nothing()
+            await sender.disconnect()
+            return nothing
+
+        self.assertTrue(scenario())
+        self.assertFalse(Message.objects.exists())
+
+    def test_write_messages(self):
+        other_board = Board.objects.create(name='Other Chat Board')
+        messages = [
+            Message(board=self.board, sent_by=self.user, content='First'),
+            Message(board=other_board, sent_by=self.admin, content='Elsewhere'),
+            Message(board=self.board, sent_by=self.admin, content='Second'),
+        ]
+        rejected, recipients = write_messages(messages)
+        self.assertEqual(rejected, [])
+        self.assertEqual(recipients, {self.board.id: {self.user.id, self.admin.id}, other_board.id: {self.admin.id}})
+        self.assertTrue(all(message.id for message in messages))
+        self.assertEqual(SearchPosting.objects.filter(kind=SearchKind.MESSAGE, term='elsewhere').get().object_id, messages[1].id)
+        self.assertEqual(Board.objects.get(id=self.board.id).last_message_id, messages[2].id)
+        self.assertEqual(Board.objects.get(id=other_board.id).last_message_id, messages[1].id)
+
+    def test_write_messages_without_returned_ids(self):
+        # As on MySQL: one insert for the batch, ids read back afterwards
+        Message.objects.create(board=self.board, sent_by=self.user, content='Before')
+        messages = [Message(board=self.board, sent_by=self.user, content=f'Batch {i}') for i in range(3)]
+        messages.insert(1, Message(board=self.board, sent_by=self.admin, content='Batch admin'))
+        with mock.patch.object(connection.features, 'can_return_rows_from_bulk_insert', False), \
+                CaptureQueriesContext(connection) as queries:
+            rejected, _ = write_messages(messages)
+        self.assertEqual(rejected, [])
+        inserts = [query for query in queries if query['sql'].startswith(f"INSERT INTO {connection.ops.quote_name('api_message')}")]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual([Message.objects.get(id=message.id).content for message in messages], [message.content for message in messages])
+        self.assertEqual(Board.objects.get(id=self.board.id).last_message_id, messages[-1].id)
+
+
+class ChatWriteFailureTest(APITransactionTestCase):
+    # Foreign keys are checked when the transaction commits, outside of a test transaction
+    def test_messages_of_deleted_boards_are_rejected_alone(self):
+        user = TheUser.objects.create_user(email='chat.failure@test.com', password='pass', first_name='Chat', last_name='Failure')
+        board = Board.objects.create(name='Kept Chat Board')
+        board.members.add(user)
+        deleted_board = Board.objects.create(name='Deleted Chat Board')
+        # Built from ids, as ChatConsumer does
+        messages = [
+            Message(board_id=board.id, sent_by=user, content='Kept'),
+            Message(board_id=deleted_board.id, sent_by=user, content='Lost'),
+        ]
+        deleted_board.delete()
+        rejected, recipients = write_messages(messages)
+        self.assertEqual(rejected, [messages[1]])
+        self.assertEqual(list(Message.objects.values_list('content', flat=True)), ['Kept'])
+        self.assertEqual(recipients, {board.id: {user.id}})
+        self.assertEqual(Board.objects.get(id=board.id).last_message_id, messages[0].id)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class MultiplexConsumerTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Multiplex Board')
+        self.board.members.add(self.user)
+        self.other_board = Board.objects.create(name='Other Multiplex Board')
+
+    def test_streams_of_one_connection(self):
+        @async_to_sync
+        async def scenario():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/multiplex/')
+            communicator.scope['user'] = self.user
+            self.assertTrue((await communicator.connect())[0])
+            frames = []
+
+            async def control(**data):
+                await communicator.send_json_to(data)
+                frames.append(await communicator.receive_json_from())
+
+            await control(action='subscribe', stream='chat', board=self.board.id)
+            await control(action='subscribe', stream='inbox')
+            await control(action='subscribe', stream='cards', board=self.other_board.id)
+            await control(action='subscribe', stream='unknown')
+
+            # Chat frame, acknowledgement and inbox update of the message
+            await communicator.send_json_to({'action': 'send', 'stream': 'chat', 'board': self.board.id, 'content': 'Multiplexed', 'client_id': 'm1'})
+            streams = [await communicator.receive_json_from() for _ in range(3)]
+
+            # Card events of the board are not subscribed to
+            channel_layer = get_channel_layer()
+            card_event = {'type': 'card_status_update', 'board': self.board.id, 'message': {'card_id': 1, 'new_status': 'DONE'}}
+            await channel_layer.group_send(f'board_{self.board.id}', card_event)
+            self.assertTrue(await communicator.receive_nothing())
+            await control(action='subscribe', stream='cards', board=self.board.id)
+            await channel_layer.group_send(f'board_{self.board.id}', card_event)
+            streams.append(await communicator.receive_json_from())
+
+            # Still in the group for cards
+            await control(action='unsubscribe', stream='chat', board=self.board.id)
+            await channel_layer.group_send(f'board_{self.board.id}', {'type': 'chat_message', 'board': self.board.id, 'message': {}})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.disconnect()
+            return frames, streams
+
+        frames, streams = scenario()
+        self.assertEqual([(frame['type'], frame['stream']) for frame in frames[:3]], [
+            ('subscribed', 'chat'), ('subscribed', 'inbox'), ('error', 'cards'),
+        ])
+        self.assertEqual(frames[2]['detail'], 'Not a member of the board')
+        self.assertEqual(frames[3]['type'], 'error')
+        self.assertEqual(frames[5], {'type': 'unsubscribed', 'stream': 'chat', 'board': self.board.id})
+
+        message = Message.objects.get(board=self.board)
+        by_kind = {(frame['stream'], frame['payload'].get('type')): frame for frame in streams[:3]}
+        self.assertEqual(by_kind[('chat', None)]['payload']['id'], message.id)
+        self.assertEqual(by_kind[('chat', 'ack')]['payload']['client_id'], 'm1')
+        self.assertEqual(by_kind[('inbox', 'latest_message_update')]['payload']['message']['id'], message.id)
+        self.assertEqual(streams[3], {'stream': 'cards', 'board': self.board.id, 'payload': {'type': 'card_status_update', 'board': self.board.id, 'message': {'card_id': 1, 'new_status': 'DONE'}}})
+
+
+    def test_malformed_frames_keep_the_connection(self):
+        @async_to_sync
+        async def scenario():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/multiplex/')
+            communicator.scope['user'] = self.user
+            await communicator.connect()
+            frames = []
+            for text in ('[]', '"x"', '1', 'null', '{"action": '):
+                await communicator.send_to(text_data=text)
+                frames.append(await communicator.receive_json_from())
+            await communicator.send_json_to({'action': 'subscribe', 'stream': 'inbox'})
+            frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames
+
+        frames = scenario()
+        self.assertEqual(frames[:5], [{'type': 'error', 'detail': 'Malformed frame'}] * 5)
+        self.assertEqual(frames[5], {'type': 'subscribed', 'stream': 'inbox'})
+
+    @override_settings(MULTIPLEX_MEMBERSHIP_RELOAD_INTERVAL=60)
+    def test_refused_subscriptions_reload_boards_at_most_once_per_interval(self):
+        @async_to_sync
+        async def scenario():
+            communicator = WebsocketCommunicator(MultiplexConsumer.as_asgi(), '/ws/multiplex/')
+            communicator.scope['user'] = self.user
+            await communicator.connect()
+            subscribe = {'action': 'subscribe', 'stream': 'cards', 'board': self.other_board.id}
+            await communicator.send_json_to(subscribe)
+            frames = [await communicator.receive_json_from()]
+            await database_sync_to_async(self.other_board.members.add)(self.user)
+            with mock.patch.object(MembershipResolver, 'load_boards') as load_boards:
+                await communicator.send_json_to(subscribe)
+                frames.append(await communicator.receive_json_from())
+            with self.settings(MULTIPLEX_MEMBERSHIP_RELOAD_INTERVAL=0):
+                await communicator.send_json_to(subscribe)
+                frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames, load_boards.call_count
+
+        frames, reloads = scenario()
+        # Refused again without reading the boards, then the new membership is read
+        self.assertEqual(reloads, 0)
+        self.assertEqual([frame['type'] for frame in frames], ['error', 'error', 'subscribed'])
+
+class WebSocketTicketTest(BaseAPITestCase):
+    def connect(self, ticket):
+        @async_to_sync
+        async def scenario():
+            communicator = WebsocketCommunicator(JwtAuthMiddleware(EchoConsumer.as_asgi()), f'/ws/echo/?uuid={ticket}')
+            connected, _ = await communicator.connect()
+            if connected:
+                self.assertEqual(await communicator.receive_json_from(), {'message': 'Connected'})
+                await communicator.disconnect()
+            return connected
+        return scenario()
+
+    def test_ticket_authenticates_one_connection(self):
+        metrics.reset()
+        self.authenticate_as_user()
+        ticket = self.client.get(reverse('get_ws_auth_uuid')).data['uuid']
+        self.assertEqual(cache.get(f'websocket_auth:{ticket}'), self.user.id)
+
+        self.assertTrue(self.connect(ticket))
+        # Deleted on disconnect
+        self.assertIsNone(cache.get(f'websocket_auth:{ticket}'))
+        self.assertFalse(self.connect(ticket))
+
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot['counters']['websocket.authenticated'], snapshot['counters']['websocket.rejected']), (1, 1))
+        self.assertEqual(snapshot['timings']['websocket.connect_auth']['count'], 2)
+
+    def test_redis_cache_uses_async_store(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': 'redis://cache:6379/1'}}):
+            store = ticket_stores.get()
+        self.assertIsInstance(store, RedisTicketStore)
+        self.assertEqual(store.url, 'redis://cache:6379/1')
+        with override_settings(WEBSOCKET_TICKET_REDIS_URL='redis://tickets:6379/2'):
+            self.assertEqual(ticket_stores.get().url, 'redis://tickets:6379/2')
+
+    def test_async_clients_are_closed_with_their_loop(self):
+        store = RedisTicketStore('redis://tickets:6379/2')
+
+        @async_to_sync
+        async def get_clients():
+            return store.get_async_client(), store.get_async_client()
+
+        with mock.patch('redis.asyncio.Redis.aclose') as aclose:
+            first, again = get_clients()
+            second, _ = get_clients()
+        self.assertIs(first, again)
+        self.assertIsNot(first, second)
+        self.assertEqual(aclose.call_count, 2)
+        self.assertEqual((len(store.async_clients), len(store.closers)), (0, 0))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class WireFormatTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Wire Board')
+        self.board.members.add(self.user)
+
+    def chat(self, frames, path=None, subprotocols=None):
+        # Send the frames to a chat socket of the board, return the accepted subprotocol and the frames received back
+        @async_to_sync
+        async def scenario():
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), path or f'/ws/chat/{self.board.id}/', subprotocols=subprotocols)
+            communicator.scope['user'] = self.user
+            communicator.scope['url_route'] = {'kwargs': {'board_id': str(self.board.id)}}
+            connected, subprotocol = await communicator.connect()
+            self.assertTrue(connected)
+            received = []
+            for frame in frames:
+                if subprotocol:
+                    await communicator.send_to(bytes_data=msgpack.packb(frame))
+                else:
+                    await communicator.send_json_to(frame)
+                received.append(await communicator.receive_from())
+            await communicator.disconnect()
+            return subprotocol, received
+        return scenario()
+
+    def test_user_dict_is_public(self):
+        self.assertEqual(set(self.user.to_dict()), {'id', 'first_name', 'last_name', 'email', 'is_admin'})
+
+    def test_json_is_the_default(self):
+        subprotocol, received = self.chat([{'board': self.board.id, 'content': 'Text frame'}])
+        self.assertIsNone(subprotocol)
+        message = json.loads(received[0])
+        self.assertEqual(message['board']['name'], 'Wire Board')
+        self.assertNotIn('password', message['sent_by'])
+
+    def test_msgpack_subprotocol(self):
+        frames = [{'board': self.board.id, 'content': f'Binary frame {i}'} for i in range(2)]
+        subprotocol, received = self.chat(frames, subprotocols=['msgpack', 'json'])
+        self.assertEqual(subprotocol, 'msgpack')
+        first, second = [msgpack.unpackb(frame) for frame in received]
+        # Board and sender by id, described in the first frame only
+        self.assertEqual((first['board'], first['sent_by'], first['content']), (self.board.id, self.user.id, 'Binary frame 0'))
+        self.assertEqual(first['refs']['boards'][0]['name'], 'Wire Board')
+        self.assertEqual(first['refs']['users'][0], self.user.to_dict())
+        self.assertEqual(second['content'], 'Binary frame 1')
+        self.assertNotIn('refs', second)
+        self.assertLess(len(received[1]), len(json.dumps({**second, 'board': self.board.to_dict(), 'sent_by': self.user.to_dict()})) / 2)
+
+    def test_msgpack_query_parameter(self):
+        @async_to_sync
+        async def scenario():
+            communicator = WebsocketCommunicator(EchoConsumer.as_asgi(), '/ws/echo/?format=msgpack')
+            communicator.scope['user'] = self.user
+            connected, subprotocol = await communicator.connect()
+            greeting = await communicator.receive_from()
+            await communicator.disconnect()
+            return subprotocol, greeting
+
+        subprotocol, greeting = scenario()
+        self.assertIsNone(subprotocol)
+        self.assertEqual(msgpack.unpackb(greeting), {'message': 'Connected'})
+
+
+class OutboundQueueTest(BaseAPITestCase):
+    def run_queue(self, max_size, frames):
+        # Queue the (frame, policy) pairs while the client is stuck on the first one, then let it read
+        async def scenario():
+            written, overflowed, release = [], [], asyncio.Event()
+
+            async def write(frame):
+                await release.wait()
+                written.append(frame)
+
+            async def on_overflow():
+                overflowed.append(True)
+
+            queue = OutboundQueue(write, on_overflow, max_size)
+            queue.put('first')
+            await asyncio.sleep(0)
+            for frame, policy in frames:
+                queue.put(frame, **policy)
+            depth = len(queue)
+            release.set()
+            for _ in range(10):
+                await asyncio.sleep(0)
+            queue.stop()
+            return written, depth, bool(overflowed)
+        return asyncio.run(scenario())
+
+    def test_card_updates_are_coalesced_and_stale_inbox_updates_dropped(self):
+        metrics.reset()
+        written, depth, overflowed = self.run_queue(4, [
+            ('card 1 DOING', {'coalesce': ('card', 1)}),
+            ('inbox 1 a', {'supersede': ('inbox', 1)}),
+            ('card 1 DONE', {'coalesce': ('card', 1)}),
+            ('chat', {}),
+            ('inbox 1 b', {'supersede': ('inbox', 1)}),
+        ])
+        self.assertEqual(depth, 3)
+        self.assertFalse(overflowed)
+        self.assertEqual(written, ['first', 'card 1 DONE', 'chat', 'inbox 1 b'])
+        snapshot = metrics.snapshot()
+        self.assertEqual((snapshot['counters']['websocket.frames_coalesced'], snapshot['counters']['websocket.frames_superseded']), (1, 1))
+        self.assertEqual(snapshot['counters']['websocket.frames_sent'], 4)
+        self.assertEqual(snapshot['gauges']['websocket.queued_frames'], 0)
+
+    def test_card_updates_stay_after_bulk_updates(self):
+        written, _, _ = self.run_queue(8, [
+            ('card 1 DOING', {'coalesce': ('card', 1)}),
+            ('bulk cards 1 2', {'release': [('card', 1), ('card', 2)]}),
+            ('card 1 DONE', {'coalesce': ('card', 1)}),
+            ('card 1 BLOCKED', {'coalesce': ('card', 1)}),
+        ])
+        self.assertEqual(written, ['first', 'card 1 DOING', 'bulk cards 1 2', 'card 1 BLOCKED'])
+
+    def test_slow_client_is_disconnected(self):
+        metrics.reset()
+        written, depth, overflowed = self.run_queue(2, [(f'chat {i}', {}) for i in range(4)])
+        # Queued frames are dropped with the connection, the one being written too
+        self.assertTrue(overflowed)
+        self.assertEqual((depth, written), (0, []))
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot['counters']['websocket.slow_disconnects'], 1)
+        self.assertEqual(snapshot['gauges']['websocket.queued_frames'], 0)
+
+
+class MessageFanOutTest(BaseAPITestCase):
+    def test_inboxes_are_notified_after_commit(self):
+        board = Board.objects.create(name='Fan-out Board')
+        members = [self.user] + [
+            TheUser.objects.create_user(email=f'fanout{i}@example.com', first_name='Fan', last_name=f'Out{i}', password='password')
+            for i in range(3)
+        ]
+        board.members.set(members)
+        channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch('api.broadcast.get_channel_layer', return_value=channel_layer):
+            # Not committed, nothing is sent
+            Message.objects.create(board=board, sent_by=self.user, content='Rolled back')
+            with self.captureOnCommitCallbacks(execute=True):
+                message = Message.objects.create(board=board, sent_by=self.user, content='Fan-out')
+            broadcaster.wait(5)
+
+        # Members and admins, each once
+        groups = [call.args[0] for call in channel_layer.group_send.call_args_list]
+        self.assertEqual(sorted(groups), sorted(f'user_{user.id}_latest_messages' for user in members + [self.admin]))
+        self.assertTrue(all(call.args[1]['message']['id'] == message.id for call in channel_layer.group_send.call_args_list))
+
+    def test_failed_sends_do_not_stop_the_others(self):
+        metrics.reset()
+
+        async def group_send(group, event):
+            if group == 'broken':
+                raise ConnectionError(group)
+
+        channel_layer = mock.Mock(group_send=mock.AsyncMock(side_effect=group_send))
+        sends = [(group, {'type': 'test'}) for group in ['first', 'broken', 'last']]
+        self.assertEqual(asyncio.run(group_send_many(sends, channel_layer)), 1)
+        self.assertEqual(channel_layer.group_send.await_count, 3)
+        self.assertEqual(metrics.snapshot()['counters']['broadcast.errors'], 1)
+
+
+class CardEventCoalescingTest(BaseAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.board = Board.objects.create(name='Events Board')
+        self.card = Card.objects.create(title='Events Card', board=self.board)
+
+    def sent_events(self, *changes):
+        # Apply each change and save the card in its own transaction, return the events sent
+        channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch('api.broadcast.get_channel_layer', return_value=channel_layer):
+            for change in changes:
+                with self.captureOnCommitCallbacks(execute=True):
+                    for field, value in change.items():
+                        setattr(self.card, field, value)
+                    self.card.save()
+            card_events.wait(5)
+        return [call.args for call in channel_layer.group_send.call_args_list]
+
+    def test_only_status_and_board_changes_are_sent(self):
+        self.assertEqual(self.sent_events({'title': 'Renamed Events Card'}, {'description': 'Edited'}), [])
+        self.assertEqual(self.sent_events({'status': 'DOING'}), [
+            (f'board_{self.board.id}', {'type': 'card_status_update', 'board': self.board.id, 'message': {'card_id': self.card.id, 'new_status': 'DOING'}}),
+        ])
+
+    def test_new_cards_are_sent(self):
+        channel_layer = mock.Mock(group_send=mock.AsyncMock())
+        with mock.patch('api.broadcast.get_channel_layer', return_value=channel_layer):
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                card = Card.objects.create(title='New Events Card', board=self.board, status='DOING')
+            card_events.wait(5)
+        # The card is not read back to compare with its previous status
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT') and connection.ops.quote_name('api_card') in query['sql']])
+        channel_layer.group_send.assert_called_once_with(f'board_{self.board.id}', {
+            'type': 'card_status_update', 'board': self.board.id, 'message': {'card_id': card.id, 'new_status': 'DOING'},
+        })
+
+    def test_bursts_are_coalesced(self):
+        metrics.reset()
+        events = self.sent_events({'status': 'DOING'}, {'title': 'Busy Events Card'}, {'status': 'BLOCKED'}, {'status': 'DONE'})
+        self.assertEqual([event[1]['message']['new_status'] for event in events], ['DONE'])
+        # Back to the status it had, nothing to send
+        self.assertEqual(self.sent_events({'status': 'TODO'}, {'status': 'DONE'}), [])
+        counters = metrics.snapshot()['counters']
+        self.assertEqual((counters['card_events.received'], counters['card_events.sent']), (5, 1))
+
+
+class QueryPlanTestCase(APITestCase):
+    """
+    Checks the EXPLAIN output of querysets to catch full table scans. Tables are seeded with enough rows
+    for the planner to prefer indexes, see seed().
+    assertNoFullScan(queryset, allowed) fails when a table outside `allowed` is read entirely.
+    """
+
+    def full_scans(self, queryset):
+        vendor = connection.vendor
+        if vendor == 'mysql':
+            plan = json.loads(queryset.explain(format='json'))
+            return {table for table, access in self.mysql_accesses(plan) if access == 'ALL'}
+        plan = queryset.explain()
+        if vendor == 'sqlite':
+            # "SCAN table" without "USING ... INDEX" reads the whole table
+            return {
+                line.split('SCAN ')[1].split()[0] for line in plan.splitlines()
+                if 'SCAN ' in line and 'INDEX' not in line and 'CONSTANT ROW' not in line
+            }
+        if vendor == 'postgresql':
+            return {line.split('Seq Scan on ')[1].split()[0] for line in plan.splitlines() if 'Seq Scan on ' in line}
+        self.skipTest(f'No query plan parser for {vendor}')
+
+    def mysql_accesses(self, plan):
+        if isinstance(plan, dict):
+            if 'table_name' in plan and 'access_type' in plan:
+                yield plan['table_name'], plan['access_type']
+            for value in plan.values():
+                yield from self.mysql_accesses(value)
+        elif isinstance(plan, list):
+            for value in plan:
+                yield from self.mysql_accesses(value)
+
+    def assertNoFullScan(self, queryset, allowed=()):
+        scans = self.full_scans(queryset) - set(allowed)
+        self.assertFalse(scans, msg=f'Full scan of {", ".join(sorted(scans))}:\n{queryset.query}\n{queryset.explain()}')
+
+
+class HotQueryPlanTest(QueryPlanTestCase):
+    """
+    Hot queries of api/views.py, api/signals.py, api/permissions.py (membership resolver) and api/models.py.
+    """
+    USERS, BOARDS, CARDS_PER_BOARD, MESSAGES_PER_BOARD = 100, 200, 8, 10
+
+    @classmethod
+    def setUpTestData(cls):
+        # Bulk inserts without signals, only the shape of the data matters
+        TheUser.objects.bulk_create([
+            TheUser(email=f'plan{i}@example.com', first_name='Plan', last_name='User') for i in range(cls.USERS)
+        ])
+        users = list(TheUser.objects.values_list('id', flat=True))
+        Board.objects.bulk_create([Board(name=f'Plan Board {i}') for i in range(cls.BOARDS)])
+        boards = list(Board.objects.values_list('id', flat=True))
+        statuses = ['TODO', 'DOING', 'BLOCKED', 'DONE']
+        Card.objects.bulk_create([
+            Card(title=f'Plan Card {board_id}-{i}', board_id=board_id, status=statuses[i % 4])
+            for board_id in boards for i in range(cls.CARDS_PER_BOARD)
+        ])
+        cards = list(Card.objects.values_list('id', 'board_id'))
+        card_members = {(card_id, users[(card_id + j) % cls.USERS], board_id) for card_id, board_id in cards for j in range(2)}
+        Card.members.through.objects.bulk_create([
+            Card.members.through(card_id=card_id, theuser_id=user_id) for card_id, user_id, _ in card_members
+        ])
+        Board.members.through.objects.bulk_create([
+            Board.members.through(board_id=board_id, theuser_id=user_id)
+            for board_id, user_id in {(board_id, user_id) for _, user_id, board_id in card_members}
+        ])
+        Message.objects.bulk_create([
+            Message(board_id=board_id, sent_by_id=users[i % cls.USERS], content='Plan message')
+            for board_id in boards for i in range(cls.MESSAGES_PER_BOARD)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE' if connection.vendor != 'mysql' else
+                           'ANALYZE TABLE api_board, api_card, api_message, api_board_members, api_card_members')
+        cls.user = TheUser.objects.get(id=users[0])
+        cls.board = Board.objects.get(id=boards[0])
+
+    def get_view(self, viewset, action='list', **params):
+        # View of a GET request of the user, to explain the querysets it builds
+        request = Request(APIRequestFactory().get('/', params))
+        request.user = self.user
+        return viewset(request=request, action=action, format_kwarg=None, args=(), kwargs={})
+
+    def test_views(self):
+        board_view = self.get_view(BoardViewSet)
+        self.assertNoFullScan(board_view.get_queryset())
+        self.assertNoFullScan(board_view.get_list_versions(board_view.get_queryset()))
+        for card_view in [self.get_view(CardViewSet), self.get_view(CardViewSet, board=self.board.id)]:
+            self.assertNoFullScan(card_view.get_queryset())
+            self.assertNoFullScan(card_view.get_list_versions(card_view.get_queryset()))
+        # The inbox, then pages of a board history
+        self.assertNoFullScan(self.get_view(MessageViewSet, 'latest_messages').get_latest_messages())
+        messages = self.get_view(MessageViewSet, board=self.board.id).get_queryset()
+        paginator = MessageCursorPagination()
+        middle = Message.objects.filter(board=self.board).order_by('id')[self.MESSAGES_PER_BOARD // 2]
+        position = (middle.date_sent, middle.id)
+        self.assertNoFullScan(paginator.older_than(messages, None)[:paginator.page_size + 1])
+        self.assertNoFullScan(paginator.older_than(messages, position)[:paginator.page_size + 1])
+        self.assertNoFullScan(paginator.newer_than(messages, position)[:paginator.page_size + 1])
+
+    def test_changes_feed(self):
+        paginator = ChangesFeedPagination()
+        paginator.position = (timezone.now(), 1, 0)
+        for index, (name, queryset, field) in enumerate(ChangesView().get_sources(self.user)):
+            self.assertNoFullScan(queryset.filter(paginator.after_position(index, field)).order_by(field, 'id')[:paginator.page_size + 1])
+
+    def test_signals(self):
+        user, board = self.user, self.board
+        self.assertNoFullScan(Card.members.through.objects.filter(card__board=board, theuser_id__in=[user.id]))
+        self.assertNoFullScan(Message.objects.filter(board=board).order_by('-date_sent', '-id').values('id')[:1])
+        self.assertNoFullScan(Board.objects.filter(cards__in=[1, 2, 3]))
+        self.assertNoFullScan(Board.members.through.objects.filter(board=board).values_list('theuser_id'))
+
+    def test_permissions(self):
+        self.assertNoFullScan(Board.members.through.objects.filter(theuser_id=self.user.id).values_list('board_id'))
+        self.assertNoFullScan(Card.members.through.objects.filter(theuser_id=self.user.id).values_list('card_id'))
+
+    def test_counters(self):
+        self.assertNoFullScan(
+            Card.objects.filter(board__in=[self.board.id]).values('board_id', 'status').annotate(total=Count('id')).order_by()
+        )
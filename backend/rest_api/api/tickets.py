@@ -0,0 +1,123 @@
+"""
+Tickets of WebSocket connections. AsgiValidateTokenView issues a ticket for the request user, JwtAuthMiddleware
+reads it when a socket connects and consumers delete it when the socket closes.
+The WebSocket side runs on the event loop of the worker: with the Redis cache of production, tickets are read and
+deleted with an async Redis client, other cache backends are called from a thread. Either way the loop keeps
+serving the other sockets during the round trip.
+"""
+import asyncio
+import threading
+import time
+import weakref
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from .metrics import metrics
+
+KEY_PREFIX = 'websocket_auth:'
+
+
+class CacheTicketStore:
+    # Tickets in the default cache, for backends without async client (tests, development)
+
+    def issue(self, ticket, user_id):
+        cache.set(f'{KEY_PREFIX}{ticket}', user_id, settings.WEBSOCKET_TICKET_TIMEOUT)
+
+    async def get(self, ticket):
+        return await sync_to_async(cache.get, thread_sensitive=False)(f'{KEY_PREFIX}{ticket}')
+
+    async def delete(self, ticket):
+        await sync_to_async(cache.delete, thread_sensitive=False)(f'{KEY_PREFIX}{ticket}')
+
+
+class RedisTicketStore:
+    # Tickets as plain keys of a Redis server, the view writes them with a sync client and sockets use async ones
+
+    def __init__(self, url):
+        self.url = url
+        self.lock = threading.Lock()
+        self.client = None
+        # Async clients are bound to the event loop they were created in, and closed with it
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.closers = set()
+
+    def get_client(self):
+        with self.lock:
+            if self.client is None:
+                self.client = redis.Redis.from_url(self.url)
+            return self.client
+
+    def get_async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = self.async_clients[loop] = redis.asyncio.Redis.from_url(self.url)
+            closer = loop.create_task(self.close_with_loop(loop, client))
+            self.closers.add(closer)
+            closer.add_done_callback(self.closers.discard)
+        return client
+
+    async def close_with_loop(self, loop, client):
+        # Waits until the loop cancels its remaining tasks before closing (asyncio.run(), async_to_sync()),
+        # then releases the connections of the client
+        try:
+            await loop.create_future()
+        finally:
+            self.async_clients.pop(loop, None)
+            await client.aclose()
+
+    def issue(self, ticket, user_id):
+        self.get_client().set(f'{KEY_PREFIX}{ticket}', user_id, ex=settings.WEBSOCKET_TICKET_TIMEOUT)
+
+    async def get(self, ticket):
+        value = await self.get_async_client().get(f'{KEY_PREFIX}{ticket}')
+        return int(value) if value is not None else None
+
+    async def delete(self, ticket):
+        await self.get_async_client().delete(f'{KEY_PREFIX}{ticket}')
+
+
+def get_redis_url():
+    # Explicit setting, or the Redis server of the default cache when it is django-redis
+    if settings.WEBSOCKET_TICKET_REDIS_URL:
+        return settings.WEBSOCKET_TICKET_REDIS_URL
+    default = settings.CACHES['default']
+    if default['BACKEND'] == 'django_redis.cache.RedisCache':
+        location = default['LOCATION']
+        return location[0] if isinstance(location, (list, tuple)) else location
+    return None
+
+
+class TicketStores:
+    # Store of the current settings, tests switch cache backends
+    def __init__(self):
+        self.stores = {}
+
+    def get(self):
+        url = get_redis_url()
+        if url not in self.stores:
+            self.stores[url] = RedisTicketStore(url) if url else CacheTicketStore()
+        return self.stores[url]
+
+
+ticket_stores = TicketStores()
+
+
+def issue_ticket(ticket, user_id):
+    ticket_stores.get().issue(ticket, user_id)
+
+
+async def get_ticket_user_id(ticket):
+    # User id of the ticket, None when unknown or expired. Timed as websocket.ticket_lookup.
+    started_at = time.perf_counter()
+    try:
+        return await ticket_stores.get().get(ticket)
+    finally:
+        metrics.observe('websocket.ticket_lookup', time.perf_counter() - started_at)
+
+
+async def delete_ticket(ticket):
+    if ticket:
+        await ticket_stores.get().delete(ticket)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import BoardViewSet, CardViewSet, TheUserViewSet, SignupView, MessageViewSet
+from .views import BoardViewSet, CardViewSet, TheUserViewSet, MessageViewSet, ChangesView, SearchView, MetricsView
 import pprint
 
 router = DefaultRouter()
@@ -9,4 +9,8 @@ router.register(r'cards', CardViewSet, basename='cards')
 router.register(r'users', TheUserViewSet, basename='users')
 router.register(r'messages', MessageViewSet, basename='users')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = router.urls + [
+    path('changes/', ChangesView.as_view(), name='changes'),
+    path('search/', SearchView.as_view(), name='search'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+]
\ No newline at end of file
@@ -1,64 +1,347 @@
 from rest_framework import viewsets
-from .models import Board, Card, TheUser, Message
-from .serializers import BoardSerializer, CardSerializer, TheUserSerializer, SignInSerializer, MessageSerializer
+from .models import Board, Card, CardPriority, CardStatus, TheUser, Message, MessageArchive, Tombstone, TombstoneKind, SearchKind
+from .archive import find_archived_message, read_archive
+from .search import index_documents, search
+from .membership import get_membership, to_id
+from .authentication import get_full_user
+from django.http import Http404
+from .serializers import BoardSerializer, CardBulkSerializer, CardSerializer, TheUserSerializer, SignInSerializer, MessageSerializer
 from rest_framework import generics, status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated, SAFE_METHODS
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from .permissions import *
-from rest_framework_simplejwt.views import TokenObtainPairView
-from django.db import IntegrityError
-from django.db.models import Max, Subquery, OuterRef, Q
+from .pagination import MessageCursorPagination, ChangesFeedPagination
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.contrib.auth.models import update_last_login
+from asgiref.sync import sync_to_async
+from .hashing import PoolFull, hash_password, verify_password
+from .metrics import metrics
+from .tickets import issue_ticket
+from .renderers import FastJSONRenderer, loads
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Max, Subquery, OuterRef, Q, prefetch_related_objects
+from django.db.models.functions import Coalesce
 from rest_framework.exceptions import ValidationError, PermissionDenied
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 from rest_framework.decorators import action
 from uuid import uuid4
 from django.core.cache import cache
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from django.utils import timezone
+from django.conf import settings
+from hashlib import md5
+from collections import Counter, defaultdict
+from .signals import cards_bulk_updated
+from .caching import BOARD_IDS_TIMEOUT, BOARD_LIST_TIMEOUT, board_ids_key, get_board_list_key, get_or_build
 
 
 
-class SignInView(TokenObtainPairView):
-    serializer_class = SignInSerializer
+def api_response(data, status_code, headers=None):
+    # DRF response returned by the plain Django async views below, rendered as the API views' responses
+    response = Response(data, status=status_code, headers=headers)
+    response.accepted_renderer = FastJSONRenderer()
+    response.accepted_media_type = response.accepted_renderer.media_type
+    response.renderer_context = {}
+    return response
 
-class SignupView(generics.CreateAPIView):
-    queryset = TheUser.objects.all()
-    permission_classes = (AllowAny,)
-
-    def post(self, request, *args, **kwargs):
-        first_name = request.data.get('first_name')
-        last_name = request.data.get('last_name')
-        password = request.data.get('password')
-        email = request.data.get('email')
 
+def request_data(request):
+    if request.content_type == 'application/json':
         try:
-            user = TheUser.objects.create_user(first_name=first_name, last_name=last_name, password=password, email=email)
-            user.save()
-
-            return Response({"msg": "User created successfully"}, status=status.HTTP_201_CREATED)
-        except IntegrityError as e:
-            if 'email' in str(e):
-                return Response({"err": "Email already exists"}, status=status.HTTP_400_BAD_REQUEST)
-            return Response({"err": "Failed to create user"}, status=status.HTTP_400_BAD_REQUEST)
-        except Exception as e:
-            return Response({"err": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            data = loads(request.body or b'{}')
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+    return request.POST
+
+
+def busy_response():
+    return api_response({"err": "Too many authentication requests, retry later"}, status.HTTP_503_SERVICE_UNAVAILABLE, {'Retry-After': '1'})
 
 
-class BoardViewSet(viewsets.ModelViewSet):
+async def sign_in(request):
+    """
+        post:
+            Refresh and access tokens of the user with this email and password.
+            The password is checked in the password hashing pool (see api/hashing.py), 503 when it is full.
+    """
+    if request.method != 'POST':
+        return api_response({"detail": f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+    data = request_data(request)
+    if data is None:
+        return api_response({"detail": "JSON parse error"}, status.HTTP_400_BAD_REQUEST)
+    errors = {field: ["This field is required."] for field in ('email', 'password') if not data.get(field)}
+    if errors:
+        return api_response(errors, status.HTTP_400_BAD_REQUEST)
+
+    user = await sync_to_async(TheUser.objects.filter(email=data['email']).first)()
+    try:
+        valid = await verify_password(user, data['password'])
+    except PoolFull:
+        return busy_response()
+    if not valid or not user.is_active:
+        return api_response({"detail": "No active account found with the given credentials"}, status.HTTP_401_UNAUTHORIZED)
+
+    if jwt_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(update_last_login)(None, user)
+    refresh = SignInSerializer.get_token(user)
+    return api_response({'refresh': str(refresh), 'access': str(refresh.access_token)}, status.HTTP_200_OK)
+
+
+async def sign_up(request):
+    """
+        post:
+            Create a user from email, first_name, last_name and password.
+            The password is hashed in the password hashing pool (see api/hashing.py), 503 when it is full.
+    """
+    if request.method != 'POST':
+        return api_response({"detail": f'Method "{request.method}" not allowed.'}, status.HTTP_405_METHOD_NOT_ALLOWED)
+    data = request_data(request)
+    if data is None:
+        return api_response({"err": "Failed to create user"}, status.HTTP_400_BAD_REQUEST)
+    email = data.get('email')
+    if not email:
+        return api_response({"err": "Users must have an email address"}, status.HTTP_400_BAD_REQUEST)
+    email = TheUser.objects.normalize_email(email)
+    # Checked first so that known emails do not take a place in the hashing pool, saving checks it again
+    if await sync_to_async(TheUser.objects.filter(email=email).exists)():
+        return api_response({"err": "Email already exists"}, status.HTTP_400_BAD_REQUEST)
+
+    try:
+        password = await hash_password(data.get('password'))
+    except PoolFull:
+        return busy_response()
+    user = TheUser(email=email, first_name=data.get('first_name'), last_name=data.get('last_name'), password=password)
+    try:
+        await sync_to_async(user.save)()
+    except IntegrityError as e:
+        if 'email' in str(e):
+            return api_response({"err": "Email already exists"}, status.HTTP_400_BAD_REQUEST)
+        return api_response({"err": "Failed to create user"}, status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return api_response({"err": str(e)}, status.HTTP_400_BAD_REQUEST)
+    return api_response({"msg": "User created successfully"}, status.HTTP_201_CREATED)
+
+# Token authenticated API, no CSRF cookie involved. csrf_exempt() would turn the views into sync ones.
+sign_in.csrf_exempt = True
+sign_up.csrf_exempt = True
+
+
+class MetricsView(APIView):
+    """
+        get:
+            Metrics of the worker process that answers, for admins.
+    """
+    permission_classes = [IsAdmin]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
+
+
+class ExpandableFieldsViewMixin:
+    """
+    Pass `?expand=` and `?fields=` (comma separated) of read requests to the serializer.
+    Related objects are returned as ids unless expanded.
+    `queryset_relations` maps an expand name ('' for the default output) to the (select_related, prefetch_related)
+    lookups its serialization needs, so that querysets load them up front instead of once per object.
+    """
+    queryset_relations = {}
+
+    def get_query_list(self, param):
+        if self.request is None or self.request.method not in SAFE_METHODS:
+            return None
+        value = self.request.query_params.get(param)
+        if not value:
+            return None
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    def get_serializer(self, *args, **kwargs):
+        for param in ('expand', 'fields'):
+            value = self.get_query_list(param)
+            if value is not None:
+                kwargs.setdefault(param, value)
+        return super().get_serializer(*args, **kwargs)
+
+    def get_relation_lookups(self):
+        # (select_related, prefetch_related) lookups of the requested output
+        expand = self.get_query_list('expand') or []
+        select, prefetch = [], []
+        for name, (select_related, prefetch_related) in self.queryset_relations.items():
+            if name == '' or any(path == name or path.startswith(f'{name}.') for path in expand):
+                select += select_related
+                prefetch += prefetch_related
+        return select, prefetch
+
+    def optimize_queryset(self, queryset):
+        select_related, prefetch_related = self.get_relation_lookups()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def load_relations(self, objects):
+        # Same as optimize_queryset() for objects that do not come from a queryset
+        select_related, prefetch_related = self.get_relation_lookups()
+        prefetch_related_objects(objects, *select_related, *prefetch_related)
+        return objects
+
+
+class BoardVersionETagMixin:
+    """
+    Answer list and retrieve requests with ETag and Last-Modified headers built from the version of the boards
+    the response depends on. A request whose If-None-Match matches gets a 304 response before anything is serialized.
+    Viewsets implement get_list_versions(queryset) and get_object_versions(instance), both returning
+    (board id, version, updated_at) tuples.
+    """
+
+    def list(self, request, *args, **kwargs):
+        versions = self.get_list_versions(self.filter_queryset(self.get_queryset()))
+        return self.versioned_response(request, versions, lambda: super(BoardVersionETagMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        versions = self.get_object_versions(instance)
+        return self.versioned_response(request, versions, lambda: Response(self.get_serializer(instance).data))
+
+    def versioned_response(self, request, versions, get_response):
+        versions = sorted(versions)
+        # The representation also depends on the user (visible cards) and on the query parameters (expand, fields...)
+        key = f"{request.user.id}|{request.get_full_path()}|{[version[:2] for version in versions]}"
+        etag = quote_etag(md5(key.encode('utf-8')).hexdigest())
+        last_modified = max((int(version[2].timestamp()) for version in versions), default=None)
+        return self.conditional_response(request, etag, last_modified and http_date(last_modified), get_response)
+
+    def conditional_response(self, request, etag, last_modified, get_response):
+        # Only the ETag is validated, Last-Modified has a one second resolution and would hide quick successive changes
+        response = get_conditional_response(request, etag=etag)
+        if response is not None:
+            response = Response(status=response.status_code)
+        else:
+            response = get_response()
+        if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = last_modified
+        return response
+
+
+class BoardViewSet(BoardVersionETagMixin, ExpandableFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsMemberOfBoardOrAdmin]
     queryset = Board.objects.all()
     serializer_class = BoardSerializer
+    queryset_relations = {
+        '': ([], ['members']),
+    }
 
     def get_queryset(self):
         user = self.request.user
         if user.is_admin:
-            return Board.objects.all()
-        return Board.objects.filter(members__in=[user])
+            queryset = Board.objects.all()
+        else:
+            queryset = Board.objects.filter(members__in=[user])
+        return self.optimize_queryset(queryset)
+
+    def get_list_versions(self, queryset):
+        return queryset.prefetch_related(None).order_by().values_list('id', 'version', 'updated_at')
+
+    def get_object_versions(self, instance):
+        return [(instance.id, instance.version, instance.updated_at)]
+
+    def get_visible_board_ids(self):
+        user = self.request.user
+        key = board_ids_key(user)
+        board_ids = cache.get(key)
+        if board_ids is None:
+            boards = Board.objects.all() if user.is_admin else Board.objects.filter(members__in=[user])
+            board_ids = list(boards.values_list('id', flat=True))
+            cache.set(key, board_ids, BOARD_IDS_TIMEOUT)
+        return board_ids
+
+    def list(self, request, *args, **kwargs):
+        # The serialized list is cached per user and query string, signals invalidate it (see api/caching.py)
+        built = {}
+
+        def build():
+            response = built['response'] = super(BoardViewSet, self).list(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return None
+            return {'data': response.data, 'etag': response['ETag'], 'last_modified': response.get('Last-Modified')}
+
+        key = get_board_list_key(request, self.get_visible_board_ids())
+        entry = get_or_build(key, build, BOARD_LIST_TIMEOUT)
+        if 'response' in built:
+            return built['response']
+        return self.conditional_response(request, entry['etag'], entry['last_modified'], lambda: Response(entry['data']))
+
+    @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
+    def summary(self, request):
+        """
+        get:
+            Overview of the boards of the user for dashboards: card counts by status and by priority,
+            overdue cards (past their due date and not done), member count and date of the last message.
+            Built with one aggregate query whatever the number of boards.
+        """
+        now = timezone.now()
+        members = (
+            Board.members.through.objects.filter(board_id=OuterRef('pk'))
+            .order_by().values('board_id').annotate(total=Count('id')).values('total')
+        )
+        # Counts by status are the counters of the boards, the others are aggregated
+        counts = {f'priority_{value}': Count('cards', filter=Q(cards__priority=value)) for value in CardPriority.values}
+        status_fields = {value: f'{value.lower()}_count' for value in CardStatus.values}
+        user = request.user
+        boards = Board.objects.all()
+        if not user.is_admin:
+            boards = boards.filter(id__in=Board.members.through.objects.filter(theuser_id=user.id).values('board_id'))
+        boards = (
+            boards
+            .annotate(
+                overdue_count=Count('cards', filter=Q(cards__due_date__lt=now) & ~Q(cards__status=CardStatus.DONE)),
+                member_count=Coalesce(Subquery(members), 0),
+                last_message_at=F('last_message__date_sent'),
+                **counts,
+            )
+            .values('id', 'name', 'progress', 'due_date', 'overdue_count', 'member_count', 'last_message_at', *status_fields.values(), *counts)
+            .order_by('id')
+        )
+
+        results = []
+        totals = {'boards': 0, 'cards': 0, 'overdue': 0, 'by_status': Counter(), 'by_priority': Counter()}
+        for board in boards:
+            by_status = {value: board[field] for value, field in status_fields.items()}
+            by_priority = {value: board[f'priority_{value}'] for value in CardPriority.values}
+            board['card_count'] = sum(by_status.values())
+            results.append({
+                'id': board['id'],
+                'name': board['name'],
+                'progress': board['progress'],
+                'due_date': board['due_date'],
+                'members': board['member_count'],
+                'last_message_at': board['last_message_at'],
+                'cards': {
+                    'total': board['card_count'],
+                    'overdue': board['overdue_count'],
+                    'by_status': by_status,
+                    'by_priority': by_priority,
+                },
+            })
+            totals['boards'] += 1
+            totals['cards'] += board['card_count']
+            totals['overdue'] += board['overdue_count']
+            totals['by_status'].update(by_status)
+            totals['by_priority'].update(by_priority)
+
+        totals['by_status'] = {value: totals['by_status'][value] for value in CardStatus.values}
+        totals['by_priority'] = {value: totals['by_priority'][value] for value in CardPriority.values}
+        return Response({'boards': results, 'totals': totals})
 
     def create(self, request, *args, **kwargs):
         try:
-            board = super().create(request, *args, **kwargs)
-            return Response(BoardSerializer(board.data).data, status=status.HTTP_201_CREATED)
+            return super().create(request, *args, **kwargs)
         except PermissionDenied as e:
             return Response({"err": str(e)}, status=status.HTTP_403_FORBIDDEN)
         except ValidationError as e:
@@ -84,9 +367,13 @@ class BoardViewSet(viewsets.ModelViewSet):
 
 
 
-class CardViewSet(viewsets.ModelViewSet):
+class CardViewSet(BoardVersionETagMixin, ExpandableFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsAdminOrCardMember]
     serializer_class = CardSerializer
+    queryset_relations = {
+        '': ([], ['members']),
+        'board_details': (['board'], ['board__members']),
+    }
 
     def get_queryset(self):
         user = self.request.user
@@ -98,13 +385,18 @@ class CardViewSet(viewsets.ModelViewSet):
         board_id = self.request.query_params.get('board', None)
         if board_id is not None:
             queryset = queryset.filter(board_id=board_id)
-        return queryset
+        return self.optimize_queryset(queryset)
+
+    def get_list_versions(self, queryset):
+        boards = Board.objects.filter(id__in=queryset.prefetch_related(None).order_by().values('board_id'))
+        return boards.values_list('id', 'version', 'updated_at')
+
+    def get_object_versions(self, instance):
+        return Board.objects.filter(id=instance.board_id).values_list('id', 'version', 'updated_at')
 
     def create(self, request, *args, **kwargs):
         try:
-            response = super().create(request, *args, **kwargs)
-            self.update_board_progress(response.data['board_details']['id'])
-            return response
+            return super().create(request, *args, **kwargs)
         except PermissionDenied as e:
             return Response({"err": str(e)}, status=status.HTTP_403_FORBIDDEN)
         except ValidationError as e:
@@ -116,9 +408,7 @@ class CardViewSet(viewsets.ModelViewSet):
 
     def update(self, request, *args, **kwargs):
         try:
-            response = super().update(request, *args, **kwargs)
-            self.update_board_progress(response.data['board_details']['id'])
-            return response
+            return super().update(request, *args, **kwargs)
         except PermissionDenied as e:
             return Response({"err": str(e)}, status=status.HTTP_403_FORBIDDEN)
         except ValidationError as e:
@@ -128,58 +418,185 @@ class CardViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({"err": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-    def perform_create(self, serializer):
-        card = serializer.save()
-        self.update_board_members(card)
-
     def perform_update(self, serializer):
+        previous_board_id = serializer.instance.board_id
         card = serializer.save()
-        self.update_board_members(card)
-
-
-    def update_board_members(self, card):
-        board = card.board
-        # Get all cards for this board
-        board_cards = Card.objects.filter(board=board)
-        
-        # Get all users who are members of any card in this board
-        card_members = set()
-        for board_card in board_cards:
-            card_members.update(board_card.members.all())
-        
-        # Update the board's members
-        board.members.set(card_members)
-        board.save()
-
-    def update_board_progress(self, board_id):
-        board = Board.objects.get(id=board_id)
-        total_cards = Card.objects.filter(board=board).count()
-        completed_cards = Card.objects.filter(board=board, status='DONE').count()
-        
-        if total_cards > 0:
-            progress = (completed_cards / total_cards) * 100
-        else:
-            progress = 0
-        
-        board.progress = round(progress, 2)
-        board.save()
-
-
-
-class TheUserViewSet(viewsets.ModelViewSet):
+        # Board members follow card members through signals, only a card moved to another board needs extra work
+        if card.board_id != previous_board_id:
+            self.update_board_members(card, previous_board_id)
+
+    @action(detail=False, methods=['POST'])
+    def bulk(self, request):
+        """
+        post:
+            Create (items without id) and update (items with id) many cards at once.
+            All cards are validated together and written in one transaction, board aggregates are updated
+            once per board and one event is sent per board.
+        """
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({"err": "Expected a list of cards"}, status=status.HTTP_400_BAD_REQUEST)
+
+        ids = [item.get('id') for item in items if isinstance(item, dict) and 'id' in item]
+        board_ids = [item.get('board') for item in items if isinstance(item, dict) and 'board' in item]
+        try:
+            ids = [int(card_id) for card_id in ids]
+            instances = self.get_queryset().in_bulk(ids)
+        except (TypeError, ValueError):
+            return Response({"err": "Invalid card id"}, status=status.HTTP_400_BAD_REQUEST)
+        # A card listed twice would be written twice from one instance, which breaks board counters
+        repeated_ids = {card_id for card_id, count in Counter(ids).items() if count > 1}
+        # One query for the boards and one for the titles of all items
+        context = {**self.get_serializer_context(), 'boards': Board.objects.in_bulk({to_id(board_id) for board_id in board_ids} - {None})}
+        # Titles of another type are left to the serializer
+        titles = Counter(item['title'] for item in items if isinstance(item, dict) and isinstance(item.get('title'), str) and item['title'])
+        taken_titles = dict(Card.objects.filter(title__in=list(titles)).values_list('title', 'id'))
+
+        serializers, errors = [], []
+        for item in items:
+            if not isinstance(item, dict):
+                serializers.append(None)
+                errors.append({'non_field_errors': ['Expected a card']})
+                continue
+            if 'id' in item:
+                instance = instances.get(int(item['id']))
+                if instance is None:
+                    serializers.append(None)
+                    errors.append({'id': ['Card not found']})
+                    continue
+                if instance.id in repeated_ids:
+                    serializers.append(None)
+                    errors.append({'id': ['Card listed more than once']})
+                    continue
+                serializer = CardBulkSerializer(instance, data=item, partial=True, context=context)
+            else:
+                instance = None
+                serializer = CardBulkSerializer(data=item, context=context)
+            serializer.is_valid()
+            item_errors = dict(serializer.errors)
+            title = item.get('title') if isinstance(item.get('title'), str) else None
+            if title and titles[title] > 1:
+                item_errors['title'] = ['Card title used more than once']
+            elif title in taken_titles and (instance is None or taken_titles[title] != instance.id):
+                item_errors['title'] = ['card with this title already exists.']
+            serializers.append(serializer)
+            errors.append(item_errors)
+
+        if any(errors):
+            return Response({"err": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        cards = self.perform_bulk_write(serializers)
+        prefetch_related_objects(cards, 'members')
+        return Response(self.get_serializer(cards, many=True).data)
+
+    def perform_bulk_write(self, serializers):
+        created, updated, update_fields, previous, emails = [], [], set(), {}, []
+        for serializer in serializers:
+            data = dict(serializer.validated_data)
+            card_emails = data.pop('emails', None)
+            card = serializer.instance
+            if card is None:
+                card = Card(**data)
+                created.append(card)
+            else:
+                previous[card.id] = (card.board_id, card.status)
+                for attr, value in data.items():
+                    setattr(card, attr, value)
+                update_fields.update(data)
+                updated.append(card)
+            # Like CardSerializer, an empty email list leaves members unchanged
+            if card_emails:
+                emails.append((card, card_emails))
+
+        with transaction.atomic():
+            if created:
+                Card.objects.bulk_create(created)
+                if created[0].id is None:
+                    # Ids of bulk inserted rows are not returned by every database (MySQL), titles are unique
+                    created_ids = dict(Card.objects.filter(title__in=[card.title for card in created]).values_list('title', 'id'))
+                    for card in created:
+                        card.id = created_ids[card.title]
+            if updated:
+                # bulk_update() skips auto_now fields
+                now = timezone.now()
+                for card in updated:
+                    card.updated_at = now
+                Card.objects.bulk_update(updated, update_fields | {'updated_at'})
+            cards = created + updated
+
+            # Users whose board membership has to be checked again, per board
+            touched_members = defaultdict(set)
+            through = Card.members.through
+            moved_ids = [card.id for card in updated if card.board_id != previous[card.id][0]]
+            replaced_ids = {card.id for card, _ in emails}
+            old_members = list(through.objects.filter(card_id__in=set(moved_ids) | replaced_ids).values_list('card_id', 'theuser_id'))
+            boards_by_card = {card.id: card.board_id for card in cards}
+            for card_id, user_id in old_members:
+                touched_members[boards_by_card[card_id]].add(user_id)
+                if card_id in previous:
+                    touched_members[previous[card_id][0]].add(user_id)
+
+            if emails:
+                users = dict(TheUser.objects.filter(
+                    email__in={email for _, card_emails in emails for email in card_emails}
+                ).values_list('email', 'id'))
+                through.objects.filter(card_id__in=replaced_ids).delete()
+                through.objects.bulk_create([
+                    through(card_id=card.id, theuser_id=users[email])
+                    for card, card_emails in emails for email in set(card_emails) if email in users
+                ])
+                new_members = set()
+                for card, card_emails in emails:
+                    touched_members[card.board_id].update(users[email] for email in card_emails if email in users)
+                    new_members.update((card.id, users[email]) for email in card_emails if email in users)
+                # Cards disappear from the changes feed of their removed members
+                Tombstone.record_pairs(TombstoneKind.CARD, [
+                    (card_id, user_id) for card_id, user_id in set(old_members) - new_members if card_id in replaced_ids
+                ])
+
+            # Card counters, progress and version, once per board
+            deltas = defaultdict(Counter)
+            for card in created:
+                deltas[card.board_id][card.status] += 1
+            for card in updated:
+                previous_board_id, previous_status = previous[card.id]
+                deltas[previous_board_id][previous_status] -= 1
+                deltas[card.board_id][card.status] += 1
+            Board.apply_card_changes(deltas, touched_members)
+            index_documents(SearchKind.CARD, cards)
+
+            for card in cards:
+                card.remember_loaded_values()
+            transaction.on_commit(lambda: cards_bulk_updated(cards))
+        return cards
+
+    def update_board_members(self, card, previous_board_id):
+        member_ids = list(card.members.values_list('id', flat=True))
+        card.board.sync_members(member_ids)
+        previous_board = Board.objects.filter(id=previous_board_id).first()
+        if previous_board is not None:
+            previous_board.sync_members(member_ids)
+
+
+class TheUserViewSet(ExpandableFieldsViewMixin, viewsets.ModelViewSet):
     queryset = TheUser.objects.all()
     serializer_class = TheUserSerializer
 
     @action(detail=False, methods=['GET'], permission_classes=[IsAuthenticated])
     def me(self, request):
-        serializer = self.get_serializer(request.user)
+        serializer = self.get_serializer(get_full_user(request.user))
         return Response(serializer.data)
 
 
-class MessageViewSet(viewsets.ModelViewSet):
+class MessageViewSet(ExpandableFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsBoardMemberOrAdminForMessage]
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
+    pagination_class = MessageCursorPagination
+    queryset_relations = {
+        'board': (['board'], ['board__members']),
+        'sent_by': (['sent_by'], []),
+    }
 
     def get_queryset(self):
         user = self.request.user
@@ -191,26 +608,56 @@ class MessageViewSet(viewsets.ModelViewSet):
         board_id = self.request.query_params.get('board', None)
         if board_id is not None:
             queryset = queryset.filter(board_id=board_id)
-        return queryset
+        return self.optimize_queryset(queryset)
+
+    def read_archive(self, before=None, after=None, limit=None):
+        # Archived messages are part of the history of a board, see api/archive.py
+        board_id = to_id(self.request.query_params.get('board'))
+        if board_id is None:
+            return []
+        segments = MessageArchive.objects.filter(board_id=board_id)
+        if not self.request.user.is_admin:
+            segments = segments.filter(board__members__in=[self.request.user])
+        return self.load_relations(read_archive(segments, before=before, after=after, limit=limit))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        # Only the messages of the table, archived ones are read by pages walking back past them
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+            message = find_archived_message(to_id(self.kwargs.get(self.lookup_field)))
+            if message is None or not get_membership(self.request).can_access_board(message.board_id):
+                raise
+            return self.load_relations([message])[0]
 
 
+    def get_latest_messages(self):
+        user = self.request.user
+        if user.is_admin:
+            boards = Board.objects.all()
+        else:
+            boards = Board.objects.filter(members__in=[user])
+
+        # Every board points to its last message, so the whole inbox is read in one query
+        return self.optimize_queryset(
+            Message.objects.filter(id__in=boards.values('last_message')).order_by('-date_sent', '-id')
+        )
+
     @action(detail=False, methods=['GET'])
     def latest_messages(self, request):
         try:
-            user = request.user
-            if user.is_admin:
-                board_ids = Board.objects.values_list('id', flat=True)
-            else:
-                board_ids = Board.objects.filter(members__in=[user]).values_list('id', flat=True)
-            
-            latest_messages = []
-            
-            for board_id in board_ids:
-                latest_message = Message.objects.filter(board_id=board_id).order_by('-date_sent').first()
-                if latest_message:
-                    latest_messages.append(latest_message)
-            
-            serializer = self.get_serializer(latest_messages, many=True)
+            serializer = self.get_serializer(self.get_latest_messages(), many=True)
             return Response(serializer.data)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -219,6 +666,115 @@ class MessageViewSet(viewsets.ModelViewSet):
 
 
 
+class ChangesView(APIView):
+    """
+        get:
+            Boards, cards and messages created, updated or deleted after the `since` sync token, oldest first.
+            Without token the feed starts from the beginning. Keep reading with the returned sync_token while
+            has_more is true. A deleted board also removes its cards and messages on the client, and a board
+            that shows up for the first time has its history loaded from the messages endpoint.
+            A token older than the tombstone retention gets a 410 response and requires a full reload.
+    """
+    permission_classes = [IsAuthenticated]
+    pagination_class = ChangesFeedPagination
+
+    def get_sources(self, user):
+        if user.is_admin:
+            boards = Board.objects.all()
+            cards = Card.objects.all()
+            messages = Message.objects.all()
+            tombstones = Tombstone.objects.filter(user=None)
+        else:
+            boards = Board.objects.filter(members__in=[user])
+            cards = Card.objects.filter(members__in=[user])
+            messages = Message.objects.filter(board__members__in=[user])
+            tombstones = Tombstone.objects.filter(Q(user=None) | Q(user=user))
+        return [
+            ('boards', boards.prefetch_related('members'), 'updated_at'),
+            ('cards', cards.prefetch_related('members'), 'updated_at'),
+            ('messages', messages, 'updated_at'),
+            ('deleted', tombstones, 'deleted_at'),
+        ]
+
+    def get(self, request, *args, **kwargs):
+        paginator = self.pagination_class()
+        position = paginator.decode_token(request.query_params.get(paginator.since_query_param))
+        retention = timezone.timedelta(days=settings.SYNC_TOMBSTONE_RETENTION_DAYS)
+        if position is not None and position[0] < timezone.now() - retention:
+            return Response({"err": "Sync token expired, reload everything"}, status=status.HTTP_410_GONE)
+
+        rows = paginator.paginate_sources(self.get_sources(request.user), request)
+
+        # Only the last change of an object in the page matters, so upserts and deletions can be grouped
+        latest, seen = [], set()
+        for name, obj in reversed(rows):
+            key = (f"{obj.kind}s", obj.object_id) if name == 'deleted' else (name, obj.id)
+            if key not in seen:
+                seen.add(key)
+                latest.append((name, obj))
+        changes = defaultdict(list)
+        for name, obj in reversed(latest):
+            changes[name].append(obj)
+
+        context = {'request': request, 'view': self}
+        deleted = {'boards': [], 'cards': [], 'messages': []}
+        for tombstone in changes['deleted']:
+            deleted[f"{tombstone.kind}s"].append(tombstone.object_id)
+        return Response({
+            'sync_token': paginator.token,
+            'has_more': paginator.has_more,
+            'boards': BoardSerializer(changes['boards'], many=True, context=context).data,
+            'cards': CardSerializer(changes['cards'], many=True, context=context).data,
+            'messages': MessageSerializer(changes['messages'], many=True, context=context).data,
+            'deleted': deleted,
+        })
+
+
+class SearchView(APIView):
+    """
+        get:
+            Full-text search over the titles and descriptions of cards and the content of messages the user can see.
+            Query parameters:
+            - q: words to search, documents must contain all of them (case and accents are ignored)
+            - type: `cards` or `messages` to only search one of them
+            - board: id of the board to search in
+            - limit: number of results, 20 by default and 50 at most
+            Results are ranked, their highlights are escaped snippets with the matching words in <mark> tags.
+    """
+    permission_classes = [IsAuthenticated]
+    max_limit = 50
+    kinds = {'cards': SearchKind.CARD, 'messages': SearchKind.MESSAGE}
+    serializer_classes = {SearchKind.CARD: CardSerializer, SearchKind.MESSAGE: MessageSerializer}
+
+    def get(self, request, *args, **kwargs):
+        params = request.query_params
+        query = params.get('q', '').strip()
+        if not query:
+            return Response({"err": "Missing search query"}, status=status.HTTP_400_BAD_REQUEST)
+        kind = params.get('type')
+        if kind is not None and kind not in self.kinds:
+            return Response({"err": "Search type must be cards or messages"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            board_id = int(params['board']) if params.get('board') else None
+            limit = min(max(int(params.get('limit', 20)), 1), self.max_limit)
+        except ValueError:
+            return Response({"err": "Invalid board or limit"}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = search(get_membership(request), query, kinds=[self.kinds[kind]] if kind else None, board_id=board_id, limit=limit)
+        context = {'request': request, 'view': self}
+        return Response({'results': [
+            {
+                'type': kind,
+                'id': obj.id,
+                'board': obj.board_id,
+                'score': round(score, 4),
+                'highlights': highlights,
+                'object': self.serializer_classes[kind](obj, context=context).data,
+            }
+            for kind, obj, score, highlights in results
+        ]})
+
+
 class AsgiValidateTokenView(APIView):
     """
         get:
@@ -228,8 +784,6 @@ class AsgiValidateTokenView(APIView):
     def get(self, request, *args, **kwargs):
         
         ticket_uuid = uuid4()
-        user_id = request.user.id
-        cache_key = f"websocket_auth:{ticket_uuid}"
-        cache.set(cache_key, user_id, 86400) # timeout 24h
+        issue_ticket(ticket_uuid, request.user.id) # timeout WEBSOCKET_TICKET_TIMEOUT
 
         return Response({'uuid': ticket_uuid})
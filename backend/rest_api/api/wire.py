@@ -0,0 +1,86 @@
+"""
+Wire formats of WebSocket frames, chosen by the client when it connects: with a WebSocket subprotocol
+(Sec-WebSocket-Protocol: msgpack) or with the format query parameter (?format=msgpack).
+- json, the default: text frames, boards and users embedded in every frame.
+- msgpack: binary MessagePack frames, available when msgpack is installed. Boards and users are sent by id,
+  a connection gets each of them once, in the "refs" of the first frame referring to it and again after it changed.
+Clients may send either text JSON or binary frames of their format.
+"""
+from urllib.parse import parse_qsl
+from .renderers import dumps, loads
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Keys of frames holding a board or a user, and the refs they go to in compact frames
+REFERENCES = {'board': 'boards', 'sent_by': 'users'}
+
+
+class JSONWire:
+    name = 'json'
+
+    def encode(self, frame):
+        return {'text_data': dumps(frame)}
+
+    def decode(self, text_data=None, bytes_data=None):
+        return loads(text_data if text_data is not None else bytes_data)
+
+
+class MessagePackWire:
+    name = 'msgpack'
+
+    def __init__(self):
+        # refs name -> id -> last sent version
+        self.sent = {refs: {} for refs in REFERENCES.values()}
+
+    def encode(self, frame):
+        refs = {}
+        frame = self.compact(frame, refs)
+        if refs:
+            frame['refs'] = refs
+        return {'bytes_data': msgpack.packb(frame, use_bin_type=True)}
+
+    def compact(self, value, refs):
+        # Boards and users replaced by their id, the ones the connection does not know yet are added to refs
+        if isinstance(value, list):
+            return [self.compact(item, refs) for item in value]
+        if not isinstance(value, dict):
+            return value
+        compacted = {}
+        for key, item in value.items():
+            if key in REFERENCES and isinstance(item, dict) and 'id' in item:
+                sent = self.sent[REFERENCES[key]]
+                if sent.get(item['id']) != item:
+                    sent[item['id']] = item
+                    refs.setdefault(REFERENCES[key], []).append(item)
+                compacted[key] = item['id']
+            else:
+                compacted[key] = self.compact(item, refs)
+        return compacted
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is not None:
+            return msgpack.unpackb(bytes_data, raw=False)
+        return loads(text_data)
+
+
+def available_formats():
+    return ['msgpack', 'json'] if msgpack is not None else ['json']
+
+
+def negotiate(scope):
+    """
+    Wire format of a connection and the subprotocol to accept it with, None when the client asked for none.
+    """
+    formats = available_formats()
+    for subprotocol in scope.get('subprotocols') or []:
+        if subprotocol in formats:
+            return get_wire(subprotocol), subprotocol
+    requested = dict(parse_qsl(scope.get('query_string', b'').decode('utf-8'))).get('format')
+    return get_wire(requested if requested in formats else 'json'), None
+
+
+def get_wire(name):
+    return MessagePackWire() if name == 'msgpack' else JSONWire()
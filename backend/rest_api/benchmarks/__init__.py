@@ -0,0 +1,5 @@
+"""
+Performance benchmarks of the api app. They run against the test database and print their results:
+
+    python manage.py test benchmarks --pattern="bench_*.py"
+"""
@@ -0,0 +1,63 @@
+import time
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+from api.models import Board, Card, Message, TheUser
+
+BOARDS = 1000
+CARDS_PER_BOARD = 5
+ROUNDS = 3
+
+
+class DashboardSummaryBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = TheUser.objects.create_admin(email='bench-admin@example.com', first_name='Bench', last_name='Admin', password='password')
+        TheUser.objects.bulk_create([
+            TheUser(email=f'bench{i}@example.com', first_name=f'Bench{i}', last_name='User') for i in range(20)
+        ])
+        users = list(TheUser.objects.filter(email__startswith='bench').exclude(id=cls.admin.id))
+        Board.objects.bulk_create([Board(name=f'Benchmark Board {i}') for i in range(BOARDS)])
+        boards = list(Board.objects.all())
+        statuses, priorities = ['TODO', 'DOING', 'BLOCKED', 'DONE'], ['LOW', 'MEDIUM', 'HIGH', 'CRITICAL']
+        Card.objects.bulk_create([
+            Card(title=f'Benchmark Card {board.id}-{i}', board=board, status=statuses[i % 4], priority=priorities[(board.id + i) % 4])
+            for board in boards for i in range(CARDS_PER_BOARD)
+        ])
+        Board.members.through.objects.bulk_create([
+            Board.members.through(board_id=board.id, theuser_id=users[(board.id + i) % len(users)].id)
+            for board in boards for i in range(3)
+        ])
+        Message.objects.bulk_create([Message(board=board, sent_by=users[0], content='Benchmark') for board in boards])
+        latest = {message.board_id: message.id for message in Message.objects.all()}
+        for board in boards:
+            board.last_message_id = latest[board.id]
+        Board.objects.bulk_update(boards, ['last_message'], batch_size=500)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def measure(self, urls):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                for url in urls:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+            elapsed = (time.perf_counter() - start) / ROUNDS
+        return elapsed, len(queries) // ROUNDS
+
+    def test_summary_against_separate_endpoints(self):
+        # Before: the dashboard loaded every board, card and last message and aggregated them itself
+        results = {
+            'boards + cards + latest messages': self.measure([
+                reverse('boards-list'), reverse('cards-list'), reverse('users-latest-messages'),
+            ]),
+            'summary': self.measure([reverse('boards-summary')]),
+        }
+        print(f'\nDashboard of {BOARDS} boards with {CARDS_PER_BOARD} cards each')
+        for label, (elapsed, queries) in results.items():
+            print(f'{label:>34}: {elapsed * 1000:9.2f} ms {queries:5d} queries')
+        self.assertLessEqual(results['summary'][1], 2)
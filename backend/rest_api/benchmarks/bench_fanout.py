@@ -0,0 +1,67 @@
+import asyncio
+import time
+from asgiref.sync import async_to_sync
+from django.test import TestCase
+from unittest import mock
+from api.broadcast import broadcaster, group_send_many, latest_message_sends
+from api.models import Board, Message, TheUser
+from api.signals import get_latest_message_recipients
+
+BOARD_SIZES = [10, 100, 300]
+ADMINS = 5
+# Round trip of a group_send to Redis on the same network
+ROUND_TRIP = 0.0005
+
+
+class SlowChannelLayer:
+    async def group_send(self, group, message):
+        await asyncio.sleep(ROUND_TRIP)
+
+
+class FanOutBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        TheUser.objects.bulk_create([
+            TheUser(email=f'fanout{i}@example.com', first_name=f'Fan{i}', last_name='Out', is_admin=i < ADMINS)
+            for i in range(max(BOARD_SIZES) + ADMINS)
+        ])
+        users = list(TheUser.objects.filter(is_admin=False))
+        cls.boards = []
+        for size in BOARD_SIZES:
+            board = Board.objects.create(name=f'Fan-out Board {size}')
+            board.members.set(users[:size])
+            cls.boards.append(board)
+        cls.sender = users[0]
+
+    def per_member(self, board, message_data, channel_layer):
+        # Before: one blocking send per member, then per admin not in the members (which were queried again)
+        for member in board.members.all():
+            async_to_sync(channel_layer.group_send)(f"user_{member.id}_latest_messages", {"type": "latest_message_update", "message": message_data})
+        for admin in TheUser.objects.filter(is_admin=True):
+            if admin not in board.members.all():
+                async_to_sync(channel_layer.group_send)(f"user_{admin.id}_latest_messages", {"type": "latest_message_update", "message": message_data})
+
+    def batched(self, board, message_data, channel_layer):
+        async_to_sync(group_send_many)(latest_message_sends(message_data, get_latest_message_recipients([board.id])[board.id]), channel_layer)
+
+    def test_fan_out_latency(self):
+        channel_layer = SlowChannelLayer()
+        print(f'\nNew message fan-out, {ROUND_TRIP * 1000:.1f} ms per channel layer round trip, {ADMINS} admins')
+        for board in self.boards:
+            message_data = {'id': 1, 'board': board.to_dict(), 'content': 'Benchmark'}
+            results = {}
+            for label, fan_out in [('per member', self.per_member), ('batched', self.batched)]:
+                start = time.perf_counter()
+                fan_out(board, message_data, channel_layer)
+                results[label] = time.perf_counter() - start
+
+            # What the sender waits for now: the message and its post-commit hook, not the sends
+            with mock.patch('api.broadcast.get_channel_layer', return_value=channel_layer):
+                start = time.perf_counter()
+                with self.captureOnCommitCallbacks(execute=True):
+                    Message.objects.create(board=board, sent_by=self.sender, content='Benchmark')
+                results['sender'] = time.perf_counter() - start
+                broadcaster.wait()
+
+            print(f'{board.members.count():4d} members: ' + '  '.join(f'{label} {elapsed * 1000:8.2f} ms' for label, elapsed in results.items()))
+            self.assertLess(results['batched'], results['per member'])
@@ -0,0 +1,72 @@
+import json
+import time
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from api.models import Board, Message, TheUser
+from api.renderers import CombinedEncoder, FastJSONRenderer, dumps, orjson
+from api.serializers import MessageSerializer
+
+MEMBERS = 50
+MESSAGES = 200
+ROUNDS = 20
+
+
+class JSONEncodingBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        TheUser.objects.bulk_create([
+            TheUser(email=f'bench{i}@example.com', first_name=f'Bench{i}', last_name='User') for i in range(MEMBERS)
+        ])
+        users = list(TheUser.objects.all())
+        board = Board.objects.create(name='Benchmark Board')
+        board.members.set(users)
+        Message.objects.bulk_create([
+            Message(board=board, sent_by=users[i % MEMBERS], content=f'Benchmark message {i} ' * 5) for i in range(MESSAGES)
+        ])
+
+    def setUp(self):
+        self.messages = list(Message.objects.select_related('board', 'sent_by').prefetch_related('board__members'))
+
+    def measure(self, encode, payloads):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for payload in payloads:
+                encode(payload)
+        return (time.perf_counter() - start) / ROUNDS
+
+    def report(self, title, results):
+        print(f'\n{title}')
+        for label, elapsed in results.items():
+            print(f'{label:>24}: {elapsed * 1000:9.2f} ms')
+
+    def test_websocket_frames(self):
+        # Frames sent by signals and consumers: dicts of models with their dates, plus raw datetimes
+        frames = [
+            {
+                'type': 'chat_message',
+                'message': {
+                    'id': message.id,
+                    'board': message.board.to_dict(),
+                    'sent_by': message.sent_by.to_dict(),
+                    'content': message.content,
+                    'date_sent': message.date_sent,
+                    'received_at': timezone.now(),
+                }
+            }
+            for message in self.messages
+        ]
+        results = {'json + CombinedEncoder': self.measure(lambda frame: json.dumps(frame, cls=CombinedEncoder), frames)}
+        if orjson is not None:
+            results['orjson'] = self.measure(dumps, frames)
+        self.report(f'{MESSAGES} WebSocket frames', results)
+        self.assertEqual(json.loads(dumps(frames)), json.loads(json.dumps(frames, cls=CombinedEncoder)))
+
+    def test_rest_responses(self):
+        # Message history pages as returned by the API, with the board and sender expanded
+        pages = [MessageSerializer(self.messages, many=True, expand=['board.members', 'sent_by']).data]
+        results = {'JSONRenderer': self.measure(JSONRenderer().render, pages)}
+        if orjson is not None:
+            results['FastJSONRenderer'] = self.measure(FastJSONRenderer().render, pages)
+        self.report(f'{MESSAGES} messages with {MEMBERS} board members', results)
+        self.assertEqual(FastJSONRenderer().render(pages[0]), JSONRenderer().render(pages[0]))
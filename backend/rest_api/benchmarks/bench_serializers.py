@@ -0,0 +1,42 @@
+import time
+from django.test import TestCase
+from rest_framework.renderers import JSONRenderer
+from api.models import Board, Message, TheUser
+from api.serializers import MessageSerializer
+
+MEMBERS = 200
+MESSAGES = 50
+ROUNDS = 5
+
+
+class MessageSerializationBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        TheUser.objects.bulk_create([
+            TheUser(email=f'bench{i}@example.com', first_name=f'Bench{i}', last_name='User') for i in range(MEMBERS)
+        ])
+        users = list(TheUser.objects.all())
+        board = Board.objects.create(name='Benchmark Board')
+        board.members.set(users)
+        Message.objects.bulk_create([
+            Message(board=board, sent_by=users[i % MEMBERS], content=f'Benchmark message {i}') for i in range(MESSAGES)
+        ])
+
+    def serialize(self, expand):
+        messages = list(Message.objects.select_related('board', 'sent_by').prefetch_related('board__members'))
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            payload = JSONRenderer().render(MessageSerializer(messages, many=True, expand=expand).data)
+        return len(payload), (time.perf_counter() - start) / ROUNDS
+
+    def test_nested_and_flat_messages(self):
+        # Before: every message nested its board and all board members. After: ids unless expanded.
+        results = {
+            'nested (board.members,sent_by)': self.serialize(['board.members', 'sent_by']),
+            'expanded (board,sent_by)': self.serialize(['board', 'sent_by']),
+            'flat (default)': self.serialize([]),
+        }
+        print(f'\n{MESSAGES} messages on a board with {MEMBERS} members')
+        for label, (size, elapsed) in results.items():
+            print(f'{label:>32}: {size / 1024:9.1f} KiB {elapsed * 1000:9.2f} ms')
+        self.assertLess(results['flat (default)'][0], results['nested (board.members,sent_by)'][0])
@@ -0,0 +1,39 @@
+import time
+from django.test import TestCase
+from api.models import Board, Message, TheUser
+from api.signals import get_message_data
+from api.wire import JSONWire, MessagePackWire
+
+MEMBERS = 10
+MESSAGES = 1000
+ROUNDS = 5
+
+
+class WireFormatBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        TheUser.objects.bulk_create([
+            TheUser(email=f'wire{i}@example.com', first_name=f'Wire{i}', last_name='User', password='pbkdf2_sha256$' + 'x' * 80)
+            for i in range(MEMBERS)
+        ])
+        users = list(TheUser.objects.all())
+        board = Board.objects.create(name='Benchmark Board', description='Where the benchmark talks')
+        Message.objects.bulk_create([
+            Message(board=board, sent_by=users[i % MEMBERS], content=f'Benchmark message {i}') for i in range(MESSAGES)
+        ])
+
+    def test_chat_frames(self):
+        # Chat frames of one connection, as sent by ChatConsumer
+        frames = [get_message_data(message) for message in Message.objects.select_related('board', 'sent_by')]
+        print(f'\n{MESSAGES} chat frames from {MEMBERS} senders on one board')
+        results = {}
+        for wire_class in [JSONWire, MessagePackWire]:
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                wire = wire_class()
+                encoded = [next(iter(wire.encode(frame).values())) for frame in frames]
+            elapsed = (time.perf_counter() - start) / ROUNDS
+            size = sum(len(data.encode('utf-8') if isinstance(data, str) else data) for data in encoded)
+            results[wire_class.name] = size
+            print(f'{wire_class.name:>8}: {size / 1024:8.1f} KiB {elapsed * 1000:8.2f} ms')
+        self.assertLess(results['msgpack'], results['json'] / 2)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from unittest import mock
+from api.tickets import get_ticket_user_id
+
+CONNECTIONS = 200
+# Round trip of a cache call to Redis under load
+ROUND_TRIP = 0.002
+HEARTBEAT = 0.001
+
+
+def slow(func):
+    def call(*args, **kwargs):
+        time.sleep(ROUND_TRIP)
+        return func(*args, **kwargs)
+    return call
+
+
+class WebSocketAuthBenchmark(SimpleTestCase):
+    async def blocking_lookup(self, ticket):
+        # Before: JwtAuthMiddleware called the sync cache on the event loop
+        return cache.get(f'websocket_auth:{ticket}')
+
+    async def measure(self, lookup):
+        # A heartbeat task measures how late the loop runs it while the sockets connect
+        stalls, done = [], asyncio.Event()
+
+        async def heartbeat():
+            while not done.is_set():
+                expected = time.perf_counter() + HEARTBEAT
+                await asyncio.sleep(HEARTBEAT)
+                stalls.append(time.perf_counter() - expected)
+
+        beating = asyncio.ensure_future(heartbeat())
+        await asyncio.sleep(0)
+        start = time.perf_counter()
+        results = await asyncio.gather(*(lookup(i) for i in range(CONNECTIONS)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await beating
+        self.assertEqual(results, list(range(CONNECTIONS)))
+        return elapsed, max(stalls or [elapsed])
+
+    def test_event_loop_stalls(self):
+        cache.set_many({f'websocket_auth:{i}': i for i in range(CONNECTIONS)})
+        with mock.patch.object(cache, 'get', slow(cache.get)):
+            results = {
+                'sync cache.get': asyncio.run(self.measure(self.blocking_lookup)),
+                'ticket store': asyncio.run(self.measure(get_ticket_user_id)),
+            }
+        print(f'\n{CONNECTIONS} concurrent WebSocket connects, {ROUND_TRIP * 1000:.1f} ms per cache round trip')
+        for label, (elapsed, stall) in results.items():
+            print(f'{label:>15}: {elapsed * 1000:8.2f} ms total, longest event loop stall {stall * 1000:8.2f} ms')
+        self.assertLess(results['ticket store'][1], results['sync cache.get'][1])
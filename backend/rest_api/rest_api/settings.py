@@ -36,8 +36,39 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=5),
     "ROTATE_REFRESH_TOKENS": True,
+    # Access tokens carry the user fields requests need, refreshing them reads the user again
+    "TOKEN_REFRESH_SERIALIZER": "api.authentication.ClaimsTokenRefreshSerializer",
 }
 
+# Per-process cache of the users needed in full by views (see api/authentication.py)
+AUTH_USER_CACHE_SIZE = 1024
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# Password hashing pool of signup and signin (see api/hashing.py): threads, and jobs running or waiting at most
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_MAX_PENDING = 32
+
+# Chat messages received within CHAT_BATCH_WINDOW seconds are inserted together, up to CHAT_BATCH_SIZE (see api/chat.py).
+# Chat connections keep the board they send to for CHAT_BOARD_SNAPSHOT_TTL seconds.
+CHAT_BATCH_WINDOW = 0.005
+CHAT_BATCH_SIZE = 100
+CHAT_BOARD_SNAPSHOT_TTL = 30
+# WebSocket tickets (see api/tickets.py): lifetime in seconds, Redis server read with an async client.
+# None uses the Redis server of the default cache when it is django-redis, or the cache itself otherwise.
+WEBSOCKET_TICKET_TIMEOUT = 86400
+WEBSOCKET_TICKET_REDIS_URL = None
+# Boards a multiplexed connection can subscribe to at once (see MultiplexConsumer), and seconds between two reloads
+# of the boards of its user when a subscription is refused
+MULTIPLEX_MAX_BOARDS = 200
+MULTIPLEX_MEMBERSHIP_RELOAD_INTERVAL = 5
+# Frames waiting to be written to a socket before its client is disconnected as too slow (see api/outbound.py)
+WEBSOCKET_QUEUE_MAX_SIZE = 256
+
+# Channel layer sends in flight at once when notifying many groups (see api/broadcast.py)
+BROADCAST_CONCURRENCY = 100
+# Status changes of a card within this many seconds are sent as one event
+CARD_EVENT_WINDOW = 0.05
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -62,11 +93,23 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.ClaimsJWTAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'JSON_ENCODER': 'django.core.serializers.json.DjangoJSONEncoder'
 }
 
+# JSON library of API responses and WebSocket frames: 'orjson' when it is installed, or 'json'
+API_JSON_BACKEND = 'orjson'
+
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
@@ -196,6 +239,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
 
+# Tombstones of the changes feed are kept this long, older sync tokens require a full reload
+SYNC_TOMBSTONE_RETENTION_DAYS = 30
+
+# Messages older than this are moved to compressed archive segments by the archive_messages command
+MESSAGE_ARCHIVE_AFTER_DAYS = 180
+MESSAGE_ARCHIVE_SEGMENT_SIZE = 500
+
 # In your settings.py file
 
 LOGGING = {
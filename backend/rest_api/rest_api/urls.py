@@ -21,14 +21,14 @@ from rest_framework_simplejwt.views import (
     TokenRefreshView,
     TokenVerifyView
 )
-from api.views import SignupView, SignInView, AsgiValidateTokenView
+from api.views import sign_up, sign_in, AsgiValidateTokenView
 
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/',include('api.urls')),
-    path('api/signup/', SignupView.as_view(), name='signup'),
-    path('api/signin/', SignInView.as_view(), name='get_token'),
+    path('api/signup/', sign_up, name='signup'),
+    path('api/signin/', sign_in, name='get_token'),
     path('api/signin/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/signin/verify/', TokenVerifyView.as_view(), name='token_verify'),
     path('api/ws_auth_uuid/', AsgiValidateTokenView.as_view(), name='get_ws_auth_uuid')
@@ -168,7 +168,7 @@ class Api {
   /// Fetch cards for a specific board
   Future<List<Map<String, dynamic>>> fetchCards({required int boardId}) async {
     try {
-      final response = await get('/cards/?board=$boardId');
+      final response = await get('/cards/?board=$boardId&expand=members');
       return _convertToList(response);
     } catch (e) {
       throw _handleApiException(e, "Failed to fetch the board's cards");
@@ -230,7 +230,7 @@ class Api {
   /// Fetch messages for a specific board
   Future<List<Map<String, dynamic>>> fetchBoardMessages({required int boardId}) async {
     try {
-      final response = await get('/messages/?board=$boardId');
+      final response = await get('/messages/?board=$boardId&expand=board,sent_by');
       return _convertToList(response);
     } catch (e) {
       throw _handleApiException(e, "Failed to fetch messages");
@@ -240,7 +240,7 @@ class Api {
   /// Fetch latest messages across all boards
   Future<List<Map<String, dynamic>>> fetchLatestMessages() async {
     try {
-      final response = await get('/messages/latest_messages/');
+      final response = await get('/messages/latest_messages/?expand=board,sent_by');
       return _convertToList(response);
     } catch (e) {
       throw _handleApiException(e, "Failed to fetch latest messages");